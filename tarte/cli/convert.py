@@ -4,6 +4,8 @@ import os
 import csv
 import re
 
+from tarte.utils.compression import open_file, strip_compression
+
 numb = re.compile(r"^(\w+)(\d+)$")
 
 
@@ -13,7 +15,10 @@ def make_parser(*args, instantiator, **kwargs):
                                      **kwargs)
 
     parser.add_argument("output_dir", help="If set, directory where data should be saved", type=str)
-    parser.add_argument("files", nargs="+", help="Files that should be dispatched for Tarte", type=str)
+    parser.add_argument("files", nargs="+", help="Files that should be dispatched for Tarte, which may be compressed"
+                                                 " (.gz, .bz2, .xz)", type=str)
+    parser.add_argument("--compress", choices=["gz", "bz2", "xz"], default=None,
+                        help="Compress the output files, which are otherwise compressed as their input")
     return parser
 
 
@@ -32,9 +37,11 @@ def main(args):
 
     for file in args.files:
         name = os.path.basename(file)
-        with open(os.path.join(args.output_dir, name), "w") as out:
+        if args.compress:
+            name = "{}.{}".format(strip_compression(name), args.compress)
+        with open_file(os.path.join(args.output_dir, name), "w") as out:
             writer = csv.writer(out, delimiter="\t")
-            with open(file) as inp:
+            with open_file(file) as inp:
                 for ind, line in enumerate(csv.reader(inp, delimiter="\t")):
 
                     if ind == 0:
@@ -0,0 +1,15 @@
+from tarte.modules.mapped import convert, is_mapped
+
+
+def make_parser(*args, instantiator=None, **kwargs):
+    parser = instantiator(*args, description="Convert a model between the .tar format and the memory-mappable v2 format",
+                          help="Convert a .tar model to the memory-mappable v2 format, or back", **kwargs)
+    parser.add_argument("source", help="Model to convert, the direction depends on its format")
+    parser.add_argument("destination", help="Path of the converted model")
+    return parser
+
+
+def main(args):
+    source_format = "v2" if is_mapped(args.source) else ".tar"
+    destination = convert(args.source, args.destination)
+    print("Converted {} model {} to {}".format(source_format, args.source, destination))
@@ -18,6 +18,8 @@ def make_parser(*args, instantiator, **kwargs):
     parser.add_argument("settings", help="Settings files as json", type=argparse.FileType())
     parser.add_argument("files", nargs="+", help="Files that should be dispatched for Tarte", type=str)
     parser.add_argument("--output", help="If set, directory where data should be saved", type=str, default=None)
+    parser.add_argument("--compress", choices=["gz", "bz2", "xz"], default=None,
+                        help="If set, compress the files saved to --output")
     parser.add_argument("--table", help="If set, save a table of disambiguation", default=False)
     parser.add_argument("--verbose", help="If set, save a table of disambiguation", action="store_true", default=False)
     return parser
@@ -30,4 +32,4 @@ def main(args):
     spl = Splitter(settings=Settings(json.loads(json_minify.json_minify(args.settings.read()))), files=args.files)
     spl.scan(table=args.table)
     if args.output:
-        spl.dispatch(args.output)
+        spl.dispatch(args.output, compress=args.compress)
@@ -0,0 +1,45 @@
+import argparse
+import json
+
+from pie.settings import Settings
+
+from tarte.modules.models import TarteModule
+from tarte.modules.export import export
+from tarte.modules.quantization import quantize, compare_scores, print_comparison
+from tarte.utils.reader import ReaderWrapper
+from tarte.utils.datasets import Dataset
+
+
+def make_parser(*args, instantiator=None, **kwargs):
+    parser = instantiator(*args, description="Export a model for the torch-only runtime",
+                          help="Export a model as a TorchScript forward and a vocabulary file, "
+                               "to be used with tarte.runtime.TarteRuntime", **kwargs)
+    parser.add_argument("model", help="Model to export")
+    parser.add_argument("output", help="Directory to write the exported model to")
+    parser.add_argument("--quantize", action="store_true", default=False,
+                        help="Use dynamic int8 quantization of the linear layers (CPU only)")
+    parser.add_argument("--quantize-embeddings", dest="quantize_embeddings", action="store_true", default=False,
+                        help="With --quantize, also store the embeddings in 8 bits")
+    parser.add_argument("--test", default=None, type=argparse.FileType(),
+                        help="With --quantize, settings file whose test_path is used to compare "
+                             "the quantized model to the float one")
+    return parser
+
+
+def main(args):
+    model = TarteModule.load(args.model)
+
+    if args.quantize:
+        quantized = quantize(model, embeddings=args.quantize_embeddings)
+
+        if args.test:
+            settings = Settings(json.load(args.test))
+            testset = Dataset(settings, ReaderWrapper(settings, settings["test_path"],
+                                                      context_window=model.context_window), model.label_encoder)
+            print("Comparing the quantized model to the float one on {}".format(settings["test_path"]))
+            print_comparison(compare_scores(model, quantized, testset))
+
+        model = quantized
+
+    directory = export(model, args.output)
+    print("Model exported to {}".format(directory))
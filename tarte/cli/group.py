@@ -3,6 +3,10 @@ from .dataset import main as dataset, make_parser as make_dataset_parser
 from .train import main as train, make_parser as make_train_parser
 from .test import main as test, make_parser as make_test_parser
 from .convert import main as convert, make_parser as make_convert_parser
+from .tag import main as tag, make_parser as make_tag_parser
+from .serve import main as serve, make_parser as make_serve_parser
+from .export import main as export, make_parser as make_export_parser
+from .convert_model import main as convert_model, make_parser as make_convert_model_parser
 
 
 def main():
@@ -21,5 +25,17 @@ def main():
     cli_test = make_test_parser("test", instantiator=subparsers.add_parser)
     cli_test.set_defaults(function=test)
 
+    cli_tag = make_tag_parser("tag", instantiator=subparsers.add_parser)
+    cli_tag.set_defaults(function=tag)
+
+    cli_serve = make_serve_parser("serve", instantiator=subparsers.add_parser)
+    cli_serve.set_defaults(function=serve)
+
+    cli_export = make_export_parser("export", instantiator=subparsers.add_parser)
+    cli_export.set_defaults(function=export)
+
+    cli_convert_model = make_convert_model_parser("convert-model", instantiator=subparsers.add_parser)
+    cli_convert_model.set_defaults(function=convert_model)
+
     args = parser.parse_args()
     args.function(args)
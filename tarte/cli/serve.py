@@ -0,0 +1,30 @@
+from tarte.tagger import Tagger
+from tarte.server import DisambiguationServer
+
+
+def make_parser(*args, instantiator=None, **kwargs):
+    parser = instantiator(*args, description="Serve a model over HTTP",
+                          help="Serve a model over HTTP with dynamic batching", **kwargs)
+    parser.add_argument("model", help="Model to serve")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on", type=str)
+    parser.add_argument("--port", default=8888, help="Port to listen on", type=int)
+    parser.add_argument("--max-batch-size", dest="max_batch_size", default=256, type=int,
+                        help="Number of ambiguous tokens after which a batch is run")
+    parser.add_argument("--max-wait-ms", dest="max_wait_ms", default=5., type=float,
+                        help="Time a request can wait for other requests to join its batch")
+    parser.add_argument("--max-body-size", dest="max_body_size", default=10 * 2 ** 20, type=int,
+                        help="Size in bytes of the largest request body, larger requests are refused")
+    parser.add_argument("--device", default="cpu", help="Device to use for the model", type=str)
+    parser.add_argument("--cache-size", dest="cache_size", default=0, type=int,
+                        help="Number of predictions kept in a LRU cache")
+    parser.add_argument("--cache-window", dest="cache_window", default=None, type=int,
+                        help="Tokens on each side of a target used as cache key, whole sentence if not set")
+    return parser
+
+
+def main(args):
+    tagger = Tagger(args.model, device=args.device, batch_size=args.max_batch_size,
+                    cache_size=args.cache_size, cache_window=args.cache_window)
+    server = DisambiguationServer(tagger, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                                  max_body_size=args.max_body_size)
+    server.serve_forever(host=args.host, port=args.port)
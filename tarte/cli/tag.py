@@ -0,0 +1,84 @@
+import os
+import os.path
+import time
+
+from tarte.tagger import Tagger
+
+
+def make_parser(*args, instantiator=None, **kwargs):
+    parser = instantiator(*args, description="Disambiguate files with a model",
+                          help="Disambiguate pie-like TSV files with a model", **kwargs)
+    parser.add_argument("model", help="Model to use")
+    parser.add_argument("files", nargs="+", help="TSV files with a header to disambiguate", type=str)
+    parser.add_argument("--output-dir", dest="output_dir", required=True,
+                        help="Directory where disambiguated files should be saved", type=str)
+    parser.add_argument("--batch-size", dest="batch_size", default=256,
+                        help="Number of ambiguous tokens predicted at once", type=int)
+    parser.add_argument("--device", default="cpu", help="Device to use for the model", type=str)
+    parser.add_argument("--workers", default=1, type=int,
+                        help="Number of processes, sharing the model, used to tag the files")
+    parser.add_argument("--cache-size", dest="cache_size", default=0, type=int,
+                        help="Number of predictions kept in a LRU cache (per worker). Statistics of the cache are "
+                             "summed over the workers")
+    parser.add_argument("--cache-window", dest="cache_window", default=None, type=int,
+                        help="Tokens on each side of a target used as cache key, whole sentence if not set")
+    parser.add_argument("--quantize", action="store_true", default=False,
+                        help="Use dynamic int8 quantization of the linear layers (CPU only)")
+    parser.add_argument("--quantize-embeddings", dest="quantize_embeddings", action="store_true", default=False,
+                        help="With --quantize, also store the embeddings in 8 bits")
+    return parser
+
+
+def print_cache(tagger: Tagger, workers: int = 1):
+    """ Print the statistics of the prediction cache, if any """
+    if tagger.cache is None:
+        return
+    stats = tagger.cache.stats() if workers == 1 else dict(max_size=tagger.cache.size, **tagger.cache.counts())
+    print("Cache : {}{}".format(", ".join("{} {:,}".format(key, value) for key, value in stats.items()),
+                                " (sum of {} workers)".format(workers) if workers > 1 else ""))
+
+
+def main(args):
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    tagger = Tagger(args.model, device=args.device, batch_size=args.batch_size,
+                    cache_size=args.cache_size, cache_window=args.cache_window,
+                    quantize=args.quantize, quantize_embeddings=args.quantize_embeddings)
+
+    outputs = []
+    for file in args.files:
+        output = os.path.join(args.output_dir, os.path.basename(file))
+        if os.path.abspath(output) == os.path.abspath(file):
+            raise ValueError("Tagging {} would overwrite it, use another output directory".format(file))
+        outputs.append(output)
+
+    if args.workers > 1:
+        start = time.time()
+        stats = tagger.tag_files(args.files, outputs, workers=args.workers)
+        elapsed = time.time() - start
+
+        for worker, (n_sents, n_tokens, worker_time) in sorted(stats.items()):
+            print("{} : {:,} sentences, {:,} tokens in {:.2f}s ({:.0f} tokens/s)".format(
+                worker, n_sents, n_tokens, worker_time, n_tokens / max(worker_time, 1e-6)))
+        total_tokens = sum(n_tokens for (_, n_tokens, _) in stats.values())
+        print("Total : {:,} tokens in {:.2f}s ({:.0f} tokens/s) with {} workers".format(
+            total_tokens, elapsed, total_tokens / max(elapsed, 1e-6), args.workers))
+        print_cache(tagger, workers=args.workers)
+        return
+
+    total_tokens, total_time = 0, 0.
+    for file, output in zip(args.files, outputs):
+        start = time.time()
+        n_sents, n_tokens = tagger.tag_file(file, output)
+        elapsed = time.time() - start
+
+        print("{} : {:,} sentences, {:,} tokens in {:.2f}s ({:.0f} tokens/s) -> {}".format(
+            file, n_sents, n_tokens, elapsed, n_tokens / max(elapsed, 1e-6), output))
+        total_tokens += n_tokens
+        total_time += elapsed
+
+    if len(args.files) > 1:
+        print("Total : {:,} tokens in {:.2f}s ({:.0f} tokens/s)".format(
+            total_tokens, total_time, total_tokens / max(total_time, 1e-6)))
+    print_cache(tagger)
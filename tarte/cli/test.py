@@ -4,6 +4,7 @@ import json
 from pie.settings import Settings
 
 from tarte.modules.models import TarteModule
+from tarte.modules.quantization import quantize, compare_scores, print_comparison
 from tarte.utils.reader import ReaderWrapper
 from tarte.utils.datasets import Dataset
 
@@ -13,6 +14,10 @@ def make_parser(*args, instantiator=None, **kwargs):
     parser.add_argument("settings", help="Settings files as json", type=argparse.FileType())
     parser.add_argument("model", help="Model to test")
     parser.add_argument("--device", default="cuda", help="Directory where data should be saved", type=str)
+    parser.add_argument("--quantize", action="store_true", default=False,
+                        help="Also evaluate the model with dynamic int8 quantization (on CPU) and report the deltas")
+    parser.add_argument("--quantize-embeddings", dest="quantize_embeddings", action="store_true", default=False,
+                        help="With --quantize, also store the embeddings in 8 bits")
     return parser
 
 
@@ -31,9 +36,17 @@ def main(args):
     encoder = model.label_encoder
 
     # Create trainer
-    trainset = Dataset(settings, ReaderWrapper(settings, settings["input_path"]), encoder)
+    # The context window is a model parameter
+    trainset = Dataset(settings, ReaderWrapper(settings, settings["input_path"],
+                                               context_window=model.context_window), encoder)
 
     print("Evaluating model on test set")
-    testset = Dataset(settings, ReaderWrapper(settings, settings["test_path"]), encoder)
+    testset = Dataset(settings, ReaderWrapper(settings, settings["test_path"],
+                                              context_window=model.context_window), encoder)
     scorer = model.evaluate(testset, trainset)
     scorer.print_summary(confusion_matrix=True)
+
+    if args.quantize:
+        print("Comparing the quantized model to the float one on the test set")
+        print_comparison(compare_scores(
+            model, quantize(model, embeddings=args.quantize_embeddings), testset, trainset))
@@ -7,7 +7,7 @@ from pie.scripts.train import get_fname_infix
 
 from tarte.trainer import Trainer
 from tarte.modules.models import TarteModule
-from tarte.utils.labels import MultiEncoder
+from tarte.utils.labels import MultiEncoder, fit_files
 from tarte.utils.reader import ReaderWrapper
 from tarte.utils.datasets import Dataset
 
@@ -16,6 +16,8 @@ def make_parser(*args, instantiator=None, **kwargs):
     parser = instantiator(*args, description="Train a model", help="Train a model", **kwargs)
     parser.add_argument("settings", help="Settings files as json", type=argparse.FileType())
     parser.add_argument("--device", default="cuda", help="Directory where data should be saved", type=str)
+    parser.add_argument("--processes", default=None, type=int,
+                        help="Number of processes fitting the vocabulary over the training files, one per CPU by default")
     return parser
 
 def main(args):
@@ -26,17 +28,27 @@ def main(args):
     settings = Settings(data)
 
     # Generate required information
-    encoder = MultiEncoder()
+    encoder = MultiEncoder.from_settings(settings)
 
     # Build dataset
-    trainset = Dataset(settings, ReaderWrapper(settings, settings["input_path"]), encoder)
-    devset = Dataset(settings, ReaderWrapper(settings, settings["dev_path"]), encoder)
+    trainset = Dataset(settings, ReaderWrapper(settings, settings["input_path"],
+                                               context_window=settings.context_window), encoder)
+    devset = Dataset(settings, ReaderWrapper(settings, settings["dev_path"],
+                                             context_window=settings.context_window), encoder)
 
     # Fit the label encoder
-    encoder.fit_reader(trainset.reader)
+    fit_files(settings, trainset.reader.filenames, context_window=settings.context_window,
+              processes=args.processes, encoder=encoder)
+
+    print("::: Vocabulary :::")
+    print()
+    for name, report in encoder.coverage.items():
+        print("{}: {} kept, {} pruned, {:.2%} of occurrences lost".format(
+            name, report["kept"], report["pruned"], report["coverage_lost"]))
+    print()
 
     # Configurate model
-    model = TarteModule(encoder)
+    model = TarteModule(encoder, context_window=settings.context_window)
 
     model.to(settings.device)
 
@@ -67,7 +79,8 @@ def main(args):
 
     if settings.test_path:
         print("Evaluating model on test set")
-        testset = Dataset(settings, ReaderWrapper(settings, settings["test_path"]), encoder)
+        testset = Dataset(settings, ReaderWrapper(settings, settings["test_path"],
+                                                  context_window=settings.context_window), encoder)
         scorer = model.evaluate(testset, trainset)
         scorer.print_summary()
 
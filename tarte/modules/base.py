@@ -1,7 +1,11 @@
+import io
 import os
+import gzip
 import json
+import time
 import tarfile
 import logging
+from typing import Optional, Tuple, Type
 
 import torch
 import torch.nn as nn
@@ -10,9 +14,54 @@ from pie import utils
 from pie.settings import Settings
 
 
+from ..utils.cache import LRUCache
 from ..utils.labels import MultiEncoder
 
 
+# Number of decoded label encoders kept in memory
+LABEL_ENCODER_CACHE_SIZE = 8
+# Decoded label encoders, by path, size and modification time of their model
+_LABEL_ENCODERS = LRUCache(LABEL_ENCODER_CACHE_SIZE)
+
+
+def build_empty(model_type: Type[nn.Module], *args, **kwargs) -> nn.Module:
+    """ Build a model whose weights are neither allocated nor initialized, when these are replaced by loaded
+        ones with `load_state_dict(state_dict, assign=True)`. Its parameters are on the meta device, which
+        is only set for the current thread.
+    """
+    with torch.device("meta"):
+        return model_type(*args, **kwargs)
+
+
+def label_encoder_key(fpath: str) -> Tuple[str, int, int]:
+    """ Key of the label encoder of a model file in the cache """
+    stat = os.stat(fpath)
+    return os.path.realpath(fpath), stat.st_size, stat.st_mtime_ns
+
+
+def cache_label_encoder(key: Tuple[str, int, int], encoder: MultiEncoder = None) -> Optional[MultiEncoder]:
+    """ Get a copy of the cached label encoder of `key` or, if `encoder` is given, cache it. Each model gets
+        its own copy, so that changing the encoder of a model does not change the others.
+    """
+    if encoder is not None:
+        _LABEL_ENCODERS.put(key, encoder)
+    cached = _LABEL_ENCODERS.get(key)
+    return cached.copy() if cached is not None else None
+
+
+def add_bytes_to_tar(data: bytes, arcname: str, tar: tarfile.TarFile):
+    """ Write bytes as a member of a tar, without temporary file """
+    info = tarfile.TarInfo(name=arcname)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def add_gzip_to_tar(string: str, arcname: str, tar: tarfile.TarFile):
+    """ Same as pie.utils.add_gzip_to_tar, without temporary file """
+    add_bytes_to_tar(gzip.compress(string.encode()), arcname, tar)
+
+
 class Base(nn.Module):
     """
     Abstract model class defining the model interface
@@ -54,28 +103,26 @@ class Base(nn.Module):
             os.makedirs(dirname)
 
         with tarfile.open(fpath, 'w') as tar:
-            # serialize label_encoder
-            string = self.label_encoder.dumps()
-            path = 'label_encoder.zip'
-            utils.add_gzip_to_tar(string, path, tar)
+            # serialize label_encoder, see MultiEncoder.dumpb
+            add_bytes_to_tar(gzip.compress(self.label_encoder.dumpb()), 'label_encoder.bin', tar)
 
             # serialize model class
             string, path = str(type(self).__name__), 'class.zip'
-            utils.add_gzip_to_tar(string, path, tar)
+            add_gzip_to_tar(string, path, tar)
 
             # serialize parameters
             string, path = json.dumps(self.get_args_and_kwargs()), 'parameters.zip'
-            utils.add_gzip_to_tar(string, path, tar)
+            add_gzip_to_tar(string, path, tar)
 
             # serialize weights
-            with utils.tmpfile() as tmppath:
-                torch.save(self.state_dict(), tmppath)
-                tar.add(tmppath, arcname='state_dict.pt')
+            buffer = io.BytesIO()
+            torch.save(self.state_dict(), buffer)
+            add_bytes_to_tar(buffer.getvalue(), 'state_dict.pt', tar)
 
             # if passed, serialize settings
             if settings is not None:
                 string, path = json.dumps(settings), 'settings.zip'
-                utils.add_gzip_to_tar(string, path, tar)
+                add_gzip_to_tar(string, path, tar)
 
         return fpath
 
@@ -84,20 +131,52 @@ class Base(nn.Module):
         """
         Load settings from path
         """
+        from .mapped import is_mapped, read_file_header
+
+        if is_mapped(fpath):
+            return Settings(read_file_header(fpath)["settings"])
+
         with tarfile.open(utils.ensure_ext(fpath, 'tar'), 'r') as tar:
             return Settings(json.loads(utils.get_gzip_from_tar(tar, 'settings.zip')))
 
+    @staticmethod
+    def load_label_encoder(fpath, tar: tarfile.TarFile = None) -> MultiEncoder:
+        """
+        Load the label encoder of a model. Decoded encoders are cached until the model file changes.
+
+        :param fpath: Path of the model
+        :param tar: Archive of the model, if already open
+        """
+        fpath = utils.ensure_ext(fpath, 'tar')
+        key = label_encoder_key(fpath)
+        le = cache_label_encoder(key)
+        if le is None:
+            if tar is None:
+                with tarfile.open(fpath, 'r') as tar:
+                    return Base.load_label_encoder(fpath, tar=tar)
+            if 'label_encoder.bin' in tar.getnames():
+                le = MultiEncoder.loadb(gzip.decompress(tar.extractfile('label_encoder.bin').read()))
+            else:
+                # Models saved before the binary serialization
+                le = MultiEncoder.load(json.loads(utils.get_gzip_from_tar(tar, 'label_encoder.zip')))
+            le = cache_label_encoder(key, le)
+        return le
+
     @staticmethod
     def load(fpath):
         """
-        Load model from path
+        Load model from path, either a .tar model or a v2 model (see tarte.modules.mapped)
         """
         import tarte.modules.models
+        from .mapped import is_mapped, load_mapped
+
+        if is_mapped(fpath):
+            return load_mapped(fpath)
 
         with tarfile.open(utils.ensure_ext(fpath, 'tar'), 'r') as tar:
 
             # load label encoder
-            le = MultiEncoder.load(json.loads(utils.get_gzip_from_tar(tar, 'label_encoder.zip')))
+            le = Base.load_label_encoder(fpath, tar=tar)
 
             # load model parameters
             args, kwargs = json.loads(utils.get_gzip_from_tar(tar, 'parameters.zip'))
@@ -105,7 +184,7 @@ class Base(nn.Module):
             # instantiate model
             model_type = getattr(tarte.modules.models, utils.get_gzip_from_tar(tar, 'class.zip'))
             with utils.shutup():
-                model = model_type(le, *args, **kwargs)
+                model = build_empty(model_type, le, *args, **kwargs)
 
             # load settings
             try:
@@ -115,11 +194,8 @@ class Base(nn.Module):
             except Exception:
                 logging.warn("Couldn't load settings for model {}!".format(fpath))
 
-            # load state_dict
-            with utils.tmpfile() as tmppath:
-                tar.extract('state_dict.pt', path=tmppath)
-                dictpath = os.path.join(tmppath, 'state_dict.pt')
-                model.load_state_dict(torch.load(dictpath, map_location='cpu'))
+            # load state_dict, read from the archive
+            model.load_state_dict(torch.load(tar.extractfile('state_dict.pt'), map_location='cpu'), assign=True)
 
         model.eval()
 
@@ -5,19 +5,26 @@ import torch.nn.functional as F
 from pie import initialization
 from pie.models.decoder import LinearDecoder
 
-from ..utils.labels import CategoryEncoder
+from ..utils.labels import CategoryEncoder, OutputEncoder
 
 
 class Classifier(nn.Module):
-    def __init__(self, output_encoder: CategoryEncoder,
-               input_size: int, highway_layers: int = 0,
-               highway_act: str = "relu"):
+    """ Linear classifier where each target is only scored against the classes of its lemma
+
+    The table of candidate classes of each lemma is a buffer of the model: Tensor(lemmas * max_candidates)
+        where the first candidate is always the unknown class and missing candidates are -1
+    """
+    def __init__(self, output_encoder: OutputEncoder,
+                 input_size: int, lemma_encoder: CategoryEncoder,
+                 highway_layers: int = 0,
+                 highway_act: str = "relu"):
         self.label_encoder = output_encoder
         super().__init__()
 
         # nll weight
         nll_weight = torch.ones(len(self.label_encoder))
         self.register_buffer('nll_weight', nll_weight)
+        self.register_buffer('candidates', self.build_candidates(output_encoder, lemma_encoder))
         self.decoder = nn.Linear(input_size, len(self.label_encoder))
         self.highway = None
         self.init()
@@ -26,20 +33,73 @@ class Classifier(nn.Module):
         # linear
         initialization.init_linear(self.decoder)
 
-    def forward(self, enc_outs):
+    @staticmethod
+    def build_candidates(output_encoder: OutputEncoder, lemma_encoder: CategoryEncoder) -> torch.Tensor:
+        """ Build the table of the candidate classes of each lemma of the lemma encoder
+
+        :return: Tensor(lemmas * max_candidates)
+        """
+        unknown = output_encoder.stoi[OutputEncoder.DEFAULT_UNKNOWN]
+        candidates = [[unknown] for _ in range(lemma_encoder.size())]
+        for category, class_id in sorted(output_encoder.stoi.items(), key=lambda item: item[1]):
+            if isinstance(category, tuple) and category[0] in lemma_encoder.stoi:
+                candidates[lemma_encoder.stoi[category[0]]].append(class_id)
+
+        width = max(len(lemma_candidates) for lemma_candidates in candidates)
+        return torch.tensor(
+            [lemma_candidates + [-1] * (width - len(lemma_candidates)) for lemma_candidates in candidates],
+            # On CPU even for models built on the meta device, which load it from models saved without it
+            dtype=torch.int64, device="cpu"
+        )
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Models saved before the candidate table get the one built from their encoders
+        if prefix + "candidates" not in state_dict:
+            state_dict[prefix + "candidates"] = self.candidates
+        super(Classifier, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def get_candidates(self, lemma):
+        """ Candidate classes of each target
+
+        :param lemma: Tensor(batch_size) of target lemma
+        :return: Tensor(batch_size * max_candidates)
+        """
+        return self.candidates.index_select(0, lemma)
+
+    def forward(self, enc_outs, candidates):
+        """ Score each target against its candidates
+
+        :param enc_outs: Tensor(batch_size * input_size)
+        :param candidates: Tensor(batch_size * max_candidates) given by get_candidates
+        :return: Tensor(batch_size * max_candidates) where missing candidates are scored -inf
+        """
         if self.highway is not None:
             enc_outs = self.highway(enc_outs)
-        linear_out = self.decoder(enc_outs)
 
-        return linear_out
+        classes = candidates.clamp(min=0)
+        if isinstance(self.decoder, nn.Linear):
+            # Tensor(batch_size * max_candidates * input_size)
+            weight = self.decoder.weight[classes]
+            linear_out = torch.bmm(weight, enc_outs.unsqueeze(2)).squeeze(2) + self.decoder.bias[classes]
+        else:
+            # Decoders without weight tensor, such as quantized ones, score every class
+            linear_out = self.decoder(enc_outs).gather(1, classes)
 
-    def loss(self, logits, targets):
-        loss = F.cross_entropy(
-            logits, targets,
-            weight=self.nll_weight, reduction="mean"
-        )
+        return linear_out.masked_fill(candidates < 0, float("-inf"))
+
+    def loss(self, logits, targets, candidates):
+        """
+        :param logits: Tensor(batch_size * max_candidates)
+        :param targets: Tensor(batch_size) of class IDs
+        :param candidates: Tensor(batch_size * max_candidates) of class IDs
+        """
+        # Position of each target in its candidates, targets outside of them are ignored
+        matches = candidates == targets.unsqueeze(1)
+        positions = matches.long().argmax(dim=1).masked_fill(~matches.any(dim=1), -100)
+        weight = self.nll_weight[targets] * (positions >= 0).to(logits.dtype)
 
-        return loss
+        loss = F.cross_entropy(logits, positions, reduction="none")
+        return (loss * weight).sum() / weight.sum().clamp(min=1e-12)
 
 
 class _Classifier(LinearDecoder):
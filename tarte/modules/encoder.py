@@ -45,19 +45,35 @@ class DataEncoder(nn.Module):
                 kernel_size=(self.kernel_size, self.emb_dim)
             )
 
-    def conv_and_pool(self, x, conv):
+    def conv_and_pool(self, x, conv, lengths=None):
         x = F.relu(conv(x)).squeeze(3)  # (N, Co, W)
-        x = F.max_pool1d(x, x.size(2)).squeeze(2)
+        if lengths is not None:
+            # Windows overlapping padding are zeroed: as ReLU outputs are positive, the max pool
+            #   then only sees real tokens and a sentence gets the same encoding whatever its batch.
+            #   Sentences shorter than the kernel keep their first window, which they only share with padding
+            windows = torch.arange(x.size(2), device=x.device).unsqueeze(0)
+            mask = windows < (lengths - self.kernel_size + 1).clamp(min=1).unsqueeze(1)  # (N, W)
+            x = x * mask.unsqueeze(1).to(x.dtype)
+        x = torch.max(x, dim=2)[0]  # Max pool over the whole sentence
         return x
 
-    def forward(self, src):
+    def forward(self, src, lengths=None):
+        """
+        :param src: Tensor(1 * batch_size * max_sentence_length * emb_dim)
+        :param lengths: Optional Tensor(batch_size) of sentence lengths, used to ignore padding
+        :return: Tensor(batch_size * channels)
+        """
         # create position tensor
 
         # permute for convolutional layer
         conv_input = src.permute(1, 0, 2, 3)
 
+        # sentences shorter than the kernel are padded so that the convolution can run
+        if conv_input.size(2) < self.kernel_size:
+            conv_input = F.pad(conv_input, (0, 0, 0, self.kernel_size - conv_input.size(2)))
+
         # pass through convolutional layer
-        conved = self.conv_and_pool(conv_input, self.conv)
+        conved = self.conv_and_pool(conv_input, self.conv, lengths=lengths)
 
         # batch_size * channels
         return conved
@@ -0,0 +1,91 @@
+from typing import Dict
+import gzip
+import json
+import os
+import warnings
+
+import torch
+import torch.nn as nn
+
+from .models import TarteModule
+from ..runtime import FORWARD_FILE, VOCABULARY_FILE
+
+
+class TarteForward(nn.Module):
+    """ Tensor-only forward of a TarteModule, used for export
+
+    It takes sentences already encoded by the vocabulary and returns, for each target,
+    the probability and the ID of its best class.
+    """
+    def __init__(self, model: TarteModule):
+        super(TarteForward, self).__init__()
+        self.model = model
+
+    def forward(self, positions, sentence_ids, context_form, context_lemma, context_pos, lengths):
+        """
+        :param positions: Tensor(targets) of the index of each target in its sentence
+        :param sentence_ids: Tensor(targets) of the sentence of each target
+        :param context_form: Tensor(max_sentence_length * sentences)
+        :param context_lemma: Tensor(max_sentence_length * sentences)
+        :param context_pos: Tensor(max_sentence_length * sentences)
+        :param lengths: Tensor(sentences)
+        :return: Tensor(targets) of probabilities, Tensor(targets) of class IDs
+        """
+        # Tensor(sentences * channels)
+        context_encoder = self.model.encode_context(context_lemma, context_pos, context_form, lengths=lengths)
+        return self.model.get_best(*self.model.get_logits(
+            context_encoder.index_select(0, sentence_ids),
+            context_lemma[positions, sentence_ids],
+            context_pos[positions, sentence_ids],
+            context_form[positions, sentence_ids]
+        ))
+
+
+def get_vocabulary(model: TarteModule) -> Dict:
+    """ Vocabulary needed by tarte.runtime.TarteRuntime, where each encoder is a list of its categories
+        in the order of their IDs
+    """
+    encoder = model.label_encoder
+    return {
+        "lemma": encoder.lemma.itos,
+        "pos": encoder.pos.itos,
+        "token": encoder.token.itos,
+        "output": encoder.output.itos,
+        "routes": encoder.output.dumps_routes(),
+        "context_window": model.context_window,
+        "kernel_size": model.context_encoder.kernel_size
+    }
+
+
+def export(model: TarteModule, directory: str) -> str:
+    """ Export a model as a TorchScript forward and a vocabulary file which can be used
+        with tarte.runtime.TarteRuntime, without pie
+
+    :param model: Model to export
+    :param directory: Directory to write both files to
+    :return: Directory
+    """
+    model = model.eval()
+    os.makedirs(directory, exist_ok=True)
+
+    # Example batch of two sentences of length 4 and 3 with 3 targets.
+    #   Sentences are always padded to the kernel size by the runtime, so the traced graph
+    #   never needs the padding branch of DataEncoder
+    kernel_size = model.context_encoder.kernel_size
+    max_len = kernel_size + 1
+    context = torch.ones(max_len, 2, dtype=torch.long)
+    example = (
+        torch.tensor([0, 2, 1]), torch.tensor([0, 0, 1]),
+        context, context, context,
+        torch.tensor([max_len, max_len - 1])
+    )
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=torch.jit.TracerWarning)
+        traced = torch.jit.trace(TarteForward(model).eval(), example)
+        traced = torch.jit.freeze(traced)  # Folds the weights in the graph
+    torch.jit.save(traced, os.path.join(directory, FORWARD_FILE))
+
+    with gzip.open(os.path.join(directory, VOCABULARY_FILE), "wt") as f:
+        json.dump(get_vocabulary(model), f, separators=(",", ":"))
+
+    return directory
@@ -0,0 +1,171 @@
+""" Memory-mappable model format (v2)
+
+A v2 model is a single uncompressed file:
+
+    - MAGIC (8 bytes), then the size of the header (uint64, little endian)
+    - Header: JSON with the model class, its parameters, its settings, and the index of the sections
+    - Tensor sections: raw tensor data, each aligned on ALIGNMENT bytes
+    - Vocabulary section: the MultiEncoder in its binary serialization, see MultiEncoder.dumpb
+
+Tensors are read from a copy-on-write memory map and used as is by the model, so processes loading the same file
+share its pages in the page cache. Models saved with Base.save (.tar) are the v1 format.
+"""
+from typing import Dict, Tuple
+import json
+import mmap
+import os
+import struct
+import sys
+
+import torch
+
+from pie.settings import Settings
+
+from .base import Base, build_empty, label_encoder_key, cache_label_encoder
+from ..utils.labels import MultiEncoder
+
+
+MAGIC = b"TARTEv2\x00"
+ALIGNMENT = 64
+_SIZE = struct.Struct("<Q")
+
+def is_mapped(fpath: str) -> bool:
+    """ Check whether a file is a v2 model """
+    if not os.path.isfile(fpath):
+        return False
+    with open(fpath, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def save_mapped(model: Base, fpath: str, settings=None) -> str:
+    """ Save a model in the v2 format
+
+    :param model: Model to save
+    :param fpath: Path of the file
+    :param settings: Settings to save with the model
+    :return: Path of the file
+    """
+    dirname = os.path.dirname(fpath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    state_dict = model.state_dict()
+    vocabulary = model.label_encoder.dumpb()
+
+    # Sections are placed relatively to the start of the data, which follows the header
+    tensors, offset = {}, 0
+    for name, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor) or tensor.is_quantized:
+            raise ValueError("{} cannot be saved as a v2 model, only plain tensors can".format(name))
+        nbytes = tensor.numel() * tensor.element_size()
+        tensors[name] = {"dtype": _dtype_name(tensor.dtype), "shape": list(tensor.shape),
+                         "offset": offset, "nbytes": nbytes}
+        offset = _align(offset + nbytes)
+
+    header = json.dumps({
+        "version": 2,
+        "byteorder": sys.byteorder,
+        "class": type(model).__name__,
+        "parameters": model.get_args_and_kwargs(),
+        "settings": settings,
+        "routes": model.label_encoder.output.dumps_routes(),
+        "tensors": tensors,
+        "vocabulary": {"offset": offset, "nbytes": len(vocabulary)}
+    }).encode("utf-8")
+    data_start = _align(len(MAGIC) + _SIZE.size + len(header))
+
+    with open(fpath, "wb") as f:
+        f.write(MAGIC + _SIZE.pack(len(header)) + header)
+        for name, tensor in state_dict.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+        f.seek(data_start + offset)
+        f.write(vocabulary)
+
+    return fpath
+
+
+def read_header(buffer) -> Tuple[Dict, int]:
+    """ Read the header of a v2 model
+
+    :return: Header and offset of the data
+    """
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a v2 model")
+    size, = _SIZE.unpack_from(buffer, len(MAGIC))
+    start = len(MAGIC) + _SIZE.size
+    header = json.loads(bytes(buffer[start:start + size]).decode("utf-8"))
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError("Model was saved on a {} endian machine".format(header["byteorder"]))
+    return header, _align(start + size)
+
+
+def read_file_header(fpath: str) -> Dict:
+    """ Read the header of a v2 model file """
+    with open(fpath, "rb") as f:
+        start = f.read(len(MAGIC) + _SIZE.size)
+        size, = _SIZE.unpack_from(start, len(MAGIC))
+        return read_header(start + f.read(size))[0]
+
+
+def load_mapped(fpath: str) -> Base:
+    """ Load a v2 model, whose tensors are memory-mapped """
+    import tarte.modules.models
+
+    with open(fpath, "rb") as f:
+        # Copy on write: pages are shared between processes as long as they are not modified
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header, data_start = read_header(buffer)
+
+    key = label_encoder_key(fpath)
+    le = cache_label_encoder(key)
+    if le is None:
+        section = header["vocabulary"]
+        start = data_start + section["offset"]
+        le = MultiEncoder.loadb(memoryview(buffer)[start:start + section["nbytes"]])
+        le.output.load_routes(header["routes"])
+        le = cache_label_encoder(key, le)
+
+    args, kwargs = header["parameters"]
+    model_type = getattr(tarte.modules.models, header["class"])
+    model = build_empty(model_type, le, *args, **kwargs)
+    if header["settings"] is not None:
+        model._settings = Settings(header["settings"])
+
+    state_dict = {}
+    for name, tensor in header["tensors"].items():
+        dtype = getattr(torch, tensor["dtype"])
+        if tensor["nbytes"]:
+            state_dict[name] = torch.frombuffer(
+                buffer, dtype=dtype, count=tensor["nbytes"] // torch.empty(0, dtype=dtype).element_size(),
+                offset=data_start + tensor["offset"]
+            ).view(tensor["shape"])
+        else:
+            state_dict[name] = torch.empty(tensor["shape"], dtype=dtype)
+    # Parameters become the memory-mapped tensors instead of copies
+    model.load_state_dict(state_dict, assign=True)
+    model.eval()
+
+    return model
+
+
+def convert(source: str, destination: str) -> str:
+    """ Convert a model from one format to the other
+
+    :param source: Model to convert
+    :param destination: Path of the converted model
+    :return: Path of the converted model
+    """
+    model = Base.load(source)
+    settings = getattr(model, "_settings", None)
+    if is_mapped(source):
+        return model.save(destination, settings=settings)
+    return save_mapped(model, destination, settings=settings)
@@ -37,7 +37,9 @@ class TarteModule(Base):
         "word_dropout": 0.25,
         "dropout": 0.25,
         "init": True,
-        "device": "cpu"
+        "device": "cpu",
+        # Number of tokens kept on each side of the target as its context, None for the whole sentence
+        "context_window": None
     }
 
     def evaluate(self, dataset: Dataset, trainset: Dataset = None, **kwargs):
@@ -97,6 +99,7 @@ class TarteModule(Base):
         # Informations
         self.word_dropout = self.arguments["word_dropout"]
         self.dropout = self.arguments["dropout"]
+        self.context_window = self.arguments["context_window"]
 
         # Embedding
         self.form_embedding = WordEmbedding(
@@ -125,8 +128,9 @@ class TarteModule(Base):
         )
 
         # Classifier
-        self.decoder: decoder.LinearDecoder = Classifier(input_size=self.context_encoder.channels * 2,
-                                                         output_encoder=self.label_encoder.output)
+        self.decoder: Classifier = Classifier(input_size=self.context_encoder.channels * 2,
+                                              output_encoder=self.label_encoder.output,
+                                              lemma_encoder=self.label_encoder.lemma)
 
         # Initialize
         if self.arguments["init"]:
@@ -151,22 +155,15 @@ class TarteModule(Base):
         Where 3 is
         """
 
-    def loss(self, batch_data):
-        """
+    def encode_context(self, context_lemma, context_pos, context_form, lengths):
+        """ Encode the context sentences
 
+        :param context_lemma: Tensor(max_sentence_length * batch_size)
+        :param context_pos: Tensor(max_sentence_length * batch_size)
+        :param context_form: Tensor(max_sentence_length * batch_size)
+        :param lengths: Tensor(batch_size)
+        :return: Tensor(batch_size * channels)
         """
-        (
-            (le, po, to),
-            (token_chars, chars_length),
-            (context_form, form_length),
-            (context_lemma, lemma_length),
-            (context_pos, pos_length)
-        ), targets = batch_data
-
-        le = self.word_embedding(le).unsqueeze(0)
-        po = self.pos__embedding(po).unsqueeze(0)
-        to = self.form_embedding(to).unsqueeze(0)
-
         # Compute embeddings
         lem = self.word_embedding(context_lemma)
         pos = self.pos__embedding(context_pos)
@@ -183,29 +180,63 @@ class TarteModule(Base):
         encoder_input = torch.cat([lem, pos, frm], dim=-1).unsqueeze(0).transpose(1, 2)
 
         # Compute encodings
-        # Tensor(1 * batch_size * 1 * channels)
-        context_encoder = self.context_encoder(encoder_input)
-
-        # Add a dimension to reflect shape of encoder input
-        # Tensor(1 * batch_size * 1 * (lem+pos+frm embedding size))
-        cat = torch.cat([le, po, to], dim=-1).unsqueeze(2)
+        # Tensor(batch_size * channels)
+        return self.context_encoder(encoder_input, lengths=lengths)
 
-        # Tensor(1 * batch_size * 1 * channels)
-        input_encoder = self.hidden(cat).squeeze(dim=2).squeeze(dim=0)
+    def get_logits(self, context_encoder, le, po, to):
+        """ Classify targets given their encoded context, against the candidate classes of their lemma
 
-        # Tensor(batch_size * classes)
+        :param context_encoder: Tensor(batch_size * channels)
+        :param le: Tensor(batch_size) of target lemma
+        :param po: Tensor(batch_size) of target POS
+        :param to: Tensor(batch_size) of target tokens
+        :return: Tensor(batch_size * max_candidates) of logits, Tensor(batch_size * max_candidates) of class IDs
+        """
+        # Tensor(batch_size * (lem+pos+frm embedding size))
+        cat = torch.cat([
+            self.word_embedding(le),
+            self.pos__embedding(po),
+            self.form_embedding(to)
+        ], dim=-1)
+
+        # Tensor(batch_size * channels)
+        input_encoder = self.hidden(cat)
+
+        # Tensor(batch_size * max_candidates)
+        candidates = self.decoder.get_candidates(le)
         reshaped_input = torch.cat([context_encoder, input_encoder], dim=-1)
-        logits = self.decoder(reshaped_input)
+        return self.decoder(reshaped_input, candidates), candidates
 
-        return self.decoder.loss(logits, targets)
+    @staticmethod
+    def get_best(logits, candidates):
+        """ Best candidate of each target
 
-    def predict(self, batch_data) -> Tuple[
+        :param logits: Tensor(batch_size * max_candidates)
+        :param candidates: Tensor(batch_size * max_candidates)
+        :return: Tensor(batch_size) of probabilities, Tensor(batch_size) of class IDs
+        """
+        probs, best = torch.max(F.softmax(logits, dim=-1), dim=-1)
+        return probs, candidates.gather(1, best.unsqueeze(1)).squeeze(1)
+
+    def decode(self, logits, candidates) -> Tuple[
         List[float], List[Tuple[str, int]]
     ]:
+        """ Turn logits into probabilities and categories
+
+        :param logits: Tensor(batch_size * max_candidates)
+        :param candidates: Tensor(batch_size * max_candidates)
+        """
+        # Probs is Tensor(batch_size) where values are the probability of chosen class
+        # Preds is Tensor(batch_size) where values is the class ID
+        probs, preds = self.get_best(logits, candidates)
+
+        output_probs, output_preds = probs.tolist(), self.label_encoder.output.inverse_transform_many(preds.cpu().numpy()).tolist()
+
+        return output_probs, output_preds
+
+    def loss(self, batch_data):
         """
 
-        :param batch_data:
-        :return:
         """
         (
             (le, po, to),
@@ -213,50 +244,54 @@ class TarteModule(Base):
             (context_form, form_length),
             (context_lemma, lemma_length),
             (context_pos, pos_length)
-        ) = batch_data
-
-        _, batch_size = context_lemma.size()
-        le = self.word_embedding(le).unsqueeze(0)
-        po = self.pos__embedding(po).unsqueeze(0)
-        to = self.form_embedding(to).unsqueeze(0)
-
-        # Compute embeddings
-        lem = self.word_embedding(context_lemma)
-        pos = self.pos__embedding(context_pos)
-        frm = self.form_embedding(context_form)
-        #chars = self.char_embedding(token_chars)
-
-        # Dropout
-        lem = F.dropout(lem, p=self.dropout, training=self.training)
-        pos = F.dropout(pos, p=self.dropout, training=self.training)
-        frm = F.dropout(frm, p=self.dropout, training=self.training)
-        #chars = F.dropout(chars, p=self.dropout, training=self.training)
+        ), targets = batch_data
 
-        # Tensor(1 * batch_size * max_sentence_length * (lem+pos+frm embedding size))
-        encoder_input = torch.cat([lem, pos, frm], dim=-1).unsqueeze(0).transpose(1, 2)
+        context_encoder = self.encode_context(context_lemma, context_pos, context_form, lengths=lemma_length)
+        logits, candidates = self.get_logits(context_encoder, le, po, to)
 
-        # Compute encodings
-        # Tensor(1 * batch_size * 1 * channels)
-        context_encoder = self.context_encoder(encoder_input)
+        return self.decoder.loss(logits, targets, candidates)
 
-        # Add a dimension to reflect shape of encoder input
-        # Tensor(1 * batch_size * 1 * (lem+pos+frm embedding size))
-        cat = torch.cat([le, po, to], dim=-1).unsqueeze(2)
+    def predict(self, batch_data) -> Tuple[
+        List[float], List[Tuple[str, int]]
+    ]:
+        """
 
-        # .squeeze() remove all 1 dimension, if a batch is one sized, we need to squeeze only what is needed
-        # Tensor(1 * batch_size * 1 * channels)
-        input_encoder = self.hidden(cat).squeeze(dim=2).squeeze(dim=0)
+        :param batch_data:
+        :return:
+        """
+        (
+            (le, po, to),
+            (token_chars, chars_length),
+            (context_form, form_length),
+            (context_lemma, lemma_length),
+            (context_pos, pos_length)
+        ) = batch_data
 
-        # Tensor(batch_size * classes)
-        reshaped_input = torch.cat([context_encoder, input_encoder], dim=-1)
-        probs = F.softmax(self.decoder(reshaped_input), dim=-1)
-        # Tensor(batch_size * classes)
-        probs, preds = torch.max(probs, dim=-1)
+        context_encoder = self.encode_context(context_lemma, context_pos, context_form, lengths=lemma_length)
+        return self.decode(*self.get_logits(context_encoder, le, po, to))
 
-        # Probs is Tensor(batch_size) where values are the probability of chosen class
-        # Preds is Tensor(batch_size) where values is the class ID
+    def predict_sentences(self, batch_data) -> Tuple[
+        List[float], List[Tuple[str, int]]
+    ]:
+        """ Predict every target of a batch of sentences, where each sentence context is encoded once
 
-        output_probs, output_preds = probs.tolist(), list(self.label_encoder.output.inverse_transform(preds.tolist()))
+        :param batch_data: Batch packed by Dataset._pack_sentences
+        :return: Probabilities and predictions, in the order of the targets
+        """
+        (
+            (positions, sentence_ids),
+            (context_form, form_length),
+            (context_lemma, lemma_length),
+            (context_pos, pos_length)
+        ) = batch_data
 
-        return output_probs, output_preds
+        # Tensor(sentences * channels)
+        context_encoder = self.encode_context(context_lemma, context_pos, context_form, lengths=lemma_length)
 
+        # Targets are read from their sentence and get their sentence encoding
+        return self.decode(*self.get_logits(
+            context_encoder.index_select(0, sentence_ids),
+            context_lemma[positions, sentence_ids],
+            context_pos[positions, sentence_ids],
+            context_form[positions, sentence_ids]
+        ))
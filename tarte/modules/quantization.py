@@ -0,0 +1,65 @@
+from typing import Dict
+import copy
+
+import torch
+import torch.nn as nn
+from torch.quantization import quantize_dynamic, default_dynamic_qconfig, float_qparams_weight_only_qconfig
+
+from .models import TarteModule
+from ..utils.datasets import Dataset
+
+
+def quantize(model: TarteModule, embeddings: bool = False) -> TarteModule:
+    """ Apply dynamic int8 quantization to a model for CPU inference
+
+    Linear layers (`hidden` and the classifier decoder) get int8 weights and quantize their
+    input on the fly. The convolution of the context encoder is kept in float.
+
+    :param model: Model to quantize, which is left untouched
+    :param embeddings: If True, embedding tables are also stored in 8 bits, with a scale
+        and an offset for each row
+    :return: Quantized copy of the model, in eval mode and on CPU
+    """
+    qconfig_spec = {nn.Linear: default_dynamic_qconfig}
+    if embeddings:
+        qconfig_spec[nn.Embedding] = float_qparams_weight_only_qconfig
+
+    model = copy.deepcopy(model).cpu().eval()
+    return quantize_dynamic(model, qconfig_spec=qconfig_spec, inplace=True)
+
+
+def compare_scores(model: TarteModule, quantized: TarteModule, dataset: Dataset,
+                   trainset: Dataset = None) -> Dict[str, Dict[str, float]]:
+    """ Evaluate a float model and its quantized version on the same dataset, on CPU
+
+    :param model: Float model, which is moved to CPU
+    :param quantized: Quantized model
+    :param dataset: Dataset to evaluate on
+    :param trainset: Optional train set, see TarteModule.evaluate
+    :return: Dictionary of {"float": scores, "quantized": scores, "delta": quantized - float}
+        for the scores of all targets
+    """
+    device, dataset.device = dataset.device, "cpu"
+    try:
+        float_scores = model.cpu().evaluate(dataset, trainset).get_scores()["all"]
+        quantized_scores = quantized.evaluate(dataset, trainset).get_scores()["all"]
+    finally:
+        dataset.device = device
+    return {
+        "float": float_scores,
+        "quantized": quantized_scores,
+        "delta": {
+            key: round(quantized_scores[key] - float_scores[key], 4)
+            for key in ("accuracy", "precision", "recall")
+        }
+    }
+
+
+def print_comparison(comparison: Dict[str, Dict[str, float]]):
+    """ Print the result of compare_scores
+    """
+    print("{:<10}{:>10}{:>10}{:>10}".format("", "float", "int8", "delta"))
+    for key in ("accuracy", "precision", "recall"):
+        print("{:<10}{:>10.4f}{:>10.4f}{:>+10.4f}".format(
+            key, comparison["float"][key], comparison["quantized"][key], comparison["delta"][key]))
+    print("{:<10}{:>10}".format("support", comparison["float"]["support"]))
@@ -0,0 +1,167 @@
+""" Minimal runtime for models exported with `tarte export`: it only requires torch
+"""
+from typing import List, Tuple, Dict, Optional
+from collections import OrderedDict
+import gzip
+import json
+import os
+
+import torch
+
+
+FORWARD_FILE = "forward.pt"
+VOCABULARY_FILE = "vocabulary.json.gz"
+
+PAD, UNK = 0, 1
+# Route of lemma which are not in the routing table, see tarte.utils.labels.OutputEncoder.routes
+PASSTHROUGH = False
+
+
+def _window_bounds(index: int, size: int, context_window: int = None) -> Tuple[int, int]:
+    """ Same as tarte.utils.reader.get_window_bounds, which cannot be imported without pie """
+    if context_window is None:
+        return 0, size
+    return max(0, index - context_window), min(size, index + context_window + 1)
+
+
+class TarteRuntime:
+    def __init__(self, directory: str, device: str = "cpu", batch_size: int = 256):
+        """
+
+        :param directory: Directory written by `tarte export`
+        :param device: Device on which the model should run
+        :param batch_size: Number of ambiguous tokens, gathered across sentences, sent to the model in one forward pass
+        """
+        with gzip.open(os.path.join(directory, VOCABULARY_FILE), "rt") as f:
+            vocabulary = json.load(f)
+
+        self.lemma: Dict[str, int] = {category: index for index, category in enumerate(vocabulary["lemma"])}
+        self.pos: Dict[str, int] = {category: index for index, category in enumerate(vocabulary["pos"])}
+        self.token: Dict[str, int] = {category: index for index, category in enumerate(vocabulary["token"])}
+        self.classes: List = [
+            tuple(category) if isinstance(category, list) else category
+            for category in vocabulary["output"]
+        ]
+        self.context_window: int = vocabulary["context_window"]
+        self.kernel_size: int = vocabulary["kernel_size"]
+
+        # Lemma with a single class are mapped to their index, lemma which need the model to None
+        self.routes: Dict[str, Optional[str]] = dict(vocabulary["routes"]["auto"])
+        self.routes.update(dict.fromkeys(vocabulary["routes"]["need"]))
+
+        self.device = device
+        self.batch_size = batch_size
+        self.forward = torch.jit.load(os.path.join(directory, FORWARD_FILE), map_location=device)
+
+    @staticmethod
+    def formatter(lemma, index):
+        return lemma+index
+
+    def tag(self, rows, formatter=None, batch_size=None):
+        """ Disambiguate sentences, see tarte.tagger.Tagger.tag
+
+        :param rows: List of sentences where each sentence is a list of word annotation
+            with token first, lemma second, pos third place.
+        :param formatter: Function to join the index and the lemma
+        :param batch_size: Number of ambiguous tokens predicted at once
+        """
+        if formatter is None:
+            formatter = self.formatter
+        batch_size = batch_size or self.batch_size
+
+        sentences, pending, n_targets = [], [], 0
+        for sentence in rows:
+            out, indexes = [], []
+            for index, (word, lemma, pos, *_) in enumerate(sentence):
+                route = self.routes.get(lemma, PASSTHROUGH)
+                if route is PASSTHROUGH:
+                    out.append(lemma)
+                elif route is None:
+                    out.append(None)
+                    indexes.append(index)
+                else:
+                    out.append(formatter(lemma, route))
+            sentences.append(out)
+
+            if indexes:
+                for offset, context in self.sentence_to_contexts(sentence, indexes):
+                    pending.append((out, offset, context))
+                n_targets += len(indexes)
+
+            if n_targets >= batch_size:
+                self.predict_targets(pending, formatter=formatter, batch_size=batch_size)
+                yield from sentences
+                sentences, pending, n_targets = [], [], 0
+
+        if pending:
+            self.predict_targets(pending, formatter=formatter, batch_size=batch_size)
+        yield from sentences
+
+    def sentence_to_contexts(self, sentence, indexes):
+        """ Read the contexts of the targets of a sentence, see tarte.tagger.Tagger.sentence_to_contexts
+        """
+        tok_lst, lem_lst, pos_lst, *_ = zip(*sentence)
+        windows = OrderedDict()
+        for index in indexes:
+            windows.setdefault(_window_bounds(index, len(sentence), self.context_window), []).append(index)
+        return [
+            (start, (lem_lst[start:end], pos_lst[start:end], tok_lst[start:end], [index - start for index in group]))
+            for (start, end), group in windows.items()
+        ]
+
+    def encode(self, contexts):
+        """ Encode contexts into the inputs of the exported forward
+
+        Sentences are padded to at least the kernel size of the context encoder.
+        """
+        max_len = max([self.kernel_size] + [len(lem_lst) for (lem_lst, *_) in contexts])
+        lemma = torch.full((max_len, len(contexts)), PAD, dtype=torch.long)
+        pos = torch.full((max_len, len(contexts)), PAD, dtype=torch.long)
+        form = torch.full((max_len, len(contexts)), PAD, dtype=torch.long)
+        positions, sentence_ids, lengths = [], [], []
+
+        for sentence_id, (lem_lst, pos_lst, tok_lst, indexes) in enumerate(contexts):
+            size = len(lem_lst)
+            lemma[:size, sentence_id] = torch.tensor([self.lemma.get(lem, UNK) for lem in lem_lst])
+            pos[:size, sentence_id] = torch.tensor([self.pos.get(po, UNK) for po in pos_lst])
+            form[:size, sentence_id] = torch.tensor([self.token.get(tok, UNK) for tok in tok_lst])
+            positions.extend(indexes)
+            sentence_ids.extend([sentence_id] * len(indexes))
+            lengths.append(size)
+
+        return tuple(
+            tensor.to(self.device)
+            for tensor in (
+                torch.tensor(positions), torch.tensor(sentence_ids),
+                form, lemma, pos, torch.tensor(lengths)
+            )
+        )
+
+    def predict_targets(self, pending, formatter, batch_size):
+        """ Predict targets by batches of about `batch_size` and write each prediction in place in its sentence output
+        """
+        batch, n_targets = [], 0
+        for item in pending:
+            batch.append(item)
+            n_targets += len(item[-1][-1])
+            if n_targets >= batch_size:
+                self.predict_batch(batch, formatter)
+                batch, n_targets = [], 0
+        if batch:
+            self.predict_batch(batch, formatter)
+
+    def predict_batch(self, batch, formatter):
+        with torch.no_grad():
+            _, predictions = self.forward(*self.encode([context for (_, _, context) in batch]))
+        predictions = iter(predictions.tolist())
+        for out, offset, context in batch:
+            for index in context[-1]:
+                out[offset + index] = self.format_prediction(index, context, self.classes[next(predictions)], formatter)
+
+    @staticmethod
+    def format_prediction(index, context, prediction, formatter):
+        """ Format the prediction of a target, see tarte.tagger.Tagger.format_prediction
+        """
+        if isinstance(prediction, tuple):
+            return formatter(*prediction)
+        return context[0][index]
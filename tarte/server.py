@@ -0,0 +1,227 @@
+from typing import List, Dict, Tuple, Optional
+from collections import deque
+from http import HTTPStatus
+import asyncio
+import json
+import logging
+import time
+
+from tarte.tagger import Tagger, SentenceList, Sentence, WordAnnotations
+
+
+logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO)
+
+
+class DisambiguationServer:
+    """ HTTP server around a Tagger, loaded once, which gathers concurrent requests into batches
+
+    Routes
+    ======
+    POST /disambiguate : JSON body {"sentences": [[[token, lemma, pos, ...], ...], ...]},
+        answers {"lemmas": [[lemma, ...], ...]}
+    GET /health : Status, number of requests and batches, latency percentiles in milliseconds
+        and the tagger's cache counters if it has a cache
+
+    :param tagger: Tagger to use
+    :param max_batch_size: Number of ambiguous tokens after which a batch is run without waiting for more requests
+    :param max_wait_ms: Time a request can wait for others to join its batch
+    :param history: Number of latest requests used to compute latency percentiles
+    :param max_body_size: Size in bytes of the largest request body, larger requests are answered 413
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, tagger: Tagger, max_batch_size: int = 256, max_wait_ms: float = 5.,
+                 history: int = 10000, max_body_size: int = 10 * 2 ** 20):
+        self.tagger: Tagger = tagger
+        self.max_batch_size: int = max_batch_size
+        self.max_wait: float = max_wait_ms / 1000
+        self.max_body_size: int = max_body_size
+
+        self.latencies: deque = deque(maxlen=history)
+        self.n_requests: int = 0
+        self.n_batches: int = 0
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._batcher: Optional[asyncio.Future] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8888) -> asyncio.AbstractServer:
+        """ Start listening and batching, to be run in the event loop
+        """
+        self.queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self.batcher())
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._batcher.cancel()
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 8888):
+        async def serve():
+            server = await self.start(host, port)
+            logging.info("Serving on {}".format(", ".join(str(sock.getsockname()) for sock in server.sockets)))
+            try:
+                await server.serve_forever()
+            finally:
+                await self.stop()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    def validate(sentences) -> SentenceList[Sentence[WordAnnotations[str]]]:
+        """ Check that a request is a list of sentences of words, which are lists of at least three strings
+            [token, lemma, pos, ...], so that a malformed request never reaches a batch shared with others
+        """
+        if not isinstance(sentences, list) or not all(isinstance(sentence, list) for sentence in sentences):
+            raise ValueError("Sentences should be a list of lists of words")
+        for sentence in sentences:
+            for word in sentence:
+                if not isinstance(word, list) or len(word) < 3 or not all(isinstance(value, str) for value in word):
+                    raise ValueError("Each word should be at least [token, lemma, pos], as strings")
+        return sentences
+
+    async def disambiguate(self, sentences: SentenceList[Sentence[WordAnnotations[str]]]) -> List[List[str]]:
+        """ Queue sentences for the next batch and wait for their lemmas
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sentences, self.tagger.count_targets(sentences), future))
+        return await future
+
+    async def batcher(self):
+        """ Gather queued requests until `max_batch_size` targets or `max_wait_ms` is reached, then tag them
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n_targets = batch[0][1]
+            deadline = loop.time() + self.max_wait
+            while n_targets < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                n_targets += request[1]
+
+            sentences = [sentence for (request, _, _) in batch for sentence in request]
+            try:
+                # The model runs out of the event loop so that requests keep being received
+                lemmas = await loop.run_in_executor(None, self.tag, sentences)
+            except Exception:
+                if len(batch) == 1:
+                    logging.exception("Error while tagging a request")
+                    self.fail(batch[0][2])
+                    continue
+                # Requests are tagged one by one, so that only the ones which cannot be tagged fail
+                logging.exception("Error while tagging a batch of {} requests, they are tagged apart".format(
+                    len(batch)))
+                for (request, _, future) in batch:
+                    try:
+                        lemmas = await loop.run_in_executor(None, self.tag, request)
+                    except Exception:
+                        logging.exception("Error while tagging a request")
+                        self.fail(future)
+                        continue
+                    self.n_batches += 1
+                    if not future.done():
+                        future.set_result(lemmas)
+                continue
+            self.n_batches += 1
+
+            start = 0
+            for (request, _, future) in batch:
+                if not future.done():
+                    future.set_result(lemmas[start:start + len(request)])
+                start += len(request)
+
+    @staticmethod
+    def fail(future: asyncio.Future):
+        if not future.done():
+            future.set_exception(RuntimeError("The request could not be tagged"))
+
+    def tag(self, sentences: SentenceList[Sentence[WordAnnotations[str]]]) -> List[List[str]]:
+        return list(self.tagger.tag(sentences, batch_size=self.max_batch_size))
+
+    def get_latencies(self) -> Dict[str, float]:
+        """ Latency percentiles, in milliseconds, over the latest requests
+        """
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {
+            "p{}".format(percentile): round(latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)], 3)
+            for percentile in self.PERCENTILES
+        }
+
+    def health(self) -> Dict:
+        health = {
+            "status": "ok",
+            "requests": self.n_requests,
+            "batches": self.n_batches,
+            "queued": self.queue.qsize(),
+            "latency_ms": self.get_latencies()
+        }
+        if self.tagger.cache is not None:
+            health["cache"] = self.tagger.cache.stats()
+        return health
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if path == "/health" and method == "GET":
+            return 200, self.health()
+        elif path == "/disambiguate" and method == "POST":
+            start = time.perf_counter()
+            try:
+                sentences = self.validate(json.loads(body.decode("utf-8"))["sentences"])
+            except (ValueError, KeyError, TypeError) as exception:
+                return 400, {"error": "Bad request: {}".format(exception)}
+            lemmas = await self.disambiguate(sentences)
+            self.n_requests += 1
+            self.latencies.append((time.perf_counter() - start) * 1000)
+            return 200, {"lemmas": lemmas}
+        return 404, {"error": "Unknown route {} {}".format(method, path)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Minimal HTTP/1.1 handling: one request per connection
+        """
+        try:
+            method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length < 0:
+                raise ValueError("Content-Length should not be negative, got {}".format(length))
+            if length > self.max_body_size:
+                # The body is not read
+                status, payload = 413, {"error": "Request body of {} bytes, the maximum is {}".format(
+                    length, self.max_body_size)}
+            else:
+                body = await reader.readexactly(length)
+                status, payload = await self.route(method, path.split("?")[0], body)
+        except (ValueError, asyncio.IncompleteReadError) as exception:
+            status, payload = 400, {"error": "Bad request: {}".format(exception)}
+        except Exception as exception:
+            logging.exception("Error while answering a request")
+            status, payload = 500, {"error": str(exception)}
+
+        content = json.dumps(payload).encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n"
+            .format(status, HTTPStatus(status).phrase, len(content)).encode("latin-1") + content
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
@@ -12,7 +12,8 @@ from pie.settings import Settings
 
 from tarte.utils.datasets import Dataset
 from tarte.utils.reader import ReaderWrapper
-from tarte.utils.labels import MultiEncoder
+from tarte.utils.labels import MultiEncoder, fit_files
+from tarte.utils.compression import open_file
 
 
 logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO)
@@ -24,7 +25,7 @@ class Splitter:
     """
     def __init__(self, settings: Settings, files: Iterator[str],
                  train_ratio: float = 0.8, dev_ratio: float = 0.1, test_ratio: float = 0.1,
-                 ):
+                 processes: int = None):
         assert test_ratio+dev_ratio+train_ratio == 1.0, "Ratio are not correct"
         self.files = list(files)
         self.ratios = train_ratio, test_ratio, dev_ratio
@@ -34,14 +35,14 @@ class Splitter:
             for file in self.files
         ]
         self.encoder: MultiEncoder = MultiEncoder()
+        self.processes = processes  # Number of processes fitting the encoder, see tarte.utils.labels.fit_files
         self.n_sents = 0
         self.fitted = False
 
     def scan(self, table=False):
         """ Scan data to retrieve information """
-        for file, reader in zip(self.files, self.readers):
-            logging.info("Reading {} for tokens".format(file))
-            self.encoder.fit_reader(reader, freeze=False)
+        logging.info("Reading {:,} files for tokens".format(len(self.files)))
+        fit_files(self.settings, self.files, encoder=self.encoder, processes=self.processes, freeze=False)
 
         for file, reader in zip(self.files, self.readers):
             logging.info("Reading {} for number of sentences".format(file))
@@ -92,7 +93,7 @@ class Splitter:
 
     def write(self, file, values, header=["token", "pos", "lemma", "Dis"]):
         i = 0
-        with open(file, "w") as f:
+        with open_file(file, "w") as f:
             writer = csv.writer(f, delimiter="\t")
             writer.writerow(header)
             for sentence in values:
@@ -102,7 +103,11 @@ class Splitter:
                 i += 1
         logging.info(f"{file} got {i} samples.")
 
-    def dispatch(self, directory, one_to_train=True, two_to_train_test=True):
+    def dispatch(self, directory, one_to_train=True, two_to_train_test=True, compress: str = None):
+        """ Write the train, dev and test files to `directory`
+
+        :param compress: If set, extension of the compression of the files (gz, bz2, xz)
+        """
         if not os.path.isdir(directory):
             os.makedirs(directory)
 
@@ -151,9 +156,10 @@ class Splitter:
         test.extend(remaining[train_milestone:test_milestone])
         dev.extend(remaining[test_milestone:])
 
-        self.write(directory+"/train.tsv", train)
-        self.write(directory+"/dev.tsv", dev)
-        self.write(directory+"/test.tsv", test)
+        extension = ".tsv" + ("." + compress if compress else "")
+        self.write(directory+"/train"+extension, train)
+        self.write(directory+"/dev"+extension, dev)
+        self.write(directory+"/test"+extension, test)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,21 @@
-from typing import List, Tuple
+from typing import List, Tuple, Iterator, TextIO, Dict, Optional
+from collections import deque, defaultdict, OrderedDict
 import logging
+import os
+import shutil
+import tempfile
+import time
+
+import torch
 
 from tarte.modules.models import TarteModule
+from tarte.modules.quantization import quantize as quantize_model
 from tarte.utils.datasets import Dataset
+from tarte.utils.cache import LRUCache
+from tarte.utils.compression import is_compressed, open_file
+from tarte.utils.labels import OutputEncoder
+from tarte.utils.reader import get_window_bounds
+from tarte.utils import constants
 
 SentenceList = List
 Sentence = List
@@ -11,12 +24,45 @@ WordAnnotations = List
 
 logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO)
 
+# Maximum length of sentences read by models saved without their settings, as pie's default
+DEFAULT_MAX_SENT_LEN = 35
+# Maximum number of sentences held by Tagger.tag while their targets wait for a batch to be full
+MAX_PENDING_SENTENCES = 1024
+
 
 class Tagger:
-    def __init__(self, filepath, device="cpu"):
+    def __init__(self, filepath, device="cpu", batch_size=1, cache_size=0, cache_window=None,
+                 quantize=False, quantize_embeddings=False):
+        """
+
+        :param filepath: Path to the model
+        :param device: Device on which the model should run
+        :param batch_size: Number of ambiguous tokens, gathered across sentences, sent to the model in one forward pass
+        :param cache_size: If set, number of predictions kept in a LRU cache
+        :param cache_window: Number of tokens on each side of a target which make its cache key. If None, the whole
+            context seen by the model is used and cached predictions are exact, otherwise two targets whose windows
+            are equal share their prediction, even if the rest of their context differs.
+        :param quantize: Use dynamic int8 quantization of the linear layers, for CPU inference
+        :param quantize_embeddings: With quantize, also store the embeddings in 8 bits
+        """
+        if quantize and device != "cpu":
+            raise ValueError("Quantized models only run on CPU, got device {}".format(device))
         self.model: TarteModule = TarteModule.load(filepath)
+        if quantize:
+            self.model = quantize_model(self.model, embeddings=quantize_embeddings)
         self.label_encoder = self.model.label_encoder
         self.output_encoder = self.label_encoder.output
+        self.batch_size = batch_size
+
+        # Files are split in sentences as the training files of the model were, see TsvReader.parse_lines
+        settings = getattr(self.model, "_settings", None) or {}
+        self.breakline_ref: Optional[str] = settings.get("breakline_ref")
+        self.breakline_data: Optional[str] = settings.get("breakline_data")
+        self.max_sent_len: int = settings.get("max_sent_len") or DEFAULT_MAX_SENT_LEN
+
+        self.cache: LRUCache = LRUCache(cache_size) if cache_size else None
+        self.cache_window = cache_window
+        self.max_pending_sentences: int = MAX_PENDING_SENTENCES
 
         self.device = None
         self.use_device(device)
@@ -44,12 +90,15 @@ class Tagger:
     def formatter(lemma, index):
         return lemma+index
 
-    def tag(self, rows: SentenceList[Sentence[WordAnnotations[str]]], formatter=None):
+    def tag(self, rows: SentenceList[Sentence[WordAnnotations[str]]], formatter=None, batch_size=None):
         """
 
         :param rows: List of sentences where each sentence is a list of word annotation
             with token first, lemma second, pos third place. SentenceList[Sentence[Word[token, lemma, pos, whatever..]]]
         :param formatter: Function to join the index and the lemma
+        :param batch_size: Number of ambiguous tokens predicted at once, defaults to the tagger's batch_size.
+            Sentences are yielded, in input order, once all of their ambiguous tokens have been predicted: targets
+            are predicted when they fill a batch or when `max_pending_sentences` sentences wait for them.
         :return:
 
         >>> tagger = Tagger("somefilepath")
@@ -64,38 +113,408 @@ class Tagger:
         """
         if formatter is None:
             formatter = self.formatter
+        batch_size = batch_size or self.batch_size
+
+        routes = self.output_encoder.routes
+
+        # Sentences waiting for predictions and, for those with targets, their context and target indexes
+        sentences, pending, n_targets = [], [], 0
         for sentence in rows:
-            out = []
-            for (word, lemma, pos, *_) in sentence:
-
-                if lemma in self.output_encoder.auto_categorization:
-                    out.append(formatter(lemma, self.output_encoder.auto_categorization[lemma]))
-                elif lemma in self.output_encoder.need_categorization:
-                    (l, p, w, lem_lst, pos_lst, tok_lst) = self.sentence_to_batch_row(word, lemma, pos, sentence)
-                    prob, (prediction, *_) = self.model.predict(
-                        Dataset._pack_batch(
-                            self.label_encoder,
-                            [(l, p, w, lem_lst, pos_lst, tok_lst)],
-                            with_target=False,
-                            device=self.device
-                        )
-                    )
-                    if isinstance(prediction, tuple):
-                        if prediction[0] != lemma:  # If somehow, the predicted category is unrelated to the lemma
-                            out.append(formatter(lemma, "?"))  # we keep the uncategorized one
-
-                            logging.info("<> was predicted for <> in the sentence <{}>;<{}>;<{}>".format(
-                                formatter(*prediction), lemma,
-                                tok_lst, lem_lst, pos_lst
-                            ))
-                        else:
-                            out.append(formatter(*prediction))
-                    else:
-                        out.append(lemma)  # If UNKNOWN, we keep the predicted one
+            out, indexes = [], []
+            for index, (word, lemma, pos, *_) in enumerate(sentence):
+                route = routes.get(lemma, OutputEncoder.PASSTHROUGH)
+                if route is OutputEncoder.PASSTHROUGH:
+                    out.append(lemma)
+                elif route is None:
+                    out.append(None)  # Placeholder filled by predict_targets
+                    indexes.append(index)
+                else:
+                    out.append(formatter(lemma, route))
+            sentences.append(out)
+
+            if indexes:
+                for offset, context in self.sentence_to_contexts(sentence, indexes):
+                    pending.append((out, offset, context))
+                n_targets += len(indexes)
+
+            if not pending:
+                # Sentences are only held while targets wait for a batch
+                yield from sentences
+                sentences = []
+            elif n_targets >= batch_size or len(sentences) >= self.max_pending_sentences:
+                self.predict_targets(pending, formatter=formatter, batch_size=batch_size)
+                yield from sentences
+                sentences, pending, n_targets = [], [], 0
+
+        if pending:
+            self.predict_targets(pending, formatter=formatter, batch_size=batch_size)
+        yield from sentences
+
+    @staticmethod
+    def read_sentences(lines: TextIO, sep: str = "\t", breakline: Optional[int] = None,
+                       breakline_data: Optional[str] = None, max_sent_len: Optional[int] = None,
+                       with_breaks: bool = False) -> Iterator[List[List[str]]]:
+        """ Lazily read sentences from TSV lines, where sentences are separated by blank lines and split as
+            tarte.utils.tsv.TsvReader.parse_lines does: after a token whose `breakline` column is `breakline_data`,
+            and in sentences of `max_sent_len` tokens (a sentence keeps at most `max_sent_len` + 1 tokens in memory)
+
+        :param lines: Iterator over lines (such as an open file) where the header was already consumed
+        :param sep: Column separator
+        :param breakline: Column whose value marks the end of a sentence
+        :param breakline_data: Value of the `breakline` column at the end of a sentence
+        :param max_sent_len: Maximum length of sentences
+        :param with_breaks: Yield each sentence with whether it was followed by a blank line (or the end of lines)
+        """
+        sentence = []
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                if sentence:
+                    yield (sentence, True) if with_breaks else sentence
+                    sentence = []
+                continue
+            row = line.split(sep)
+
+            if sentence and breakline is not None and len(sentence[-1]) > breakline and \
+                    sentence[-1][breakline] == breakline_data:
+                yield (sentence, False) if with_breaks else sentence
+                sentence = []
+            elif max_sent_len is not None and len(sentence) > max_sent_len:
+                yield (sentence[:max_sent_len], False) if with_breaks else sentence[:max_sent_len]
+                sentence = sentence[max_sent_len:]
+            sentence.append(row)
+        if sentence:
+            yield (sentence, True) if with_breaks else sentence
+
+    @staticmethod
+    def read_header(line: str, sep: str = "\t") -> List[str]:
+        """ Parse the header of a TSV file to tag, which requires a lemma and a POS column
+        """
+        header = line.rstrip("\r\n").split(sep)
+        if constants.lemma_task_name not in header or constants.pos_task_name not in header:
+            raise ValueError("Header should have `{}` and `{}` columns, got {}".format(
+                constants.lemma_task_name, constants.pos_task_name, header))
+        return header
+
+    def tag_file(self, input_path: str, output_path: str, formatter=None, batch_size=None,
+                 sep: str = "\t") -> Tuple[int, int]:
+        """ Disambiguate a TSV file with a header (such as pie's output) sentence by sentence
+            and write it with its lemma column disambiguated
+
+        Only the sentences waiting for predictions are kept in memory. Both files may be compressed,
+        see tarte.utils.compression.
+
+        :param input_path: File to disambiguate
+        :param output_path: File to write
+        :param formatter: Function to join the index and the lemma
+        :param batch_size: Number of ambiguous tokens predicted at once
+        :param sep: Column separator
+        :return: Number of sentences and of tokens tagged
+        """
+        with open_file(input_path) as inp, open_file(output_path, "w") as out:
+            header = self.read_header(next(inp), sep=sep)
+            out.write(sep.join(header) + "\n")
+            return self.tag_lines(inp, out, header, formatter=formatter, batch_size=batch_size, sep=sep)
+
+    def tag_lines(self, lines: Iterator[str], out: TextIO, header: List[str], formatter=None, batch_size=None,
+                  sep: str = "\t") -> Tuple[int, int]:
+        """ Disambiguate TSV lines (without their header) and write them to `out`
+
+        :param lines: Iterator over lines
+        :param out: File-like object to write to
+        :param header: Header of the file the lines come from
+        :param formatter: Function to join the index and the lemma
+        :param batch_size: Number of ambiguous tokens predicted at once
+        :param sep: Column separator
+        :return: Number of sentences and of tokens tagged
+        """
+        lemma_column = header.index(constants.lemma_task_name)
+        pos_column = header.index(constants.pos_task_name)
+        if not self.breakline_ref:
+            breakline = None
+        elif self.breakline_ref == "input":
+            breakline = 0
+        elif self.breakline_ref in header:
+            breakline = header.index(self.breakline_ref)
+        else:
+            raise ValueError("Header should have the `{}` column which ends sentences, got {}".format(
+                self.breakline_ref, header))
+
+        # Sentences read but not written yet
+        queue = deque()
+        n_sents, n_tokens = 0, 0
+
+        def sentences():
+            for sentence, blank in self.read_sentences(lines, sep=sep, breakline=breakline,
+                                                       breakline_data=self.breakline_data,
+                                                       max_sent_len=self.max_sent_len, with_breaks=True):
+                queue.append((sentence, blank))
+                yield [(row[0], row[lemma_column], row[pos_column]) for row in sentence]
+
+        for lemmas in self.tag(sentences(), formatter=formatter, batch_size=batch_size):
+            sentence, blank = queue.popleft()
+            for row, lemma in zip(sentence, lemmas):
+                row[lemma_column] = lemma
+                out.write(sep.join(row) + "\n")
+            # Sentences split without a blank line are written as they were read
+            if blank:
+                out.write("\n")
+            n_sents += 1
+            n_tokens += len(sentence)
+
+        return n_sents, n_tokens
+
+    def tag_files(self, files: List[str], outputs: List[str], workers: int = 1,
+                  batch_size=None) -> Dict[str, Tuple[int, int, float]]:
+        """ Disambiguate files using `workers` processes which share the model weights
+
+        Each file is cut into ranges of sentences which are tagged by the workers in any order,
+        ranges are then concatenated in their original order so that output does not depend on `workers`.
+        Compressed files are tagged as a single range, see sentence_ranges.
+
+        :param files: Files to disambiguate
+        :param outputs: Path where each file should be written
+        :param workers: Number of processes
+        :param batch_size: Number of ambiguous tokens predicted at once
+        :return: Number of sentences, tokens and seconds of tagging for each worker. Each worker has its own copy
+            of the cache, whose counters are added to the ones of `self.cache`, see LRUCache.add_counts
+        """
+        # Weights are moved to shared memory, workers only read them
+        self.model.share_memory()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+        tmpdir = tempfile.mkdtemp(prefix="tarte-")
+        tasks = [
+            (file, start, end, os.path.join(tmpdir, "{}-{}.part".format(file_index, range_index)), batch_size)
+            for file_index, file in enumerate(files)
+            for range_index, (start, end) in enumerate(sentence_ranges(file, workers))
+        ]
+
+        stats = defaultdict(lambda: (0, 0, 0.))
+        try:
+            with torch.multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self, threads)) as pool:
+                for worker, n_sents, n_tokens, elapsed, counts in pool.imap_unordered(_tag_range, tasks):
+                    w_sents, w_tokens, w_elapsed = stats[worker]
+                    stats[worker] = (w_sents + n_sents, w_tokens + n_tokens, w_elapsed + elapsed)
+                    if counts:
+                        self.cache.add_counts(counts)
+
+            # Merge ranges in order
+            for file, output in zip(files, outputs):
+                with open_file(file) as inp:
+                    header = next(inp)
+                with open_file(output, "w") as out:
+                    out.write(header.rstrip("\r\n") + "\n")
+                    for (task_file, _, _, part, _) in tasks:
+                        if task_file == file:
+                            with open(part) as f:
+                                shutil.copyfileobj(f, out)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        return dict(stats)
 
+    def count_targets(self, rows: SentenceList[Sentence[WordAnnotations[str]]]) -> int:
+        """ Number of tokens, in `rows`, whose lemma need the model
+        """
+        routes = self.output_encoder.routes
+        return sum(
+            1
+            for sentence in rows
+            for (_, lemma, *_) in sentence
+            if routes.get(lemma, OutputEncoder.PASSTHROUGH) is None
+        )
+
+    def sentence_to_contexts(self, sentence, indexes):
+        """ Read the contexts of the targets of a sentence, following the context window of the model
+
+        Targets with the same context (the whole sentence if the model has no window) share it.
+
+        :param sentence: Sentence as a list of word annotations
+        :param indexes: Indexes of the targets in the sentence
+        :return: List of (offset, (lem_lst, pos_lst, tok_lst, indexes)) where offset is the index of the context
+            in the sentence and indexes are relative to the context
+        """
+        tok_lst, lem_lst, pos_lst, *_ = zip(*sentence)
+        windows = OrderedDict()
+        for index in indexes:
+            windows.setdefault(get_window_bounds(index, len(sentence), self.model.context_window), []).append(index)
+        return [
+            (start, (lem_lst[start:end], pos_lst[start:end], tok_lst[start:end], [index - start for index in group]))
+            for (start, end), group in windows.items()
+        ]
+
+    @staticmethod
+    def chunk_sentences(pending, batch_size):
+        """ Group contexts so that each group holds about `batch_size` targets. A context is never split.
+        """
+        batch, n_targets = [], 0
+        for out, offset, context in pending:
+            batch.append((out, offset, context))
+            n_targets += len(context[-1])
+            if n_targets >= batch_size:
+                yield batch
+                batch, n_targets = [], 0
+        if batch:
+            yield batch
+
+    def cache_key(self, index, context):
+        """ Key of a target in the prediction cache: the target and a hash of its context window
+
+        :param index: Index of the target in its context
+        :param context: Context as given by sentence_to_contexts
+        """
+        lem_lst, pos_lst, tok_lst, _ = context
+        start, end = get_window_bounds(index, len(lem_lst), self.cache_window)
+        return (
+            lem_lst[index], pos_lst[index], tok_lst[index],
+            hash((lem_lst[start:end], pos_lst[start:end], tok_lst[start:end]))
+        )
+
+    def read_cache(self, pending, formatter):
+        """ Fill targets whose prediction is cached and keep a single target for each unknown key
+
+        :param pending: List of (sentence output, context offset, context)
+        :param formatter: Function to join the index and the lemma
+        :return: Contexts with targets left to predict, and the targets waiting for each key to be predicted
+        """
+        to_predict, waiting = [], {}
+        for out, offset, context in pending:
+            indexes = []
+            for index in context[-1]:
+                key = self.cache_key(index, context)
+                if key in waiting:  # Same key already in the batch
+                    waiting[key].append((out, offset, index, context))
+                    self.cache.deduplicated += 1
+                    continue
+                cached = self.cache.get(key)
+                if cached is not None:
+                    prediction, _ = cached
+                    out[offset + index] = self.format_prediction(index, context, prediction, formatter)
                 else:
-                    out.append(lemma)
-            yield out
+                    waiting[key] = []
+                    indexes.append(index)
+            if indexes:
+                to_predict.append((out, offset, context[:-1] + (indexes, )))
+        return to_predict, waiting
+
+    def predict_targets(self, pending, formatter, batch_size):
+        """ Predict targets by batches of about `batch_size` and write each prediction in place in its sentence output
+
+        :param pending: List of (sentence output, context offset, context) where context is given by sentence_to_contexts
+        :param formatter: Function to join the index and the lemma
+        :param batch_size: Number of targets per forward pass
+        """
+        if self.cache is not None:
+            pending, waiting = self.read_cache(pending, formatter)
+
+        for batch in self.chunk_sentences(pending, batch_size):
+            with torch.no_grad():
+                probs, predictions = self.model.predict_sentences(
+                    Dataset._pack_sentences(
+                        self.label_encoder,
+                        [context for (_, _, context) in batch],
+                        device=self.device
+                    )
+                )
+            predictions = iter(zip(probs, predictions))
+            for out, offset, context in batch:
+                for index in context[-1]:
+                    prob, prediction = next(predictions)
+                    out[offset + index] = self.format_prediction(index, context, prediction, formatter)
+
+                    if self.cache is not None:
+                        key = self.cache_key(index, context)
+                        self.cache.put(key, (prediction, prob))
+                        for (w_out, w_offset, w_index, w_context) in waiting.pop(key):
+                            w_out[w_offset + w_index] = self.format_prediction(
+                                w_index, w_context, prediction, formatter)
+
+    @staticmethod
+    def format_prediction(index, context, prediction, formatter):
+        """ Format the prediction of a target
+
+        :param index: Index of the target in its context
+        :param context: Context as given by sentence_to_contexts
+        :param prediction: Predicted category
+        :param formatter: Function to join the index and the lemma
+        """
+        # Predictions are restricted to the classes of the lemma, or the unknown class
+        if isinstance(prediction, tuple):
+            return formatter(*prediction)
+        return context[0][index]  # If UNKNOWN, we keep the lemma
+
+
+def sentence_ranges(path: str, n: int) -> List[Tuple[int, Optional[int]]]:
+    """ Cut a TSV file, after its header, into at most `n` byte ranges which start and end on sentence breaks
+
+    Compressed files are not cut, as seeking in them means decompressing them up to the offset: they are a single
+    range whose end is None.
+
+    :param path: File to cut
+    :param n: Number of ranges wanted
+    :return: List of (start, end) byte offsets
+    """
+    if is_compressed(path):
+        with open_file(path, "rb") as f:
+            f.readline()  # Header
+            return [(f.tell(), None)]
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()  # Header
+        boundaries = [f.tell()]
+        for index in range(1, n):
+            f.seek(max(boundaries[-1], boundaries[0] + (size - boundaries[0]) * index // n))
+            f.readline()  # We might have landed in the middle of a line
+            line = f.readline()
+            while line and line.strip():
+                line = f.readline()
+            if f.tell() >= size:
+                break
+            boundaries.append(f.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def read_range(path: str, start: int, end: Optional[int]) -> Iterator[str]:
+    """ Read the lines of a file between two byte offsets, up to its end if `end` is None
+    """
+    with open_file(path, "rb") as f:
+        f.seek(start)
+        while end is None or start < end:
+            line = f.readline()
+            if not line:
+                break
+            start += len(line)
+            yield line.decode("utf-8")
+
+
+# Tagger of the current worker process, set by _init_worker
+_worker_tagger: Tagger = None
+
+
+def _init_worker(tagger: Tagger, threads: int):
+    global _worker_tagger
+    _worker_tagger = tagger
+    torch.set_num_threads(threads)
+
+
+def _tag_range(task):
+    """ Tag a range of a file into a part file, in a worker process
+
+    :return: Worker, number of sentences and tokens, seconds of tagging, and the cache counters of the range
+    """
+    path, start, end, part, batch_size = task
+    started = time.time()
+    cache = _worker_tagger.cache
+    before = cache.counts() if cache is not None else {}
+    with open_file(path) as f:
+        header = _worker_tagger.read_header(next(f))
+    with open(part, "w") as out:
+        n_sents, n_tokens = _worker_tagger.tag_lines(read_range(path, start, end), out, header, batch_size=batch_size)
+    counts = {name: value - before[name] for name, value in cache.counts().items()} if cache is not None else {}
+    return "worker-{}".format(os.getpid()), n_sents, n_tokens, time.time() - started, counts
 
 
 if __name__ == "__main__":
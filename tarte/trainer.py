@@ -13,6 +13,7 @@ logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO)
 import pie.trainer as trainer
 
 from .utils import constants
+from .utils.prefetch import Prefetcher
 
 
 class EarlyStopException(trainer.EarlyStopException):
@@ -34,6 +35,8 @@ class Trainer(trainer.Trainer):
     weights
     report_freq
     checks_per_epoch
+    prefetch : number of batches built ahead in the background, see tarte.utils.prefetch.Prefetcher
+    prefetch_mode : "thread" or "process", where batches are built in the background
     """
     def __init__(self, settings, model, dataset, num_instances):
         self.verbose = settings.verbose
@@ -44,6 +47,7 @@ class Trainer(trainer.Trainer):
         self.clip_norm = settings.clip_norm
 
         self.report_freq = settings.report_freq
+        self.prefetcher = Prefetcher(dataset, depth=settings.prefetch or 0, mode=settings.prefetch_mode or "thread")
         self.num_batches = num_instances // dataset.batch_size
         if settings.checks_per_epoch == 1:
             self.check_freq = self.num_batches - 1  # check after last batch
@@ -134,7 +138,8 @@ class Trainer(trainer.Trainer):
         rep_items, rep_start = 0, time.time()
         scores = None
 
-        for b, batch in enumerate(self.dataset.batch_generator()):
+        self.prefetcher.take_wait()
+        for b, batch in enumerate(self.prefetcher):
             # get loss
             loss = self.model.loss(batch)
 
@@ -157,8 +162,8 @@ class Trainer(trainer.Trainer):
             if self.report_freq and b > 0 and b % self.report_freq == 0:
                 rep = 'Disambiguation:{:.3f}  '.format(rep_loss / rep_batches)
 
-                logging.info("Batch [{}/{}] || {} || {:.0f} w/s".format(
-                    b, self.num_batches, rep, rep_items / (time.time() - rep_start)))
+                logging.info("Batch [{}/{}] || {} || {:.0f} w/s || data wait {:.2f}s".format(
+                    b, self.num_batches, rep, rep_items / (time.time() - rep_start), self.prefetcher.take_wait()))
                 rep_loss = 0.
                 rep_batches = 0
                 rep_items, rep_start = 0, time.time()
@@ -167,6 +172,8 @@ class Trainer(trainer.Trainer):
                 if devset is not None:
                     scores = self.run_check(devset)
 
+        logging.info("Padding of epoch [{}] || {:.1%} of context tokens".format(epoch, self.dataset.padding_ratio))
+
         return scores
 
     def train_epochs(self, epochs, devset=None):
@@ -0,0 +1,61 @@
+from typing import Hashable, Any, Dict
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Bounded mapping which drops its least recently used entry once full
+
+    Counts hits, misses and evictions so that its size can be tuned, and `deduplicated`, a counter
+    callers can increment when they avoid a computation without going through the cache.
+    """
+    COUNTERS = ("hits", "misses", "evictions", "deduplicated")
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self._data: OrderedDict = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.deduplicated: int = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def counts(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.COUNTERS}
+
+    def add_counts(self, counts: Dict[str, int]):
+        """ Add counters to the ones of the cache, such as the counters of its copies in other processes """
+        for name, value in counts.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self),
+            "max_size": self.size,
+            **self.counts()
+        }
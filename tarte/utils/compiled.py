@@ -0,0 +1,314 @@
+""" Pre-encoded corpora
+
+A corpus is read through ReaderWrapper.readsentences and encoded with a fitted MultiEncoder once, then saved as
+a directory of .npy files which are memory-mapped when batches are built:
+
+    - lemma, pos, token: Array(sum(sentence lengths)) of the flat IDs of every sentence
+    - offsets: Array(sentences + 1) where the sentence `i` is [offsets[i]:offsets[i+1]]
+    - sentences: Array(targets) of the sentence of each target
+    - positions: Array(targets) of the index of each target in its sentence
+    - targets: Array(targets) of the class ID of each target
+    - chars, char_offsets: flat character IDs of the token of each target, and their offsets
+
+Each sentence is stored once, whatever its number of targets: the context window of each target is
+applied when its batch is built. A fingerprint of the encoder, of the reader settings and of the source files is saved in meta.json: a corpus
+whose fingerprint does not match is compiled again.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from itertools import chain
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .labels import MultiEncoder, pad_array
+from .reader import ReaderWrapper
+
+
+VERSION = 2
+META_FILE = "meta.json"
+# Number of targets encoded at once when compiling, if the reader settings have no buffer size
+CHUNK_SIZE = 10000
+ARRAYS = ("lemma", "pos", "token", "offsets", "sentences", "positions", "targets", "chars", "char_offsets")
+
+# Settings which change what the reader yields
+_READER_SETTINGS = ("header", "tasks_order", "sep", "breakline_ref", "breakline_data", "max_sent_len", "max_sents",
+                    "tasks")
+
+
+def encoder_digest(encoder: MultiEncoder) -> str:
+    """ Hash of the vocabularies of an encoder """
+    return hashlib.sha1(encoder.dumps().encode("utf-8")).hexdigest()
+
+
+def fingerprint(reader: ReaderWrapper, encoder: MultiEncoder, digest: Optional[str] = None) -> str:
+    """ Hash of everything the content of a compiled corpus depends on
+
+    Source files are identified by their path, size and modification time.
+
+    :param digest: encoder_digest of the encoder, if it is already known, as it is costly for large vocabularies
+    """
+    sha = hashlib.sha1()
+    sha.update(json.dumps({
+        "version": VERSION,
+        "context_window": reader.context_window,
+        "settings": {key: reader.settings.get(key) for key in _READER_SETTINGS},
+        "files": [
+            (os.path.realpath(fpath), os.stat(fpath).st_size, os.stat(fpath).st_mtime_ns)
+            for fpath in reader.filenames
+        ]
+    }, sort_keys=True).encode("utf-8"))
+    sha.update((digest or encoder_digest(encoder)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def cache_directory(cache_dir: str, reader: ReaderWrapper) -> str:
+    """ Directory of the compiled corpus of a reader: each set of files gets its own """
+    files = [os.path.realpath(fpath) for fpath in reader.filenames]
+    name = os.path.splitext(os.path.basename(files[0]))[0]
+    return os.path.join(cache_dir, "{}-{}".format(name, hashlib.sha1("\n".join(files).encode("utf-8")).hexdigest()[:12]))
+
+
+def ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """ Concatenated [start:start+length] ranges of indexes
+
+    :param starts: Array(n) of the start of each range
+    :param lengths: Array(n) of the length of each range
+    :return: Array(sum(lengths))
+    """
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) + np.repeat(starts - ends + lengths, lengths)
+
+
+def bucket_batches(lengths: np.ndarray, batch_size: int, buckets: int, shuffle: bool = False) -> List[np.ndarray]:
+    """ Split targets in batches of targets of similar context lengths, to minimize padding
+
+    Targets are sorted by length and cut in `buckets` buckets of the same number of targets, so that skewed
+    distributions of lengths still get buckets of use. Batches never mix buckets.
+
+    :param lengths: Array(targets) of the context length of each target
+    :param batch_size: Number of targets per batch
+    :param buckets: Number of buckets
+    :param shuffle: Shuffle targets inside each bucket, and the order of the batches
+    :return: List of Array(batch_size) of indexes in `lengths`
+    """
+    batches = []
+    for bucket in np.array_split(np.argsort(lengths, kind="stable"), max(1, min(buckets, len(lengths)))):
+        if shuffle:
+            bucket = np.random.permutation(bucket)
+        batches.extend(bucket[i:i + batch_size] for i in range(0, len(bucket), batch_size))
+    if shuffle:
+        np.random.shuffle(batches)
+    return batches
+
+
+class CompiledCorpus:
+    def __init__(self, arrays: Dict[str, np.ndarray], fingerprint: Optional[str] = None,
+                 context_window: Optional[int] = None):
+        """
+
+        :param arrays: Arrays of the corpus, see the module documentation
+        :param fingerprint: Fingerprint of the encoder and of the source of the corpus
+        :param context_window: Number of tokens kept on each side of targets, whole sentence if None
+        """
+        self.arrays = arrays
+        self.fingerprint = fingerprint
+        self.context_window = context_window
+
+    def __len__(self):
+        return len(self.arrays["targets"])
+
+    @classmethod
+    def encode(cls, encoder: MultiEncoder, sentences: List[Tuple[List[str], List[str], List[str]]],
+               targets: List[Tuple[int, int, str]], context_window: Optional[int] = None) -> "CompiledCorpus":
+        """ Encode sentences once, and their targets
+
+        :param sentences: List of (sentence_in_lemma, sentence_in_pos, sentence_in_tokens)
+        :param targets: List of (sentence_id, target index, disambiguated ID)
+        :param context_window: Number of tokens kept on each side of targets, whole sentence if None
+        """
+        lengths = np.fromiter((len(tok_lst) for _, _, tok_lst in sentences), dtype=np.int64, count=len(sentences))
+        sentence_ids = np.fromiter((sentence_id for sentence_id, _, _ in targets), dtype=np.int64, count=len(targets))
+        positions = np.fromiter((index for _, index, _ in targets), dtype=np.int64, count=len(targets))
+
+        classes, chars = [], []
+        for sentence_id, index, disambiguation in targets:
+            lem_lst, _, tok_lst = sentences[sentence_id]
+            classes.append(encoder.get_category(lem_lst[index], disambiguation))
+            chars.append(encoder.char.encode(tok_lst[index]))
+        char_lengths = np.fromiter(map(len, chars), dtype=np.int64, count=len(chars))
+
+        arrays = {
+            name: getattr(encoder, name).transform_array(
+                list(chain.from_iterable(sentence[column] for sentence in sentences))).astype(np.int32)
+            for column, name in enumerate(("lemma", "pos", "token"))
+        }
+        arrays.update({
+            "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            "sentences": sentence_ids,
+            "positions": positions,
+            "targets": encoder.output.transform_array(classes),
+            "chars": np.fromiter(chain.from_iterable(chars), dtype=np.int32, count=int(char_lengths.sum())),
+            "char_offsets": np.concatenate([[0], np.cumsum(char_lengths)]).astype(np.int64)
+        })
+        return cls(arrays, context_window=context_window)
+
+    @classmethod
+    def concatenate(cls, corpora: List["CompiledCorpus"], context_window: Optional[int] = None) -> "CompiledCorpus":
+        """ Join corpora, one after the other """
+        arrays = {
+            name: np.concatenate([corpus.arrays[name] for corpus in corpora])
+            for name in ("lemma", "pos", "token", "positions", "targets", "chars")
+        }
+        # Offsets and sentence IDs of each corpus start after the ones of the corpora before it
+        offsets, char_offsets, sentences = [np.zeros(1, dtype=np.int64)], [np.zeros(1, dtype=np.int64)], []
+        n_sentences = 0
+        for corpus in corpora:
+            sentences.append(corpus.arrays["sentences"] + n_sentences)
+            offsets.append(corpus.arrays["offsets"][1:] + offsets[-1][-1])
+            char_offsets.append(corpus.arrays["char_offsets"][1:] + char_offsets[-1][-1])
+            n_sentences += len(corpus.arrays["offsets"]) - 1
+        arrays.update({
+            "offsets": np.concatenate(offsets),
+            "char_offsets": np.concatenate(char_offsets),
+            "sentences": np.concatenate(sentences)
+        })
+        return cls(arrays, context_window=context_window)
+
+    @classmethod
+    def compile(cls, reader: ReaderWrapper, encoder: MultiEncoder, chunk_size: Optional[int] = None,
+                expected: Optional[str] = None) -> "CompiledCorpus":
+        """ Read and encode every sentence of a reader. Sentences are encoded by chunks, so that only the
+            arrays of the corpus are kept whole in memory.
+
+        :param chunk_size: Number of targets encoded at once, `buffer_size` of the reader settings by default
+        :param expected: Fingerprint of the reader and of the encoder, if it is already known
+        """
+        chunk_size = chunk_size or reader.settings.buffer_size or CHUNK_SIZE
+        chunks, sentences, targets = [], [], []
+        for _, sentence, sentence_targets in reader.readsentences():
+            targets.extend((len(sentences), index, disambiguation) for index, disambiguation in sentence_targets)
+            sentences.append(sentence)
+            if len(targets) >= chunk_size:
+                chunks.append(cls.encode(encoder, sentences, targets))
+                sentences, targets = [], []
+        if targets or not chunks:
+            chunks.append(cls.encode(encoder, sentences, targets))
+        corpus = cls.concatenate(chunks, context_window=reader.context_window)
+        corpus.fingerprint = expected or fingerprint(reader, encoder)
+        return corpus
+
+    def save(self, directory: str) -> str:
+        """ Save the arrays as .npy files. The metadata are written last, so that an interrupted save is
+            not taken for a valid corpus.
+        """
+        os.makedirs(directory, exist_ok=True)
+        meta = os.path.join(directory, META_FILE)
+        if os.path.exists(meta):
+            os.remove(meta)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), self.arrays[name])
+        with open(meta, "w") as f:
+            json.dump({"version": VERSION, "fingerprint": self.fingerprint, "context_window": self.context_window,
+                       "targets": len(self)}, f)
+        return directory
+
+    @classmethod
+    def load(cls, directory: str, expected: Optional[str] = None) -> Optional["CompiledCorpus"]:
+        """ Memory-map a compiled corpus
+
+        :param directory: Directory of the corpus
+        :param expected: If set, fingerprint the corpus must have
+        :return: Corpus, or None if it does not exist or if it is outdated
+        """
+        try:
+            with open(os.path.join(directory, META_FILE)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != VERSION or (expected is not None and meta["fingerprint"] != expected):
+            return None
+        return cls(
+            {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r") for name in ARRAYS},
+            meta["fingerprint"], context_window=meta["context_window"]
+        )
+
+    @classmethod
+    def get(cls, cache_dir: str, reader: ReaderWrapper, encoder: MultiEncoder,
+            expected: Optional[str] = None) -> "CompiledCorpus":
+        """ Load the compiled corpus of a reader from `cache_dir`, compiling it if it is missing or outdated
+
+        :param expected: Fingerprint of the reader and of the encoder, if it is already known
+        """
+        directory = cache_directory(cache_dir, reader)
+        expected = expected or fingerprint(reader, encoder)
+        corpus = cls.load(directory, expected=expected)
+        if corpus is None:
+            cls.compile(reader, encoder, expected=expected).save(directory)
+            corpus = cls.load(directory)
+        return corpus
+
+    def contexts(self, indexes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Context of targets in the flat arrays, see tarte.utils.reader.get_window_bounds
+
+        :return: Array(targets) of the start of each context, Array(targets) of its length,
+            Array(targets) of the index of each target in its context
+        """
+        sentences = self.arrays["sentences"][indexes]
+        positions = self.arrays["positions"][indexes]
+        starts = self.arrays["offsets"][sentences]
+        if self.context_window is None:
+            return starts, self.arrays["offsets"][sentences + 1] - starts, positions
+        begin = np.maximum(0, positions - self.context_window)
+        end = np.minimum(self.arrays["offsets"][sentences + 1] - starts, positions + self.context_window + 1)
+        return starts + begin, end - begin, positions - begin
+
+    def batches(self, batch_size: int, shuffle: bool = False, minimize_pad: bool = False,
+                buffer_size: Optional[int] = None, buckets: int = 0) -> Iterator[np.ndarray]:
+        """ Split the targets in batches, as pie.data.dataset.Dataset.prepare_buffer does for each buffer
+
+        :param buckets: If set, the targets of each buffer are batched by length in this number of buckets,
+            see bucket_batches
+        :return: Iterator of Array(batch_size) of target indexes
+        """
+        indexes = np.arange(len(self), dtype=np.int64)
+        buffer_size = buffer_size or len(self) or 1
+        batches = []
+        for start in range(0, len(self), buffer_size):
+            buf = indexes[start:start + buffer_size]
+            if buckets:
+                batches.extend(buf[batch] for batch in bucket_batches(
+                    self.contexts(buf)[1], batch_size, buckets, shuffle=shuffle))
+                continue
+            if minimize_pad:
+                buf = buf[np.argsort(-self.contexts(buf)[1], kind="stable")]
+            elif shuffle:
+                buf = np.random.permutation(buf)
+            buf_batches = [buf[i:i + batch_size] for i in range(0, len(buf), batch_size)]
+            if shuffle:
+                np.random.shuffle(buf_batches)
+            batches.extend(buf_batches)
+        return iter(batches)
+
+    def pack(self, indexes: np.ndarray, char_pad: int = 0):
+        """ Build the arrays of a batch of targets, in the format of MultiEncoder.transform
+
+        :param indexes: Array(batch_size) of target indexes
+        :param char_pad: Padding ID of characters
+        """
+        arrays = self.arrays
+        starts, lengths, positions = self.contexts(indexes)
+        flat = ranges(starts, lengths)
+        # Position of each target in the flat arrays
+        targets = starts + positions
+
+        char_starts = arrays["char_offsets"][indexes]
+        char_lengths = arrays["char_offsets"][indexes + 1] - char_starts
+        chars = arrays["chars"][ranges(char_starts, char_lengths)]
+
+        return (
+            tuple(arrays[name][targets].astype(np.int64) for name in ("lemma", "pos", "token")),
+            (pad_array(chars, char_lengths, char_pad), char_lengths),
+            *((pad_array(arrays[name][flat], lengths, 0), lengths) for name in ("token", "lemma", "pos"))
+        ), arrays["targets"][indexes]
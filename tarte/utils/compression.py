@@ -0,0 +1,49 @@
+""" Files compressed with the formats of the standard library, which are read and written as streams
+
+The compression of a file is given by its extension: `.gz` (gzip), `.bz2` (bzip2) or `.xz` (lzma). Other files
+are opened as they are.
+"""
+from typing import IO, Optional
+import bz2
+import gzip
+import lzma
+import os
+
+COMPRESSIONS = {
+    ".gz": gzip,
+    ".bz2": bz2,
+    ".xz": lzma
+}
+
+
+def compression(fpath: str) -> Optional[str]:
+    """ Compression extension of a file, or None if it is not compressed """
+    extension = os.path.splitext(fpath)[1].lower()
+    return extension if extension in COMPRESSIONS else None
+
+
+def is_compressed(fpath: str) -> bool:
+    return compression(fpath) is not None
+
+
+def strip_compression(fpath: str) -> str:
+    """ Path of a file without its compression extension, such as `corpus.tsv` for `corpus.tsv.gz` """
+    if is_compressed(fpath):
+        return os.path.splitext(fpath)[0]
+    return fpath
+
+
+def open_file(fpath: str, mode: str = "r", encoding: Optional[str] = None, newline: Optional[str] = None) -> IO:
+    """ Open a file as `open` does, decompressing or compressing it on the fly if its extension is a compression
+
+    :param fpath: Path of the file
+    :param mode: Mode, where text mode is the default as with `open`
+    :param encoding: Encoding of text modes
+    :param newline: Newline handling of text modes, see `open`
+    """
+    module = COMPRESSIONS.get(compression(fpath))
+    if module is None:
+        return open(fpath, mode, encoding=encoding, newline=newline)
+    if "b" in mode:
+        return module.open(fpath, mode)
+    return module.open(fpath, mode.replace("t", "") + "t", encoding=encoding, newline=newline)
@@ -1,3 +1,6 @@
+from typing import Tuple
+
+import numpy as np
 import torch
 
 import pie.data.dataset
@@ -7,9 +10,26 @@ import pie.torch_utils as torch_utils
 
 
 from .labels import MultiEncoder
+from .compiled import CompiledCorpus, bucket_batches, encoder_digest, fingerprint
+from .reader import get_window_bounds
+from .tsv import RandomAccessCorpus
 
 
 class Dataset(pie.data.dataset.Dataset):
+    """ See pie.data.dataset.Dataset
+
+    Settings
+    ===========
+    cache_dir : str, if set, directory where the corpus is saved pre-encoded once the encoder is fitted,
+        see tarte.utils.compiled. Training batches are then built from the memory-mapped arrays.
+    sentence_mode : bool, if set, each sentence is read and encoded once for all of its targets,
+        and batches are built from (sentence_id, index) pairs, see Dataset.sentence_batch_generator
+    random_access : bool, if set, targets are shuffled over the whole corpus instead of within buffers, and their
+        sentences are read from memory-mapped files, see Dataset.random_access_batch_generator
+    buckets : int, if set, the targets of each buffer are batched with targets of similar context lengths, in this
+        number of buckets, see tarte.utils.compiled.bucket_batches. It replaces minimize_pad, and does not apply
+        to random_access, which reads batches without knowing the length of their sentences.
+    """
     def __init__(
             self,
             settings: pie.settings.Settings,
@@ -17,6 +37,162 @@ class Dataset(pie.data.dataset.Dataset):
             multiencoder: MultiEncoder
     ):
         super(Dataset, self).__init__(settings=settings, reader=reader, label_encoder=multiencoder)
+        self.cache_dir = settings.cache_dir
+        self.sentence_mode = bool(settings.sentence_mode)
+        self.random_access = bool(settings.random_access)
+        self.buckets = settings.buckets or 0
+        # Tokens and padded cells of the contexts of the batches of the last pass, see padding_ratio
+        self.context_tokens, self.context_cells = 0, 0
+        self._compiled: CompiledCorpus = None
+        # Encoder whose digest was computed, and its digest, see compiled
+        self._encoder_digest: Tuple[MultiEncoder, str] = (None, None)
+        self._random_access: RandomAccessCorpus = None
+
+    @property
+    def compiled(self) -> CompiledCorpus:
+        """ Pre-encoded corpus, compiled again when the encoder or the files changed. The encoder is hashed once,
+            and again only if it is replaced by another one.
+        """
+        if self._encoder_digest[0] is not self.label_encoder:
+            self._encoder_digest = (self.label_encoder, encoder_digest(self.label_encoder))
+        expected = fingerprint(self.reader, self.label_encoder, digest=self._encoder_digest[1])
+        if self._compiled is None or self._compiled.fingerprint != expected:
+            self._compiled = CompiledCorpus.get(self.cache_dir, self.reader, self.label_encoder, expected=expected)
+        return self._compiled
+
+    @property
+    def padding_ratio(self) -> float:
+        """ Share of padding in the contexts of the batches of the last pass over the dataset """
+        if not self.context_cells:
+            return 0.
+        return 1 - self.context_tokens / self.context_cells
+
+    def batch_generator(self, return_raw=False):
+        """ See pie.data.dataset.Dataset.batch_generator
+
+        Without raw data, batches come from the pre-encoded corpus if there is a cache directory
+        and the encoder is fitted. The padding of the batches is counted, see padding_ratio.
+        """
+        self.context_tokens, self.context_cells = 0, 0
+        for batch in self._batch_generator(return_raw=return_raw):
+            # Tensor(batch_size) of the length of each context
+            lengths = (batch[0] if return_raw else batch)[0][2][1]
+            if len(lengths):
+                self.context_tokens += int(lengths.sum())
+                self.context_cells += int(lengths.max()) * len(lengths)
+            yield batch
+
+    def _batch_generator(self, return_raw=False):
+        if return_raw or not self.cache_dir or not self.label_encoder.fitted:
+            if self.random_access:
+                yield from self.random_access_batch_generator(return_raw=return_raw)
+            elif self.sentence_mode:
+                yield from self.sentence_batch_generator(return_raw=return_raw)
+            else:
+                yield from super(Dataset, self).batch_generator(return_raw=return_raw)
+            return
+
+        corpus = self.compiled
+        for indexes in corpus.batches(self.batch_size, shuffle=self.shuffle, minimize_pad=self.minimize_pad,
+                                      buffer_size=self.buffer_size, buckets=self.buckets):
+            yield self._to_batch(corpus.pack(indexes, self.label_encoder.char.get_pad()), self.device)
+
+    def prepare_buffer(self, buf, return_raw=False, **kwargs):
+        """ See pie.data.dataset.Dataset.prepare_buffer, where the buffer is batched by context length
+            if `buckets` is set
+        """
+        if not self.buckets:
+            yield from super(Dataset, self).prepare_buffer(buf, return_raw=return_raw, **kwargs)
+            return
+
+        # Sentence in tokens of each (InputAnnotation, disambiguated ID)
+        lengths = np.fromiter((len(tokens[5]) for tokens, _ in buf), dtype=np.int64, count=len(buf))
+        for indexes in bucket_batches(lengths, self.batch_size, self.buckets, shuffle=self.shuffle):
+            batch = [buf[index] for index in indexes.tolist()]
+            packed = self.pack_batch(batch, **kwargs)
+            if return_raw:
+                yield packed, tuple(zip(*batch))
+            else:
+                yield packed
+
+    def sentence_batch_generator(self, return_raw=False):
+        """ Same batches as batch_generator, where sentences are read and encoded once, whatever their number of
+            targets. Buffers hold `buffer_size` targets as (sentence_id, index, disambiguation).
+        """
+        sentences, targets = [], []
+        for _, sentence, sentence_targets in self.reader.readsentences():
+            sentences.append(sentence)
+            for index, disambiguation in sentence_targets:
+                targets.append((len(sentences) - 1, index, disambiguation))
+                if len(targets) == self.buffer_size:
+                    yield from self.prepare_sentences(sentences, targets, return_raw=return_raw)
+                    # The rest of the targets of the sentence go in the next buffer
+                    sentences, targets = [sentence], []
+
+        if targets:
+            yield from self.prepare_sentences(sentences, targets, return_raw=return_raw)
+
+    def prepare_sentences(self, sentences, targets, return_raw=False):
+        """ Encode a buffer of sentences and batch their targets, see sentence_batch_generator """
+        corpus = CompiledCorpus.encode(self.label_encoder, sentences, targets,
+                                       context_window=self.reader.context_window)
+        for indexes in corpus.batches(self.batch_size, shuffle=self.shuffle, minimize_pad=self.minimize_pad,
+                                      buckets=self.buckets):
+            yield self.pack_targets(corpus, sentences, targets, indexes, return_raw=return_raw)
+
+    def pack_targets(self, corpus: CompiledCorpus, sentences, targets, indexes, return_raw=False):
+        """ Pack a batch of targets of encoded sentences
+
+        :param corpus: Sentences and targets, encoded by CompiledCorpus.encode
+        :param sentences: List of (sentence_in_lemma, sentence_in_pos, sentence_in_tokens)
+        :param targets: List of (sentence_id, target index, disambiguated ID)
+        :param indexes: Array(batch_size) of the targets of the batch
+        """
+        packed = self._to_batch(corpus.pack(indexes, self.label_encoder.char.get_pad()), self.device)
+        if not return_raw:
+            return packed
+
+        # Raw data, as given by ReaderWrapper.readsents
+        raw = []
+        for index in indexes.tolist():
+            sentence_id, position, disambiguation = targets[index]
+            lem_lst, pos_lst, tok_lst = sentences[sentence_id]
+            start, end = get_window_bounds(position, len(tok_lst), self.reader.context_window)
+            raw.append((
+                (lem_lst[position], pos_lst[position], tok_lst[position],
+                 lem_lst[start:end], pos_lst[start:end], tok_lst[start:end]),
+                disambiguation
+            ))
+        return packed, tuple(zip(*raw))
+
+    @property
+    def random_access_corpus(self) -> RandomAccessCorpus:
+        if self._random_access is None:
+            self._random_access = RandomAccessCorpus(self.reader.settings, *self.reader.filenames)
+        return self._random_access
+
+    def random_access_batch_generator(self, return_raw=False):
+        """ Batches of targets in a random order over the whole corpus if `shuffle` is set, whose sentences
+            are read from memory maps of the files, see tarte.utils.tsv.RandomAccessCorpus
+        """
+        corpus = self.random_access_corpus
+        for target_ids in corpus.batches(self.batch_size, shuffle=self.shuffle):
+            sentences, targets = corpus.read(target_ids)
+            encoded = CompiledCorpus.encode(self.label_encoder, sentences, targets,
+                                            context_window=self.reader.context_window)
+            yield self.pack_targets(encoded, sentences, targets, np.arange(len(targets)), return_raw=return_raw)
+
+    @staticmethod
+    def _to_batch(packed, device=None):
+        """ Move arrays packed by CompiledCorpus.pack to tensors """
+        (triple, chars, forms, lemma, pos), targets = packed
+        return (
+            Dataset._to_tensors(triple, device=device),
+            Dataset._to_tensors(chars, device=device),
+            Dataset._to_tensors(forms, device=device),
+            Dataset._to_tensors(lemma, device=device),
+            Dataset._to_tensors(pos, device=device)
+        ), torch.from_numpy(targets).to(device)
 
     def pack_batch(self, batch, device=None):
         """ Finish up the batch
@@ -31,6 +207,11 @@ class Dataset(pie.data.dataset.Dataset):
     def get_nelement(batch):
         return len(batch[1])
 
+    @staticmethod
+    def _to_tensors(arrays, device=None):
+        """ Move numpy arrays to tensors """
+        return tuple(torch.from_numpy(array).to(device) for array in arrays)
+
     @staticmethod
     def _pack_batch(label_encoder: MultiEncoder, batch, device=None, with_target=True):
         """ Transform batch data to tensors
@@ -41,16 +222,31 @@ class Dataset(pie.data.dataset.Dataset):
             Tensor(3, batch_size) where 3 is (lem,pos,tok)
         """
         (to_categorize, chars, forms, lemma, pos), output_batch = label_encoder.transform(batch)
-        forms = torch_utils.pad_batch(forms, label_encoder.token.get_pad(), device=device)
-        lemma = torch_utils.pad_batch(lemma, label_encoder.lemma.get_pad(), device=device)
-        pos = torch_utils.pad_batch(pos, label_encoder.pos.get_pad(), device=device)
+        forms = Dataset._to_tensors(forms, device=device)
+        lemma = Dataset._to_tensors(lemma, device=device)
+        pos = Dataset._to_tensors(pos, device=device)
         chars = torch_utils.pad_batch(chars, label_encoder.char.get_pad(), device=device)
 
-        triple = tuple([
-            torch.tensor(cat, dtype=torch.int64, device=device)
-            for cat in zip(*to_categorize)
-        ])
+        triple = Dataset._to_tensors(to_categorize, device=device)
         if not with_target:
             return triple, chars, forms, lemma, pos
         # Triple is each thing encoded apart
-        return (triple, chars, forms, lemma, pos), torch.tensor(output_batch, dtype=torch.int64, device=device)
+        return (triple, chars, forms, lemma, pos), torch.from_numpy(output_batch).to(device)
+
+    @staticmethod
+    def _pack_sentences(label_encoder: MultiEncoder, sentences, device=None):
+        """ Transform sentences and the positions of their targets to tensors
+
+        Each sentence is packed once, whatever its number of targets.
+            Forms, lemma, pos batches are Tuple(Tensor(max_len, sentences), Tensor(sentences))
+            Positions and sentence ids are Tensor(targets)
+
+        :param sentences: List of (lemma_list, pos_list, token_list, target_indexes)
+        """
+        positions, sentence_ids, forms, lemma, pos = label_encoder.transform_sentences(sentences)
+        forms = Dataset._to_tensors(forms, device=device)
+        lemma = Dataset._to_tensors(lemma, device=device)
+        pos = Dataset._to_tensors(pos, device=device)
+
+        targets = Dataset._to_tensors((positions, sentence_ids), device=device)
+        return targets, forms, lemma, pos
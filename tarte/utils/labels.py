@@ -1,11 +1,66 @@
-from typing import Dict, Union, List, Tuple, Iterator, Iterable, Set
+from typing import Any, Dict, Union, List, Tuple, Iterator, Iterable, FrozenSet, Optional, Sequence
 from json import dumps
+import copy
+import struct
 from collections import Counter, defaultdict
+from itertools import chain, repeat
+
+import multiprocessing
+
+import numpy as np
 
 import pie.data.reader
+from pie.data.reader import get_filenames
+from pie.settings import Settings
 
 from . import constants
-from .reader import InputAnnotation
+from .reader import InputAnnotation, ReaderWrapper, get_window_bounds
+
+
+def pad_array(ids: np.ndarray, lengths: np.ndarray, pad: int) -> np.ndarray:
+    """ Pad concatenated sequences
+
+    :param ids: Array(sum(lengths)) of the concatenated sequences
+    :param lengths: Array(batch_size) of the length of each sequence
+    :param pad: Padding ID
+    :return: Array(max_len * batch_size)
+    """
+    max_len = int(lengths.max()) if len(lengths) else 0
+    padded = np.full((len(lengths), max_len), pad, dtype=np.int64)
+    padded[np.arange(max_len) < lengths[:, None]] = ids
+    return np.ascontiguousarray(padded.T)
+
+
+# Binary serialization of MultiEncoder, see MultiEncoder.dumpb
+BINARY_MAGIC = b"TARTEvoc"
+BINARY_VERSION = 2
+
+
+def pack_strings(strings: Sequence[str]) -> bytes:
+    """ Pack strings as their count (uint32), their end offsets (uint32 each) and their UTF-8 data """
+    data = [string.encode("utf-8") for string in strings]
+    ends = np.cumsum(np.fromiter(map(len, data), dtype=np.int64, count=len(data)), dtype=np.int64)
+    return struct.pack("<I", len(data)) + ends.astype("<u4").tobytes() + b"".join(data)
+
+
+def unpack_strings(buffer, offset: int = 0) -> Tuple[List[str], int]:
+    """ Read strings packed by pack_strings
+
+    :return: Strings and the offset following them
+    """
+    count, = struct.unpack_from("<I", buffer, offset)
+    ends = np.frombuffer(buffer, dtype="<u4", count=count, offset=offset + 4).tolist()
+    start = offset + 4 + 4 * count
+    size = ends[-1] if ends else 0
+    data = bytes(buffer[start:start + size])
+    text = data.decode("utf-8")
+    # ASCII data can be sliced once decoded, which is faster than decoding each string
+    if len(text) != len(data):
+        text = data
+    strings = [text[previous:end] for previous, end in zip([0] + ends[:-1], ends)]
+    if text is data:
+        strings = [string.decode("utf-8") for string in strings]
+    return strings, start + size
 
 
 class CategoryEncoder:
@@ -13,15 +68,19 @@ class CategoryEncoder:
     DEFAULT_UNKNOWN = "<UNK>"
 
     def __init__(self):
-        self.itos: Dict[int, str] = {
-            0: CategoryEncoder.DEFAULT_PADDING,
-            1: CategoryEncoder.DEFAULT_UNKNOWN
-        }
+        # Categories, in the order of their IDs
+        self.itos: List[str] = [
+            CategoryEncoder.DEFAULT_PADDING,
+            CategoryEncoder.DEFAULT_UNKNOWN
+        ]
         self.stoi: Dict[str, int] = {
             CategoryEncoder.DEFAULT_PADDING: 0,
             CategoryEncoder.DEFAULT_UNKNOWN: 1
         }
         self.fitted = False
+        self._itos_array: np.ndarray = None
+        # Occurrences of each category seen before fitting
+        self.counter: Counter[str] = Counter()
 
     def __len__(self):
         return self.size()
@@ -35,15 +94,62 @@ class CategoryEncoder:
         :param category:
         :return:
         """
+        if not self.fitted:
+            self.counter[category] += 1
         if category in self.stoi:
             return self.stoi[category]
         elif self.fitted:
             return self.stoi[CategoryEncoder.DEFAULT_UNKNOWN]
         index = len(self.stoi)
         self.stoi[category] = index
-        self.itos[index] = category
+        self.itos.append(category)
         return index
 
+    def prune(self, max_size: Optional[int] = None, min_freq: Optional[int] = None,
+              keep: Iterable[str] = ()) -> Dict[str, float]:
+        """ Drop rare categories, which are then encoded as unknown, as pie.data.dataset.LabelEncoder does:
+            if `max_size` is set, the `max_size` most frequent categories are kept, otherwise the categories
+            seen at least `min_freq` times. Kept categories keep the order of their IDs.
+
+        :param max_size: Maximum number of categories, reserved ones excluded
+        :param min_freq: Minimum number of occurrences, only used if max_size is not set
+        :param keep: Categories which are always kept
+        :return: Report of {"kept": categories kept, "pruned": categories pruned,
+            "coverage_lost": share of the occurrences which are now unknown}
+        """
+        reserved = [
+            category for category in self.itos
+            if category in (CategoryEncoder.DEFAULT_PADDING, CategoryEncoder.DEFAULT_UNKNOWN)
+        ]
+        if max_size:
+            kept = {category for category, _ in self.counter.most_common(max_size)}
+        elif min_freq:
+            kept = {category for category, freq in self.counter.items() if freq >= min_freq}
+        else:
+            kept = set(self.counter)
+        kept.update(category for category in keep if category in self.stoi)
+
+        lost = sum(freq for category, freq in self.counter.items() if category not in kept)
+        total = sum(self.counter.values())
+        report = {
+            "kept": len(kept),
+            "pruned": len(self.counter) - len(kept),
+            "coverage_lost": lost / total if total else 0.
+        }
+
+        self.itos = reserved + [category for category in self.itos if category in kept and category not in reserved]
+        self.stoi = {category: index for index, category in enumerate(self.itos)}
+        self._itos_array = None
+        return report
+
+    def merge(self, other: "CategoryEncoder"):
+        """ Add the categories of an unfitted encoder, in the order of their IDs, and their counts """
+        for category in other.itos:
+            if category not in self.stoi:
+                self.stoi[category] = len(self.itos)
+                self.itos.append(category)
+        self.counter.update(other.counter)
+
     def encode_group(self, *categories: str):
         """ Encode a group of string
         """
@@ -66,13 +172,68 @@ class CategoryEncoder:
         """
         return list(self.encode_group(*categories))
 
+    def transform_array(self, categories: Sequence[str]) -> np.ndarray:
+        """ Encode categories at once
+
+        :return: Array(len(categories)) of IDs
+        """
+        if not self.fitted:
+            return np.array(self.encode_group(*categories), dtype=np.int64)
+        # Unknown categories get the unknown ID, looked up in a single C-level pass
+        unknown = self.stoi[CategoryEncoder.DEFAULT_UNKNOWN]
+        return np.fromiter(map(self.stoi.get, categories, repeat(unknown)), dtype=np.int64, count=len(categories))
+
+    def transform_many(self, sequences: Sequence[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Encode a batch of sequences, such as sentences, at once
+
+        :return: Array(max_len * batch_size) of IDs padded with get_pad(), Array(batch_size) of lengths
+        """
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        ids = self.transform_array(list(chain.from_iterable(sequences)))
+        return pad_array(ids, lengths, self.get_pad()), lengths
+
+    @property
+    def itos_array(self) -> np.ndarray:
+        """ Categories as an object array, to decode arrays of IDs """
+        if self._itos_array is None or len(self._itos_array) != len(self.itos):
+            # Filled one by one so that tuples are kept as categories
+            self._itos_array = np.empty(len(self.itos), dtype=object)
+            for index, category in enumerate(self.itos):
+                self._itos_array[index] = category
+        return self._itos_array
+
+    def inverse_transform_many(self, ids) -> np.ndarray:
+        """ Decode an array of IDs, of any shape, at once
+
+        :return: Object array of categories with the shape of `ids`
+        """
+        return self.itos_array[np.asarray(ids, dtype=np.int64)]
+
     def inverse_transform(self, batch_output: Iterable[int]) -> Iterator[Union[str, Tuple[str, str]]]:
+        if isinstance(batch_output, np.ndarray):
+            yield from self.inverse_transform_many(batch_output).tolist()
+            return
         for inp in batch_output:
             if isinstance(inp, list):
                 yield list(self.inverse_transform(inp))
             else:
                 yield self.decode(inp)
 
+    def _build_itos(self):
+        """ Build the list of categories from the STOI """
+        self.itos = [None] * len(self.stoi)
+        for category, index in self.stoi.items():
+            self.itos[index] = category
+
+    @classmethod
+    def from_itos(cls, itos: List[str]) -> "CategoryEncoder":
+        """ Generates a category encoder from its categories, in the order of their IDs """
+        obj = cls()
+        obj.itos = itos
+        obj.stoi = {category: index for index, category in enumerate(itos)}
+        obj.fitted = True
+        return obj
+
     @classmethod
     def load(cls, stoi: Dict[str, int]) -> "CategoryEncoder":
         """ Generates a category encoder
@@ -82,10 +243,20 @@ class CategoryEncoder:
         """
         obj = cls()
         obj.stoi.update(stoi)
-        obj.itos.update({v: k for (k, v) in obj.stoi.items()})
+        obj._build_itos()
         obj.fitted = True
         return obj
 
+    def copy(self) -> "CategoryEncoder":
+        """ Copy of the encoder which can be changed without changing this one """
+        obj = copy.copy(self)
+        obj.itos = list(self.itos)
+        obj.stoi = dict(self.stoi)
+        obj.counter = Counter(self.counter)
+        # Rebuilt on demand, see itos_array
+        obj._itos_array = None
+        return obj
+
     def dumps(self, as_string=True):
         if not as_string:
             return self.stoi
@@ -96,60 +267,101 @@ class CategoryEncoder:
 
 
 class OutputEncoder(CategoryEncoder):
+    """ Encoder of the (lemma, index) classes
+
+    Once fitted, it holds the routing table of each lemma, see OutputEncoder.routes
+    """
+    # Route of lemma which are not in the routing table
+    PASSTHROUGH = False
+
     def __init__(self):
         super(OutputEncoder, self).__init__()
 
-        self.itos: Dict[int, str] = {
-            0: CategoryEncoder.DEFAULT_UNKNOWN
-        }
+        self.itos: List[Union[str, Tuple[str, str]]] = [
+            CategoryEncoder.DEFAULT_UNKNOWN
+        ]
         self.stoi: Dict[str, int] = {
             CategoryEncoder.DEFAULT_UNKNOWN: 0
         }
 
-        self.counter: Counter[str] = Counter()
-        self._need_categorization: Set[str] = None
-        self._auto_categorization: Dict[str, Tuple[str, str]] = None
+        self._routes: Dict[str, Optional[str]] = None
+        # Tables derived from the routing table, see set_routes
+        self._need_categorization: FrozenSet[str] = None
+        self._auto_categorization: Dict[str, str] = None
 
     @property
-    def need_categorization(self) -> Set[str]:
+    def routes(self) -> Dict[str, Optional[str]]:
+        """ Routing table of lemma: a lemma with a single class is mapped to its index, a lemma with more classes
+            is mapped to None as it needs the model. Other lemma are not in the table and are passed through.
+        """
         if self.fitted:
-            if not self._need_categorization:
-                self._need_categorization = set([key[0] for key in self.stoi if isinstance(key, tuple)])
-            return self._need_categorization
+            if self._routes is None:
+                self.set_routes(self.build_routes())
+            return self._routes
         raise Exception("Vocabulary not fitted ATM")
 
+    def build_routes(self) -> Dict[str, Optional[str]]:
+        indexes = defaultdict(list)
+        for token in self.stoi:
+            if isinstance(token, tuple):
+                indexes[token[0]].append(token[1])
+        return {
+            lemma: values[0] if len(values) == 1 else None
+            for lemma, values in indexes.items()
+        }
+
+    def set_routes(self, routes: Dict[str, Optional[str]]):
+        """ Set the routing table, and build once the tables of lemma which need the model or not """
+        self._routes = routes
+        self._need_categorization = frozenset(lemma for lemma, index in routes.items() if index is None)
+        self._auto_categorization = {lemma: index for lemma, index in routes.items() if index is not None}
+
+    def route(self, lemma: str) -> Union[bool, None, str]:
+        """ Route of a lemma: OutputEncoder.PASSTHROUGH, None if the model is needed or the index of the lemma
+        """
+        return self.routes.get(lemma, self.PASSTHROUGH)
+
     @property
-    def auto_categorization(self) -> Dict[str, str]:
-        if self.fitted:
-            if not self._auto_categorization:
-                a = defaultdict(set)
-                for token in self.stoi:
-                    if isinstance(token, tuple):
-                        a[token[0]].add(token[1])
-                self._auto_categorization = {
-                    key: value[0]
-                    for key, value in a.items()
-                    if len(value) == 1
-                }
-            return self._auto_categorization
-        raise Exception("Vocabulary not fitted ATM")
+    def need_categorization(self) -> FrozenSet[str]:
+        """ Lemma which need the model """
+        self.routes  # Builds the tables if needed
+        return self._need_categorization
 
-    def encode(self, category: Union[str, Tuple[str, str]]):
-        if not self.fitted:
-            self.counter[category] += 1
-        return super(OutputEncoder, self).encode(category)
+    @property
+    def auto_categorization(self) -> Dict[str, str]:
+        """ Lemma with a single class, mapped to their index """
+        self.routes  # Builds the tables if needed
+        return self._auto_categorization
 
     def get_pad(self):
         return -100  # As Nll loss default
 
+    def copy(self) -> "OutputEncoder":
+        obj = super(OutputEncoder, self).copy()
+        if self._routes is not None:
+            obj.set_routes(dict(self._routes))
+        return obj
+
     def dumps(self, as_string=True):
         key_values = list(self.stoi.items())
         if not as_string:
             return key_values
         return dumps(key_values)
 
+    def dumps_routes(self) -> Dict[str, Union[Dict[str, str], List[str]]]:
+        """ Routing table as {"auto": {lemma: index}, "need": [lemma]} """
+        return {
+            "auto": self.auto_categorization,
+            "need": sorted(self.need_categorization)
+        }
+
     @classmethod
-    def load(cls, stoi: List) -> "OutputEncoder":
+    def load(cls, stoi: List, routes: Dict[str, Union[Dict[str, str], List[str]]] = None) -> "OutputEncoder":
+        """ Generates an output encoder
+
+        :param stoi: STOI as a list of (category, index)
+        :param routes: Routing table, as given by dumps_routes. If not given, it is built from the STOI.
+        """
         obj = cls()
         for k, v in stoi:
             if isinstance(k, str):
@@ -157,10 +369,18 @@ class OutputEncoder(CategoryEncoder):
             else:
                 obj.stoi[tuple(k)] = v
 
-        obj.itos.update({v: k for (k, v) in obj.stoi.items()})
+        obj._build_itos()
         obj.fitted = True
+        if routes is not None:
+            obj.load_routes(routes)
         return obj
 
+    def load_routes(self, routes: Dict[str, Union[Dict[str, str], List[str]]]):
+        """ Set the routing table from the output of dumps_routes """
+        table = dict(routes["auto"])
+        table.update(dict.fromkeys(routes["need"]))
+        self.set_routes(table)
+
 
 class CharEncoder(CategoryEncoder):
     def encode(self, category: str) -> List[int]:
@@ -189,6 +409,24 @@ class MultiEncoder:
         self.fitted = False
         self._known_tokens = None
 
+        # Vocabulary limits of each encoder as (max_size, min_freq), applied when fitting, see CategoryEncoder.prune
+        self.limits: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        # Report of the pruning of each encoder
+        self.coverage: Dict[str, Dict[str, float]] = {}
+
+    @classmethod
+    def from_settings(cls, settings) -> "MultiEncoder":
+        """ Generates an encoder with the limits `word_max_size` and `word_min_freq` for lemma and tokens,
+            and `char_max_size` and `char_min_freq` for characters
+        """
+        obj = cls()
+        obj.limits = {
+            "lemma": (settings.word_max_size, settings.word_min_freq),
+            "token": (settings.word_max_size, settings.word_min_freq),
+            "char": (settings.char_max_size, settings.char_min_freq)
+        }
+        return obj
+
     def __eq__(self, other):
         return type(self) == type(other) and \
                self.lemma == other.lemma and \
@@ -206,6 +444,16 @@ class MultiEncoder:
                 self._known_tokens = list(self.token.stoi.keys())
         return list(self.token.stoi.keys())
 
+    def copy(self) -> "MultiEncoder":
+        """ Copy of the encoder which can be changed, refitted or pruned without changing this one """
+        obj = copy.copy(self)
+        for name in ("lemma", "token", "output", "pos", "char"):
+            setattr(obj, name, getattr(self, name).copy())
+        obj._known_tokens = None
+        obj.limits = dict(self.limits)
+        obj.coverage = dict(self.coverage)
+        return obj
+
     @classmethod
     def load(cls, dumped: Dict[str, Dict[str, int]]) -> "MultiEncoder":
         """ Generates a category encoder
@@ -216,7 +464,7 @@ class MultiEncoder:
         obj = cls(
             lemma_encoder=CategoryEncoder.load(dumped["lemma_encoder"]),
             token_encoder=CategoryEncoder.load(dumped["token_encoder"]),
-            output_encoder=OutputEncoder.load(dumped["output_encoder"]),
+            output_encoder=OutputEncoder.load(dumped["output_encoder"], routes=dumped.get("output_routes")),
             pos_encoder=CategoryEncoder.load(dumped["pos_encoder"]),
             char_encoder=CharEncoder.load(dumped["char_encoder"])
         )
@@ -228,14 +476,109 @@ class MultiEncoder:
             "lemma_encoder": self.lemma.dumps(as_string=False),
             "token_encoder": self.token.dumps(as_string=False),
             "output_encoder": self.output.dumps(as_string=False),
+            "output_routes": self.output.dumps_routes() if self.output.fitted else None,
             "pos_encoder": self.pos.dumps(as_string=False),
             "char_encoder": self.char.dumps(as_string=False)
         })
 
-    def fit(self, lines: Iterator[InputAnnotation], freeze=True):
-        """ Read all `lines` and fit the vocabulary
+    def dumpb(self) -> bytes:
+        """ Binary serialization, which loads much faster than dumps
+
+        After a magic number and a version (uint32), it holds the categories of the lemma, token, POS and char
+            encoders as string tables (see pack_strings), in the order of their IDs, then the classes:
+            a string table of extra lemma, a string table of indexes, and the number of classes (uint32) followed
+            by two int32 arrays. The first holds the lemma of each class as an ID of the lemma encoder or,
+            from its size on, of the extra lemma. The second holds the ID of the index of each class, or -1 for
+            classes which are not (lemma, index), such as <UNK>, whose string is then stored as its lemma.
+            Since version 2, the routing table follows (see OutputEncoder.dumps_routes): a flag (uint32) which is 0
+            if the encoder has no routes, then string tables of the lemma which need the model, of the lemma with
+            a single class and of their indexes.
         """
-        for idx, inp in enumerate(lines):
+        lemma_ids, extra = dict(self.lemma.stoi), []
+        index_ids, indexes = {}, []
+        class_lemma, class_index = [], []
+        for category in self.output.itos:
+            lemma, index = category if isinstance(category, tuple) else (category, None)
+            if lemma not in lemma_ids:
+                lemma_ids[lemma] = len(lemma_ids)
+                extra.append(lemma)
+            class_lemma.append(lemma_ids[lemma])
+            if index is None:
+                class_index.append(-1)
+            else:
+                if index not in index_ids:
+                    index_ids[index] = len(indexes)
+                    indexes.append(index)
+                class_index.append(index_ids[index])
+
+        return b"".join([
+            BINARY_MAGIC, struct.pack("<I", BINARY_VERSION),
+            pack_strings(self.lemma.itos), pack_strings(self.token.itos),
+            pack_strings(self.pos.itos), pack_strings(self.char.itos),
+            pack_strings(extra), pack_strings(indexes),
+            struct.pack("<I", len(class_lemma)),
+            np.array(class_lemma, dtype="<i4").tobytes(), np.array(class_index, dtype="<i4").tobytes(),
+            self._dumpb_routes()
+        ])
+
+    def _dumpb_routes(self) -> bytes:
+        if not self.output.fitted:
+            return struct.pack("<I", 0)
+        routes = self.output.dumps_routes()
+        return b"".join([
+            struct.pack("<I", 1), pack_strings(routes["need"]),
+            pack_strings(list(routes["auto"])), pack_strings(list(routes["auto"].values()))
+        ])
+
+    @classmethod
+    def loadb(cls, buffer) -> "MultiEncoder":
+        """ Generates an encoder from the output of dumpb """
+        if bytes(buffer[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            raise ValueError("Not a binary MultiEncoder")
+        offset = len(BINARY_MAGIC)
+        version, = struct.unpack_from("<I", buffer, offset)
+        if version not in (1, BINARY_VERSION):
+            raise ValueError("Unknown version {} of binary MultiEncoder".format(version))
+
+        offset += 4
+        tables = []
+        for _ in range(6):
+            strings, offset = unpack_strings(buffer, offset)
+            tables.append(strings)
+        lemma, token, pos, char, extra, indexes = tables
+
+        n_classes, = struct.unpack_from("<I", buffer, offset)
+        class_lemma = np.frombuffer(buffer, dtype="<i4", count=n_classes, offset=offset + 4).tolist()
+        class_index = np.frombuffer(buffer, dtype="<i4", count=n_classes, offset=offset + 4 + 4 * n_classes).tolist()
+        lemmas = lemma + extra
+        classes = [
+            lemmas[lemma_id] if index_id == -1 else (lemmas[lemma_id], indexes[index_id])
+            for lemma_id, index_id in zip(class_lemma, class_index)
+        ]
+
+        obj = cls(
+            lemma_encoder=CategoryEncoder.from_itos(lemma),
+            token_encoder=CategoryEncoder.from_itos(token),
+            output_encoder=OutputEncoder.from_itos(classes),
+            pos_encoder=CategoryEncoder.from_itos(pos),
+            char_encoder=CharEncoder.from_itos(char)
+        )
+        obj.fitted = True
+
+        # Version 1 has no routing table, which is built again when it is needed
+        offset += 4 + 8 * n_classes
+        if version >= 2 and struct.unpack_from("<I", buffer, offset)[0]:
+            need, offset = unpack_strings(buffer, offset + 4)
+            auto, offset = unpack_strings(buffer, offset)
+            auto_indexes, offset = unpack_strings(buffer, offset)
+            obj.output.load_routes({"auto": dict(zip(auto, auto_indexes)), "need": need})
+        return obj
+
+    def fit(self, lines: Iterable[InputAnnotation], freeze=True):
+        """ Read all `lines`, which can be a generator, and fit the vocabulary. The context of each line is
+            counted, so tokens of a sentence are counted once per target: see fit_sentences to count them once.
+        """
+        for inp in lines:
             (lem, pos, tok, lem_lst, pos_lst, tok_lst), disambiguation = self.regularize_input(inp)
 
             # input
@@ -246,18 +589,80 @@ class MultiEncoder:
             self.char.encode(tok)
 
         if freeze:
-            self.fitted = True
-            self.lemma.fitted = True
-            self.pos.fitted = True
-            self.token.fitted = True
-            self.output.fitted = True
-            self.char.fitted = True
-
-    def fit_reader(self, reader, freeze=True):
+            self.freeze()
+
+    def merge(self, encoders: Iterable["MultiEncoder"], freeze=True):
+        """ Add the categories and the counts of unfitted encoders, such as encoders fitted over shards of a corpus
+            with `freeze=False`
+
+        New categories get their IDs in the order of `encoders`, then in the order of their IDs in each encoder:
+            merging the encoders of files is the same as fitting over the files one after the other.
         """
-        fit reader in a non verbose way (to warn about parsing issues)
+        for encoder in encoders:
+            for name in ("lemma", "token", "output", "pos", "char"):
+                getattr(self, name).merge(getattr(encoder, name))
+
+        if freeze:
+            self.freeze()
+
+    def freeze(self):
+        """ Apply the vocabulary limits and stop adding categories
+        """
+        self.prune()
+        self.fitted = True
+        self.lemma.fitted = True
+        self.pos.fitted = True
+        self.token.fitted = True
+        self.output.fitted = True
+        self.char.fitted = True
+        # Routing tables are built once, and saved with the encoder
+        self.output.set_routes(self.output.build_routes())
+
+    def prune(self):
+        """ Apply the vocabulary limits to each encoder, and record their report in `coverage`
         """
-        return self.fit([line for (_, line) in reader.readsents(silent=False)], freeze=freeze)
+        # Lemma of the classes are always kept, as the classifier finds the candidates of a target through them
+        keep = {"lemma": [category[0] for category in self.output.itos if isinstance(category, tuple)]}
+        for name, (max_size, min_freq) in self.limits.items():
+            self.coverage[name] = getattr(self, name).prune(max_size, min_freq, keep=keep.get(name, ()))
+
+    def fit_sentences(self, sentences: Iterable[Tuple[Any, Tuple[List[str], List[str], List[str]],
+                                                      List[Tuple[int, str]]]],
+                      context_window: Optional[int] = None, freeze=True):
+        """ Fit the vocabulary over sentences as yielded by ReaderWrapper.readsentences. Each token of a sentence
+            is counted once whatever the number of targets it is the context of, and only if it is in the context
+            of one of them. Classes and characters are counted for each target.
+
+        :param sentences: Sentences as (index, (lemma, POS, tokens), [(target index, disambiguated ID)])
+        :param context_window: Context window of the targets, whole sentence if None
+        """
+        for _, (lem_lst, pos_lst, tok_lst), targets in sentences:
+            if context_window is None:
+                context = range(len(tok_lst))
+            else:
+                context = sorted({
+                    position
+                    for index, _ in targets
+                    for position in range(*get_window_bounds(index, len(tok_lst), context_window))
+                })
+
+            # input
+            self.lemma.encode_group(*[lem_lst[position] for position in context])
+            self.pos.encode_group(*[pos_lst[position] for position in context])
+            self.token.encode_group(*[tok_lst[position] for position in context])
+            for index, disambiguation in targets:
+                self.output.encode(self.get_category(lem_lst[index], disambiguation))
+                self.char.encode(tok_lst[index])
+
+        if freeze:
+            self.freeze()
+
+    def fit_reader(self, reader: ReaderWrapper, freeze=True):
+        """
+        fit reader in a non verbose way (to warn about parsing issues), reading each sentence once
+        """
+        return self.fit_sentences(reader.readsentences(silent=False), context_window=reader.context_window,
+                                  freeze=freeze)
 
     def get_category(self, lemma, disambiguation_code) -> Tuple[str, str]:
         return lemma, disambiguation_code
@@ -277,8 +682,11 @@ class MultiEncoder:
             self,
             sentence_batch
     ) -> Tuple[
-        Tuple[List[Tuple[int, int, int]], List[int], List[List], List[List], List[List]],
-        List[int]
+        Tuple[
+            Tuple[np.ndarray, np.ndarray, np.ndarray], List[List[int]],
+            Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]
+        ],
+        np.ndarray
     ]:
         """
         Parameters
@@ -293,40 +701,120 @@ class MultiEncoder:
         ===========
         tuple of Input(input_token, context_lemma, context_pos, token_chars, lengths), disambiguated
 
-            - word: list of integers
+            - to_categorize: (lemma, pos, token) arrays of the targets, each Array(batch_size)
             - char: list of integers where each list represents a word at the
                 character level
-            - task_dict: Dict to corresponding integer output for each task
+            - context_*: Array(max_len * batch_size) padded and Array(batch_size) of lengths, see
+                CategoryEncoder.transform_many
+            - disambiguated: Array of class IDs, for the inputs which have one
         """
-        # List of sentence where each word is translated to an index
-        lemm_batch: List[List[int]] = []
+        examples = [self.regularize_input(input_data) for input_data in sentence_batch]
+        lem, pos, tok, lem_lst, pos_lst, tok_lst = zip(*[inp for inp, _ in examples])
+
+        # Triple data input (Lemma, POS, TOK)
+        to_categorize_batch = (
+            self.lemma.transform_array(lem),
+            self.pos.transform_array(pos),
+            self.token.transform_array(tok)
+        )
         # List of sentence where each word is translated into series of characters
-        char_batch: List[List[int]] = []
-        # List of sentence where each word is kept by its POS
-        pos__batch: List[List[int]] = []
-        # Token batch
-        toke_batch: List[List[int]] = []
+        char_batch: List[List[int]] = [self.char.encode(token) for token in tok]
         # Expected output
-        output_batch: List[int] = []
-        # Triple data input (Lemma, POS, TOK)
-        to_categorize_batch: List[Tuple[int, int, int]] = []
+        output_batch = self.output.transform_array([
+            disambiguation for _, disambiguation in examples if disambiguation
+        ])
 
-        for input_data in sentence_batch:
-            # If we have the disambiguation class
-            (lem, pos, tok, lem_lst, pos_lst, tok_lst), disambiguation = self.regularize_input(input_data)
+        # Tuple of Input(input_token, context_lemma, context_pos, token_chars), disambiguated
+        return (
+            to_categorize_batch, char_batch,
+            self.token.transform_many(tok_lst), self.lemma.transform_many(lem_lst), self.pos.transform_many(pos_lst)
+        ), output_batch
+
+    def transform_sentences(
+            self,
+            sentences
+    ) -> Tuple[np.ndarray, np.ndarray, Tuple[np.ndarray, np.ndarray],
+               Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+        """ Encode sentences once for all of their targets
 
-            lemm_batch.append(self.lemma.transform(lem_lst))
-            pos__batch.append(self.pos.transform(pos_lst))
-            toke_batch.append(self.token.transform(tok_lst))
-            char_batch.append(self.char.encode(tok))
+        Parameters
+        ===========
+        sentences : list of (sentence_in_lemma, sentence_in_pos, sentence_in_tokens, target_indexes)
 
-            to_categorize_batch.append((
-                self.lemma.encode(lem),
-                self.pos.encode(pos),
-                self.token.encode(tok)
-            ))
-            if disambiguation:
-                output_batch.append(self.output.encode(disambiguation))
+        Returns
+        ===========
+        tuple of (positions, sentence_ids, context_tokens, context_lemma, context_pos)
 
-        # Tuple of Input(input_token, context_lemma, context_pos, token_chars), disambiguated
-        return (to_categorize_batch, char_batch, toke_batch, lemm_batch, pos__batch), output_batch
+            - positions: Array(targets) of the index of each target in its sentence
+            - sentence_ids: Array(targets) of the index of the sentence of each target in the batch
+            - context_*: Array(max_len * sentences) padded and Array(sentences) of lengths, see
+                CategoryEncoder.transform_many
+        """
+        lem_lst, pos_lst, tok_lst, indexes = zip(*sentences)
+
+        positions = np.fromiter(chain.from_iterable(indexes), dtype=np.int64)
+        sentence_ids = np.repeat(
+            np.arange(len(sentences), dtype=np.int64),
+            np.fromiter(map(len, indexes), dtype=np.int64, count=len(indexes))
+        )
+
+        return (
+            positions, sentence_ids,
+            self.token.transform_many(tok_lst), self.lemma.transform_many(lem_lst), self.pos.transform_many(pos_lst)
+        )
+
+
+def _fit_file(args) -> Tuple[MultiEncoder, int]:
+    """ Fit an encoder over a single file, without freezing it
+
+    :return: Encoder, number of sentences read
+    """
+    settings, fpath, context_window = args
+    encoder = MultiEncoder()
+    reader = ReaderWrapper(Settings(settings), fpath, context_window=context_window)
+    encoder.fit_reader(reader, freeze=False)
+    return encoder, reader.reader.nsents
+
+
+def fit_files(settings: Settings, files: Iterable[str], context_window: Optional[int] = None,
+              processes: Optional[int] = None, encoder: Optional[MultiEncoder] = None,
+              freeze: bool = True) -> MultiEncoder:
+    """ Fit an encoder over many files in parallel: each file is read by a worker, and their encoders are merged
+        in the order of the files, see MultiEncoder.merge
+
+    `max_sents` applies to the files as a whole, as it does for a single reader. Workers read their file up to
+        `max_sents` sentences: once the files before it were read, the file which reaches the limit is fitted
+        again over what is left of it, and the files after it are dropped.
+
+    :param settings: Settings of the readers
+    :param files: Paths or glob patterns of the files
+    :param context_window: Context window of the readers
+    :param processes: Number of workers, the number of CPUs by default
+    :param encoder: Encoder to fit, MultiEncoder.from_settings(settings) by default
+    :param freeze: Whether to freeze the encoder once fitted
+    :return: Fitted encoder
+    """
+    if encoder is None:
+        encoder = MultiEncoder.from_settings(settings)
+    files = [fpath for pattern in files for fpath in get_filenames(pattern)]
+    # Settings cannot be pickled, their dictionary is sent to the workers
+    tasks = [(dict(settings), fpath, context_window) for fpath in files]
+
+    def within_max_sents(fitted: Iterable[Tuple[MultiEncoder, int]]) -> Iterator[MultiEncoder]:
+        remaining = settings.max_sents
+        for (shard, n_sents), (task_settings, fpath, _) in zip(fitted, tasks):
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                if n_sents > remaining:
+                    shard, n_sents = _fit_file((dict(task_settings, max_sents=remaining), fpath, context_window))
+                remaining -= n_sents
+            yield shard
+
+    if len(tasks) <= 1 or processes == 1:
+        encoder.merge(within_max_sents(map(_fit_file, tasks)), freeze=freeze)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            # Encoders are merged as they come, in the order of the files
+            encoder.merge(within_max_sents(pool.imap(_fit_file, tasks)), freeze=freeze)
+    return encoder
@@ -0,0 +1,151 @@
+""" Batches built in the background while the model trains on the previous ones
+
+Reading, encoding and packing run in a thread or in a process, which fills a queue of `depth` batches ahead
+of the consumer. Time spent by the consumer waiting for a batch is counted, see Prefetcher.take_wait.
+"""
+from typing import Iterator
+import queue
+import random
+import threading
+import time
+import traceback
+
+import numpy as np
+import torch
+import torch.multiprocessing
+
+MODES = ("thread", "process")
+
+# Markers of the end of the batches, and of an error of the producer
+_END, _ERROR = "end", "error"
+# Seconds between two checks of the stop event by a producer blocked on a full queue
+_POLL = 0.1
+
+
+def to_device(data, device):
+    """ Move the tensors of nested tuples to a device """
+    if isinstance(data, torch.Tensor):
+        return data.to(device)
+    if isinstance(data, (tuple, list)):
+        return type(data)(to_device(item, device) for item in data)
+    return data
+
+
+def _put(batches, stop, item) -> bool:
+    """ Put an item in the queue unless the consumer stopped, in which case False is returned """
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(dataset, batches, stop):
+    """ Fill the queue with the batches of a dataset, then with the end marker and the padding counters
+        of the dataset (see Dataset.padding_ratio), which a process cannot share otherwise
+    """
+    try:
+        for batch in dataset.batch_generator():
+            if not _put(batches, stop, batch):
+                return
+        _put(batches, stop, (_END, (dataset.context_tokens, dataset.context_cells)))
+    except Exception as error:
+        _put(batches, stop, (_ERROR, "{}\n{}".format(error, traceback.format_exc())))
+
+
+def _produce_in_process(dataset, batches, stop, seed: int):
+    """ _produce in a forked process """
+    # A forked process starts with the random state of its parent at each epoch
+    random.seed(seed)
+    np.random.seed(seed)
+    _produce(dataset, batches, stop)
+    # Tensors sent by a process are shared through it: it lives until the consumer received them all
+    stop.wait()
+    # Batches which were not received are dropped instead of being flushed at exit
+    batches.cancel_join_thread()
+
+
+def _received(batches, producer) -> Iterator:
+    """ Items of the queue, as long as its producer is alive or the queue is not empty """
+    while True:
+        try:
+            yield batches.get(timeout=_POLL)
+        except queue.Empty:
+            if not producer.is_alive():
+                raise RuntimeError("Batches could not be built: their producer stopped")
+
+
+class Prefetcher:
+    """ Iterate over the training batches of a dataset, built `depth` batches ahead in the background
+
+    In `process` mode, batches are built on the CPU by a forked process and moved to the device of the dataset
+    once received: the dataset is not pickled, which requires the fork start method (Linux).
+    """
+    def __init__(self, dataset, depth: int = 0, mode: str = "thread"):
+        """
+
+        :param dataset: Dataset whose batch_generator is iterated
+        :param depth: Number of batches built ahead, batches are built when they are needed if 0
+        :param mode: Either "thread" or "process"
+        """
+        if mode not in MODES:
+            raise ValueError("Prefetching mode should be one of {}, got {}".format(", ".join(MODES), mode))
+        self.dataset = dataset
+        self.depth = depth
+        self.mode = mode
+        self.wait = 0.  # Seconds spent waiting for batches since the last take_wait
+
+    def take_wait(self) -> float:
+        """ Seconds spent waiting for batches since the last call """
+        wait, self.wait = self.wait, 0.
+        return wait
+
+    def __iter__(self) -> Iterator:
+        if self.depth <= 0:
+            yield from self._timed(iter(self.dataset.batch_generator()))
+            return
+
+        if self.mode == "thread":
+            batches, stop = queue.Queue(self.depth), threading.Event()
+            producer = threading.Thread(target=_produce, args=(self.dataset, batches, stop), daemon=True)
+            producer.start()
+        else:
+            context = torch.multiprocessing.get_context("fork")
+            batches, stop = context.Queue(self.depth), context.Event()
+            producer = context.Process(target=_produce_in_process, daemon=True,
+                                       args=(self.dataset, batches, stop, np.random.randint(2 ** 31)))
+            device, self.dataset.device = self.dataset.device, "cpu"
+            try:
+                producer.start()
+            finally:
+                self.dataset.device = device
+
+        try:
+            for batch in self._timed(_received(batches, producer)):
+                if isinstance(batch[0], str):
+                    marker, data = batch
+                    if marker == _ERROR:
+                        raise RuntimeError("Batches could not be built: {}".format(data))
+                    self.dataset.context_tokens, self.dataset.context_cells = data
+                    return
+                if self.mode == "process":
+                    batch = to_device(batch, self.dataset.device)
+                yield batch
+        finally:
+            # Producers blocked on a full queue see it, see _put
+            stop.set()
+            producer.join()
+
+    def _timed(self, batches: Iterator) -> Iterator:
+        """ Yield from an iterator, counting the time spent in next() as waiting time """
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            finally:
+                self.wait += time.perf_counter() - start
+            yield batch
@@ -1,8 +1,10 @@
-from typing import List, Union, Iterator, Tuple
+from typing import List, Union, Iterator, Tuple, Optional
 
-from pie.data.reader import Reader
+from pie.data.reader import Reader, get_filenames
 
 from tarte.utils import constants
+from tarte.utils.compression import is_compressed, strip_compression
+from tarte.utils.tsv import TsvReader, SentenceIndex, EXTENSIONS, sentence_targets
 
 # At some point, information that is used should be configurable, so that maybe one morph info is useful to decide ?
 InputAnnotation = Tuple[
@@ -13,11 +15,45 @@ InputAnnotation = Tuple[
 ]
 
 
+def get_window_bounds(index: int, size: int, context_window: Optional[int] = None) -> Tuple[int, int]:
+    """ Compute the slice of a sentence of length `size` which is the context of the token at `index`
+
+    :param index: Index of the target
+    :param size: Length of the sentence
+    :param context_window: Number of tokens kept on each side of the target, whole sentence if None
+    :return: Start and end of the context
+    """
+    if context_window is None:
+        return 0, size
+    return max(0, index - context_window), min(size, index + context_window + 1)
+
+
 class ReaderWrapper(Reader):
-    def __init__(self, settings, *input_path):
+    def __init__(self, settings, *input_path, context_window: Optional[int] = None):
+        """
+
+        :param settings: Settings, where `reader` is either "pie" (default) to read files with pie's Reader
+            or "tsv" to read them with tarte.utils.tsv.TsvReader. Compressed files (see tarte.utils.compression)
+            are always read with TsvReader, as pie cannot read them
+        :param input_path: Files to read
+        :param context_window: If set, the context of each target is restricted to this number of tokens on each side
+        """
         self.settings = settings
-        self.reader = Reader(self.settings, *input_path)
+        if settings.reader == "tsv" or any(
+                is_compressed(fpath) for path in input_path if path is not None for fpath in get_filenames(path)):
+            self.reader = TsvReader(self.settings, *input_path)
+        else:
+            self.reader = Reader(self.settings, *input_path)
         self.nsents = None
+        self.context_window = context_window
+
+    @property
+    def filenames(self) -> List[str]:
+        """ Files read, in order
+        """
+        if isinstance(self.reader, TsvReader):
+            return list(self.reader.filenames)
+        return [reader.fpath for reader in self.reader.readers]
 
     def get_reader(self, fpath):
         """ Decide on reader type based on filename
@@ -54,52 +90,92 @@ class ReaderWrapper(Reader):
                     (Filepath, SentenceIndex),
                     (InputAnnotation, disambiguated ID)
                 )
+
+            If the reader has a context window, sentences in InputAnnotation are restricted to it
+            and the index yielded `with_index` is relative to the window.
         """
         total = 0
+        for (filepath, _), (lem_lst, pos_lst, tok_lst), targets in self.readsentences(silent=silent):
+            for index, disambiguation in targets:
+                # We have one more sentence
+                total += 1
+
+                # Input format is constant
+                tokens = (
+                    lem_lst[index],
+                    pos_lst[index],
+                    tok_lst[index],
+                    lem_lst,
+                    pos_lst,
+                    tok_lst
+                )
+
+                if self.context_window is not None:
+                    start, end = get_window_bounds(index, len(tok_lst), self.context_window)
+                    tokens = tokens[:3] + tuple(context[start:end] for context in tokens[3:])
+                    index -= start
+
+                if only_tokens:
+                    yield tokens
+                elif with_index:
+                    yield ((filepath, total), (tokens, disambiguation, index))
+                else:
+                    yield ((filepath, total), (tokens, disambiguation))
+
+    def readsentences(self, silent=True) -> Iterator[Tuple[
+                Tuple[str, int], Tuple[List[str], List[str], List[str]], List[Tuple[int, str]]
+            ]]:
+        """
+        Read each sentence with targets once, whatever its number of targets
+
+        yields:
+            Tuple(
+                (Filepath, SentenceIndex),
+                (sentence_in_lemma, sentence_in_pos, sentence_in_tokens),
+                [(target index, disambiguated ID)]
+            )
+
+            Sentences are whole: the context window, if any, is left to the consumer, see get_window_bounds.
+        """
         for ((filepath, sentence_index), (inp, tasks)) in self.reader.readsents(silent=silent, only_tokens=False):
 
             # The following part ought to be changed
             #   as this will need to check the lemma for a list of know tokens that
             #   needs to be disambiguated.
 
-            disambiguated = tasks.get(constants.disambiguation_task_name, list([""] * len(inp)))
-            for index, disambiguation in enumerate(disambiguated):
-                if disambiguation and disambiguation.isnumeric():
-                    # We have one more sentence
-                    total += 1
-
-                    # Input format is constant
-                    tokens = (
-                        tasks[constants.lemma_task_name][index],
-                        tasks[constants.pos_task_name][index],
-                        inp[index],
-                        # Lemma
-                        tasks[constants.lemma_task_name],
-                        # POS
-                        tasks[constants.pos_task_name],
-                        # Tokens
-                        inp
-                    )
-
-                    if only_tokens:
-                        yield tokens
-                    elif with_index:
-                        yield ((filepath, total), (tokens, disambiguation, index))
-                    else:
-                        yield ((filepath, total), (tokens, disambiguation))
+            targets = sentence_targets(inp, tasks)
+            if targets:
+                yield (
+                    (filepath, sentence_index),
+                    (tasks[constants.lemma_task_name], tasks[constants.pos_task_name], inp),
+                    targets
+                )
 
     def get_nsents(self):
         """
-        Number of sents in Reader
+        Number of sents in Reader, which is the number of targets. It is read from the index of each file
+            if they are tab separated files and `index_files` is not false, see tarte.utils.tsv.SentenceIndex
         """
         if self.nsents is not None:
             return self.nsents
+        indexes = self.get_indexes()
+        # The maximum number of sentences depends on the order of the files if it is reached
+        if indexes is not None and sum(len(index) for index in indexes) <= self.settings.max_sents:
+            self.nsents = sum(index.n_targets for index in indexes)
+            return self.nsents
         nsents = 0
         for _ in self.readsents():
             nsents += 1
         self.nsents = nsents
         return nsents
 
+    def get_indexes(self) -> Optional[List[SentenceIndex]]:
+        """ Index of each file, or None if the files cannot be indexed """
+        if self.settings.index_files is False or \
+                not all(strip_compression(fpath).endswith(EXTENSIONS) for fpath in self.filenames):
+            return None
+        return [SentenceIndex.get(self.settings, fpath) for fpath in self.filenames]
+
     def get_token_iterator(self):
         return self.reader.get_token_iterator()
 
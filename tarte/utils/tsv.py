@@ -0,0 +1,485 @@
+""" Reader of the tab separated files of Tarte, which yields the same data as pie.data.reader.Reader
+    with its TabReader, without its per-line parser
+"""
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import csv
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import random
+import tempfile
+
+import numpy as np
+
+from pie.data.reader import get_filenames, TokenIterator
+
+from . import constants
+from .compression import is_compressed, open_file, strip_compression
+
+# Extensions read by pie's TabReader
+EXTENSIONS = ("tab", "tsv", "csv")
+
+
+def _decode(f, start: int, positions: List[int]) -> Iterator[str]:
+    """ Decode the lines of a binary file, and record the byte offset of each line in `positions` """
+    position = start
+    for line in f:
+        positions.append(position)
+        position += len(line)
+        yield line.decode("utf-8")
+
+
+def sentence_targets(inp: List[str], tasks: Dict[str, List[str]]) -> List[Tuple[int, str]]:
+    """ Targets of a sentence, as (index, disambiguated ID), which are the tokens with a numeric disambiguation """
+    disambiguated = tasks.get(constants.disambiguation_task_name, list([""] * len(inp)))
+    return [
+        (index, disambiguation)
+        for index, disambiguation in enumerate(disambiguated)
+        if disambiguation and disambiguation.isnumeric()
+    ]
+
+
+class LineParseException(Exception):
+    """ Line which cannot be parsed, see pie.data.tabreader.LineParseException """
+
+
+class TsvReader:
+    """ Streaming reader of tab separated files, which can replace pie.data.reader.Reader
+
+    Settings
+    ========
+    header, sep, tasks_order, breakline_ref, breakline_data, max_sent_len, tasks[task].default : see
+        pie.data.tabreader.TabReader
+    shuffle, max_sents : see pie.data.reader.Reader
+
+    Files may be compressed, see tarte.utils.compression
+    """
+    def __init__(self, settings, *input_paths):
+        filenames = []
+        for input_path in input_paths:
+            if input_path is not None:
+                filenames.extend(get_filenames(input_path))
+
+        if len(filenames) == 0:
+            raise RuntimeError("Couldn't find files [{}]".format(''.join(input_paths)))
+        for fpath in filenames:
+            if not strip_compression(fpath).endswith(EXTENSIONS):
+                raise ValueError("Unknown file format: {}".format(fpath))
+        self.filenames: List[str] = filenames
+
+        self.header = settings.header
+        self.sep = settings.sep
+        self.tasks_order = settings.tasks_order
+        self.breakline_ref = settings.breakline_ref
+        self.breakline_data = settings.breakline_data
+        self.max_sent_len = settings.max_sent_len
+        self.defaults: Dict[str, str] = {task["name"]: task.get("default") for task in settings.tasks}
+
+        # settings
+        self.shuffle = settings.shuffle
+        self.max_sents = settings.max_sents
+        # cache
+        self.nsents = None
+        self.tasks: Dict[str, Tuple[str, ...]] = {fpath: self.get_tasks(fpath) for fpath in filenames}
+
+    def get_tasks(self, fpath: str) -> Tuple[str, ...]:
+        """ Tasks of a file, read from its header or guessed from `tasks_order` """
+        with open_file(fpath) as f:
+            if self.header:
+                _, *header = next(f).strip().split(self.sep)
+                return tuple(header)
+
+            # move to first non empty line
+            line = next(f).strip()
+            while not line:
+                line = next(f).strip()
+
+            _, *tasks = line.split(self.sep)
+            if len(tasks) == 0:
+                raise ValueError("Not enough input tasks: [{}]".format(fpath))
+            return tuple(self.tasks_order[:len(tasks)])
+
+    def reset(self):
+        """ Called after a full run over `readsents` """
+        if self.shuffle:
+            random.shuffle(self.filenames)
+
+    def check_tasks(self, expected=None):
+        """ Check tasks over files, see pie.data.reader.Reader.check_tasks """
+        tasks = set()
+        for fpath, file_tasks in self.tasks.items():
+            if expected is not None:
+                diff = set(expected).difference(set(file_tasks))
+                if diff:
+                    raise ValueError("Following expected tasks are missing from at least one file: '{}'"
+                                     .format('"'.join(diff)))
+            tasks.update(expected or file_tasks)
+        return tuple(tasks)
+
+    def get_token_iterator(self):
+        return TokenIterator(self)
+
+    def rows(self, f) -> Iterator[List[str]]:
+        """ Split the lines of a file as `line.strip().split(sep)` does, where blank lines are empty lists """
+        if len(self.sep) != 1:
+            for line in f:
+                line = line.strip()
+                yield line.split(self.sep) if line else []
+            return
+
+        for row in csv.reader(f, delimiter=self.sep, quoting=csv.QUOTE_NONE):
+            # Rows with whitespace at their ends are split again from the stripped line
+            if row and (not row[-1] or row[-1][-1].isspace() or row[0][:1].isspace()):
+                line = self.sep.join(row).strip()
+                row = line.split(self.sep) if line else []
+            yield row
+
+    def parse(self, fpath: str, start: Optional[int] = None, offsets: Optional[List[int]] = None)\
+            -> Iterator[Union[Tuple[List[str], Dict[str, List[str]]], LineParseException]]:
+        """ Sentences of a file, split as pie.data.tabreader.TabReader.parselines does
+
+        :param fpath: File to read
+        :param start: Byte offset of the first line to read, such as the offset of a sentence. The header is only
+            skipped if it is not set.
+        :param offsets: If given, the byte offset of the first line of each sentence is appended to it
+        """
+        positions = None
+        if start is None and offsets is None:
+            f = open_file(fpath)
+            lines = f
+        else:
+            # Lines are read as bytes to know their offsets, which are offsets in the decompressed data
+            #   of compressed files: seeking them decompresses the file up to the offset
+            f = open_file(fpath, "rb")
+            if start is None:
+                start = len(f.readline()) if self.header else 0
+            else:
+                f.seek(start)
+            positions = []
+            lines = _decode(f, start, positions)
+
+        with f:
+            if start is None and self.header:
+                next(f, None)
+            yield from self.parse_lines(self.tasks[fpath], lines, positions=positions, offsets=offsets)
+
+    def parse_lines(self, tasks: Tuple[str, ...], lines: Iterable[str], positions: Optional[List[int]] = None,
+                    offsets: Optional[List[int]] = None)\
+            -> Iterator[Union[Tuple[List[str], Dict[str, List[str]]], LineParseException]]:
+        """ Sentences of lines, see parse
+
+        :param tasks: Tasks of the columns following the token
+        :param positions: Byte offset of each line, filled while lines are read, if offsets are needed
+        :param offsets: If given, the byte offset of the first line of each sentence is appended to it
+        """
+        n_tasks = len(tasks)
+        defaults = [self.defaults.get(task) for task in tasks]
+        max_sent_len = self.max_sent_len
+        breakline_data = self.breakline_data
+        if not self.breakline_ref:
+            breakline = None
+        elif self.breakline_ref == "input":
+            breakline = -1
+        else:
+            breakline = tasks.index(self.breakline_ref)
+
+        inp, columns = [], [[] for _ in tasks]
+        # Line of the first and of the last token of the sentence
+        first_line = last_line = 0
+        for line_num, row in enumerate(self.rows(lines)):
+            if not row:
+                if inp:
+                    if offsets is not None:
+                        offsets.append(positions[first_line])
+                    yield inp, dict(zip(tasks, columns))
+                    inp, columns = [], [[] for _ in tasks]
+                    continue
+                # Blank lines out of sentences are parsed as a token, as pie does
+                row = [""]
+
+            if inp and breakline is not None and \
+                    (inp if breakline == -1 else columns[breakline])[-1] == breakline_data:
+                if offsets is not None:
+                    offsets.append(positions[first_line])
+                yield inp, dict(zip(tasks, columns))
+                inp, columns = [], [[] for _ in tasks]
+            elif len(inp) > max_sent_len:
+                if offsets is not None:
+                    offsets.append(positions[first_line])
+                yield inp[:max_sent_len], {task: column[:max_sent_len] for task, column in zip(tasks, columns)}
+                # The rest of the sentence is its last token
+                inp, columns = inp[max_sent_len:], [column[max_sent_len:] for column in columns]
+                first_line = last_line
+
+            if len(row) - 1 < n_tasks:
+                if None in defaults:
+                    yield LineParseException(
+                        "Not enough number of tasks. Expected {} but got {} at line {}."
+                        .format(n_tasks, len(row) - 1, line_num))
+                    continue
+                row = [row[0]] + [row[0] if default.lower() == "copy" else default for default in defaults]
+
+            if not inp:
+                first_line = line_num
+            last_line = line_num
+            inp.append(row[0])
+            for column, data in zip(columns, row[1:]):
+                column.append(data)
+
+        if inp:
+            if offsets is not None:
+                offsets.append(positions[first_line])
+            yield inp, dict(zip(tasks, columns))
+
+    def read_sentence(self, fpath: str, offset: int, data: Optional[bytes] = None)\
+            -> Tuple[List[str], Dict[str, List[str]]]:
+        """ Read the sentence starting at a byte offset, see SentenceIndex
+
+        :param data: If given, bytes of the file from `offset` on, which are read instead of the file
+        """
+        if data is None:
+            sentences = self.parse(fpath, start=offset)
+        else:
+            sentences = self.parse_lines(self.tasks[fpath], (line.decode("utf-8") for line in io.BytesIO(data)))
+        for sentence in sentences:
+            # Lines of the sentence which cannot be parsed come first
+            if not isinstance(sentence, LineParseException):
+                return sentence
+
+    def readsents(self, silent=True, only_tokens=False):
+        """ Read sents over files, see pie.data.reader.Reader.readsents """
+        self.reset()
+        total = 0
+        for fpath in self.filenames:
+            for current_sent, data in enumerate(self.parse(fpath), start=1):
+                if isinstance(data, LineParseException):
+                    if not silent:
+                        logging.warning("Parse error at [{}:sent={}]\n  => {}".format(
+                            fpath, current_sent + 1, str(data)))
+                    continue
+
+                if total >= self.max_sents:
+                    break
+                total += 1
+
+                if only_tokens:
+                    yield data[0]
+                else:
+                    yield (fpath, current_sent), data
+        self.nsents = total
+
+
+def index_path(fpath: str) -> str:
+    """ Path of the index sidecar of a file. It is hidden, so that it is not read as an input file """
+    directory, name = os.path.split(fpath)
+    return os.path.join(directory, ".{}.tarteidx".format(name))
+
+
+def _file_hash(fpath: str) -> str:
+    sha = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SentenceIndex:
+    """ Index of the sentences of a file, saved as a sidecar next to it (see index_path)
+
+    It holds the byte offset of each sentence, which can be read with TsvReader.read_sentence, and its number of
+    targets. It is read again when the reader settings change, or when the file changes: a file with another
+    size, or another modification time and content, is indexed again.
+    """
+    # Settings which change how sentences are split
+    SETTINGS = ("header", "sep", "tasks_order", "breakline_ref", "breakline_data", "max_sent_len", "tasks")
+
+    def __init__(self, offsets: np.ndarray, targets: np.ndarray, meta: Dict):
+        """
+
+        :param offsets: Array(sentences) of the byte offset of each sentence
+        :param targets: Array(sentences) of the number of targets of each sentence
+        :param meta: Size, modification time and hash of the file, and the reader settings
+        """
+        self.offsets = offsets
+        self.targets = targets
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def n_targets(self) -> int:
+        return int(self.targets.sum())
+
+    @classmethod
+    def get_meta(cls, settings, fpath: str, with_hash: bool = True) -> Dict:
+        stat = os.stat(fpath)
+        return {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": _file_hash(fpath) if with_hash else None,
+            "settings": json.dumps({key: settings.get(key) for key in cls.SETTINGS}, sort_keys=True)
+        }
+
+    @classmethod
+    def build(cls, settings, fpath: str) -> "SentenceIndex":
+        """ Read a file to index its sentences """
+        offsets, targets = [], []
+        for data in TsvReader(settings, fpath).parse(fpath, offsets=offsets):
+            if isinstance(data, LineParseException):
+                continue
+            targets.append(len(sentence_targets(*data)))
+        return cls(np.array(offsets, dtype=np.int64), np.array(targets, dtype=np.int32),
+                   cls.get_meta(settings, fpath))
+
+    def save(self, fpath: str):
+        """ Write the index to a temporary file which then replaces `fpath`, so that readers of the sidecar
+            never see a partial index
+        """
+        directory, name = os.path.split(fpath)
+        descriptor, temporary = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or None)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                np.savez(f, offsets=self.offsets, targets=self.targets,
+                         meta=np.frombuffer(json.dumps(self.meta).encode("utf-8"), dtype=np.uint8))
+            os.replace(temporary, fpath)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    @classmethod
+    def load(cls, fpath: str) -> "SentenceIndex":
+        with np.load(fpath) as data:
+            return cls(data["offsets"], data["targets"], json.loads(data["meta"].tobytes().decode("utf-8")))
+
+    def is_valid(self, settings, fpath: str) -> bool:
+        """ Check that the index is the one of the file with these settings
+
+        Copied or touched files keep their index if their content did not change: their new modification time
+            is then recorded in `meta`, see SentenceIndex.get.
+        """
+        meta = self.get_meta(settings, fpath, with_hash=False)
+        if meta["size"] != self.meta["size"] or meta["settings"] != self.meta["settings"]:
+            return False
+        if meta["mtime"] == self.meta["mtime"]:
+            return True
+        if _file_hash(fpath) != self.meta["hash"]:
+            return False
+        self.meta["mtime"] = meta["mtime"]
+        return True
+
+    @classmethod
+    def get(cls, settings, fpath: str) -> "SentenceIndex":
+        """ Load the index of a file from its sidecar, or build it and write the sidecar """
+        sidecar = index_path(fpath)
+        index = None
+        if os.path.isfile(sidecar):
+            try:
+                loaded = cls.load(sidecar)
+                mtime = loaded.meta["mtime"]
+                if loaded.is_valid(settings, fpath):
+                    if loaded.meta["mtime"] == mtime:
+                        return loaded
+                    # The file was only touched: the next check does not need to hash it again
+                    index = loaded
+            except Exception:
+                # Any sidecar which cannot be read, such as one which is being written by another job, is stale
+                logging.warning("Index {} cannot be read, it is built again".format(sidecar))
+
+        if index is None:
+            index = cls.build(settings, fpath)
+        try:
+            index.save(sidecar)
+        except OSError:
+            logging.warning("Index of {} cannot be written to {}".format(fpath, sidecar))
+        return index
+
+
+class RandomAccessCorpus:
+    """ Targets of tab separated files, whose sentences are read in any order from memory maps of the files,
+        through their index (see SentenceIndex)
+
+    Only the index arrays are held in memory: sentences are parsed when their batch is built.
+    """
+    def __init__(self, settings, *input_paths):
+        self.reader = TsvReader(settings, *input_paths)
+        self.filenames: List[str] = list(self.reader.filenames)
+        for fpath in self.filenames:
+            if is_compressed(fpath):
+                raise ValueError("{} is compressed and cannot be memory-mapped, decompress it to read it in any "
+                                 "order".format(fpath))
+
+        files, starts, ends, counts = [], [], [], []
+        remaining = settings.max_sents
+        for file_id, fpath in enumerate(self.filenames):
+            index = SentenceIndex.get(settings, fpath)
+            # Sentences beyond max_sents are not read, as in TsvReader.readsents
+            n_sents = min(len(index), remaining)
+            remaining -= n_sents
+            sentence_ends = np.append(index.offsets[1:], os.path.getsize(fpath))
+            keep = np.flatnonzero(index.targets[:n_sents] > 0)
+            files.append(np.full(len(keep), file_id, dtype=np.int32))
+            starts.append(index.offsets[keep])
+            ends.append(sentence_ends[keep])
+            counts.append(index.targets[keep])
+
+        # Sentences with targets
+        self.files = np.concatenate(files)
+        self.starts = np.concatenate(starts)
+        self.ends = np.concatenate(ends)
+        counts = np.concatenate(counts).astype(np.int64)
+        # Targets, as the sentence and the rank of the target among the targets of its sentence
+        self.sentences = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+        self.ranks = np.arange(len(self.sentences), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        self._maps: Dict[int, mmap.mmap] = {}
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def get_map(self, file_id: int) -> mmap.mmap:
+        if file_id not in self._maps:
+            with open(self.filenames[file_id], "rb") as f:
+                self._maps[file_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[file_id]
+
+    def read_sentence(self, sentence_id: int) -> Tuple[Tuple[List[str], List[str], List[str]], List[Tuple[int, str]]]:
+        """ Read a sentence with targets
+
+        :return: (sentence_in_lemma, sentence_in_pos, sentence_in_tokens) and the targets of the sentence,
+            see ReaderWrapper.readsentences
+        """
+        file_id = int(self.files[sentence_id])
+        data = self.get_map(file_id)[self.starts[sentence_id]:self.ends[sentence_id]]
+        inp, tasks = self.reader.read_sentence(self.filenames[file_id], int(self.starts[sentence_id]), data=data)
+        return (
+            (tasks[constants.lemma_task_name], tasks[constants.pos_task_name], inp),
+            sentence_targets(inp, tasks)
+        )
+
+    def batches(self, batch_size: int, shuffle: bool = False) -> Iterator[np.ndarray]:
+        """ Split the targets in batches, in a random order over the whole corpus if `shuffle`
+
+        :return: Iterator of Array(batch_size) of target IDs
+        """
+        order = np.random.permutation(len(self)) if shuffle else np.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            yield order[start:start + batch_size]
+
+    def read(self, target_ids: np.ndarray) \
+            -> Tuple[List[Tuple[List[str], List[str], List[str]]], List[Tuple[int, int, str]]]:
+        """ Read the sentences of targets, each once
+
+        :return: Sentences, and each target as (index of its sentence in sentences, target index, disambiguated ID)
+        """
+        sentences, positions, targets = [], {}, []
+        for sentence_id, rank in zip(self.sentences[target_ids].tolist(), self.ranks[target_ids].tolist()):
+            if sentence_id not in positions:
+                positions[sentence_id] = len(sentences)
+                sentences.append(self.read_sentence(sentence_id))
+            _, in_sentence = sentences[positions[sentence_id]]
+            targets.append((positions[sentence_id],) + in_sentence[rank])
+        return [sentence for sentence, _ in sentences], targets
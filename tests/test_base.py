@@ -0,0 +1,107 @@
+from unittest import TestCase
+import shutil
+import tarfile
+import threading
+import tempfile
+import os.path
+
+import torch
+
+from tarte.modules.base import Base, build_empty, add_gzip_to_tar, _LABEL_ENCODERS, LABEL_ENCODER_CACHE_SIZE
+from tarte.modules.models import TarteModule
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestBase(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.directory = tempfile.mkdtemp()
+        self.model = TarteModule(encoder, context_window=2)
+        self.path = self.model.save(os.path.join(self.directory, "model.tar"), settings={"a": 1})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_then_load(self):
+        """ Check that a model is saved and loaded without temporary files """
+        with tarfile.open(self.path) as tar:
+            self.assertEqual(
+                sorted(tar.getnames()),
+                ["class.zip", "label_encoder.bin", "parameters.zip", "settings.zip", "state_dict.pt"]
+            )
+        loaded = TarteModule.load(self.path)
+        self.assertEqual(loaded.context_window, 2)
+        self.assertEqual(loaded.label_encoder, self.model.label_encoder)
+        self.assertEqual(Base.load_settings(self.path), {"a": 1})
+        for (name, expected), (_, tensor) in zip(self.model.state_dict().items(), loaded.state_dict().items()):
+            self.assertTrue(torch.equal(expected, tensor), "{} should be loaded".format(name))
+
+    def test_routes(self):
+        """ Check that the routing table is saved with the model instead of being built again """
+        self.assertIsNotNone(self.model.label_encoder.output._routes)
+        loaded = TarteModule.load(self.path).label_encoder.output
+        self.assertIsNotNone(loaded._routes, "Routes should be read from the archive")
+        self.assertEqual(loaded._routes, self.model.label_encoder.output.routes)
+
+    def test_load_json_label_encoder(self):
+        """ Check that models saved with a JSON label encoder are still loaded """
+        path = os.path.join(self.directory, "json.tar")
+        with tarfile.open(self.path) as source, tarfile.open(path, "w") as tar:
+            for member in source.getmembers():
+                if member.name != "label_encoder.bin":
+                    tar.addfile(member, source.extractfile(member))
+            add_gzip_to_tar(self.model.label_encoder.dumps(), "label_encoder.zip", tar)
+        self.assertEqual(TarteModule.load(path).label_encoder, self.model.label_encoder)
+
+    def test_label_encoder_cache(self):
+        """ Check that the decoded label encoder is cached until the model file changes, and that each model
+            gets its own copy of it
+        """
+        encoder = Base.load_label_encoder(self.path)
+        hits = _LABEL_ENCODERS.hits
+        model = TarteModule.load(self.path)
+        self.assertEqual(_LABEL_ENCODERS.hits, hits + 1, "The encoder should not be decoded again")
+        self.assertEqual(model.label_encoder, encoder)
+        self.assertIsNot(model.label_encoder, encoder)
+        self.assertIsNot(model.label_encoder.token.stoi, encoder.token.stoi)
+
+        model.label_encoder.output.load_routes({"auto": {}, "need": []})
+        self.assertEqual(Base.load_label_encoder(self.path).output.routes, encoder.output.routes,
+                         "Changing the encoder of a model should not change the cached one")
+
+        self.model.save(self.path, settings={"a": 2, "b": 3})
+        self.assertIsNot(Base.load_label_encoder(self.path), encoder)
+
+    def test_label_encoder_cache_size(self):
+        """ Check that the cache keeps a bounded number of encoders """
+        for index in range(LABEL_ENCODER_CACHE_SIZE + 2):
+            Base.load_label_encoder(self.model.save(os.path.join(self.directory, "model{}.tar".format(index))))
+        self.assertEqual(len(_LABEL_ENCODERS), LABEL_ENCODER_CACHE_SIZE)
+
+    def test_build_empty(self):
+        """ Check that weights of models built empty are not allocated, without changing other threads """
+        built, empty = threading.Event(), threading.Event()
+
+        def build():
+            with torch.device("meta"):
+                built.set()
+                empty.wait()
+
+        thread = threading.Thread(target=build)
+        thread.start()
+        built.wait()
+        try:
+            model = build_empty(TarteModule, self.model.label_encoder, context_window=2)
+            self.assertTrue(all(parameter.is_meta for parameter in model.parameters()))
+            self.assertFalse(torch.zeros(3).is_meta, "Only the building thread should build on the meta device")
+        finally:
+            empty.set()
+            thread.join()
+
+        model.load_state_dict(self.model.state_dict(), assign=True)
+        self.assertFalse(any(parameter.is_meta for parameter in model.parameters()))
@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+import torch
+
+from tarte.modules.base import build_empty
+from tarte.modules.models import TarteModule
+from tarte.modules.classifier import Classifier
+from tarte.utils.datasets import Dataset
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestClassifier(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        self.encoder = MultiEncoder()
+        self.encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.model = TarteModule(self.encoder)
+
+    def test_candidates(self):
+        """ Check that each lemma gets the unknown class and its own classes """
+        candidates = Classifier.build_candidates(self.encoder.output, self.encoder.lemma)
+        self.assertEqual(candidates.size(0), self.encoder.lemma.size())
+
+        output, lemma = self.encoder.output, self.encoder.lemma
+        self.assertEqual(
+            [output.itos[class_id] for class_id in candidates[lemma.stoi["en"]].tolist() if class_id >= 0],
+            ["<UNK>", ("en", "1"), ("en", "2")]
+        )
+        self.assertEqual(candidates[lemma.stoi["grant"]].tolist()[0], output.stoi["<UNK>"])
+        self.assertEqual(
+            [class_id for class_id in candidates[lemma.stoi["grant"]].tolist() if class_id >= 0],
+            [output.stoi["<UNK>"]],
+            "Lemma without classes only have the unknown class"
+        )
+
+    def test_predictions_match_lemma(self):
+        """ Check that predictions are always a class of the target lemma """
+        dataset = Dataset(DefaultSettings, ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"), self.encoder)
+        for (inp, _), (rinp, _) in dataset.batch_generator(return_raw=True):
+            _, preds = self.model.predict(inp)
+            for (lemma, *_), pred in zip(rinp, preds):
+                self.assertEqual(pred[0], lemma)
+
+    def test_loss(self):
+        """ Check that the loss is the cross entropy over the candidates """
+        logits = torch.tensor([[0.1, 2., float("-inf")], [1., -1., 0.5]])
+        candidates = torch.tensor([[0, 3, -1], [0, 1, 2]])
+        targets = torch.tensor([3, 2])
+        self.assertAlmostEqual(
+            self.model.decoder.loss(logits, targets, candidates).item(),
+            torch.nn.functional.cross_entropy(logits, torch.tensor([1, 2])).item(),
+            places=5
+        )
+
+    def test_load_without_candidates(self):
+        """ Check that state dicts saved without the candidate table can still be loaded """
+        state_dict = self.model.state_dict()
+        del state_dict["decoder.candidates"]
+        model = TarteModule(self.encoder)
+        model.load_state_dict(state_dict)
+        self.assertTrue(torch.equal(model.decoder.candidates, self.model.decoder.candidates))
+
+        # As loaded models are, see Base.load
+        model = build_empty(TarteModule, self.encoder)
+        model.load_state_dict(state_dict, assign=True)
+        self.assertTrue(torch.equal(model.decoder.candidates, self.model.decoder.candidates))
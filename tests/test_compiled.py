@@ -0,0 +1,145 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import time
+import os.path
+
+import numpy as np
+
+from pie.settings import Settings
+
+from tarte.utils.compiled import CompiledCorpus, bucket_batches, cache_directory
+from tarte.utils.datasets import Dataset
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestCompiled(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "ambiguous.tsv")
+        shutil.copy("data/ambiguous.tsv", self.source)
+        self.settings = Settings(dict(DefaultSettings, batch_size=3, cache_dir=os.path.join(self.directory, "cache")))
+        self.encoder = MultiEncoder()
+        self.encoder.fit_reader(ReaderWrapper(self.settings, self.source))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_dataset(self, context_window=None):
+        return Dataset(self.settings, ReaderWrapper(self.settings, self.source, context_window=context_window),
+                       self.encoder)
+
+    def assertBatchesEqual(self, dataset):
+        compiled = list(dataset.batch_generator())
+        # Raw batches are always read from the files
+        read = [batch for batch, _ in dataset.batch_generator(return_raw=True)]
+        self.assertEqual(len(compiled), len(read))
+        for (compiled_inputs, compiled_targets), (read_inputs, read_targets) in zip(compiled, read):
+            for compiled_input, read_input in zip(compiled_inputs, read_inputs):
+                for compiled_tensor, read_tensor in zip(compiled_input, read_input):
+                    self.assertEqual(compiled_tensor.tolist(), read_tensor.tolist())
+            self.assertEqual(compiled_targets.tolist(), read_targets.tolist())
+
+    def test_batches(self):
+        """ Check that batches of the compiled corpus are the batches of the reader """
+        for context_window in (None, 1):
+            self.assertBatchesEqual(self.get_dataset(context_window))
+
+    def test_sentence_mode(self):
+        """ Check that batches built from sentences read once are the batches of the reader, raw data included """
+        for buffer_size in (3, 4, 10):
+            for context_window in (None, 1):
+                self.settings.buffer_size = buffer_size
+                dataset = self.get_dataset(context_window)
+                read = list(dataset.batch_generator(return_raw=True))
+                dataset.sentence_mode = True
+                for (batch, raw), (expected_batch, expected_raw) in zip(
+                        dataset.batch_generator(return_raw=True), read):
+                    self.assertEqual(raw[0], expected_raw[0])
+                    self.assertEqual(raw[1], expected_raw[1])
+                    self.assertEqual(batch[1].tolist(), expected_batch[1].tolist())
+                    for tensors, expected_tensors in zip(batch[0], expected_batch[0]):
+                        for tensor, expected in zip(tensors, expected_tensors):
+                            self.assertEqual(tensor.tolist(), expected.tolist())
+                self.assertEqual(len(list(dataset.sentence_batch_generator())), len(read))
+
+    def test_chunks(self):
+        """ Check that a corpus compiled by chunks is the corpus compiled at once """
+        reader = ReaderWrapper(self.settings, self.source)
+        whole = CompiledCorpus.compile(reader, self.encoder, chunk_size=1000)
+        for chunk_size in (1, 2, 3):
+            chunked = CompiledCorpus.compile(reader, self.encoder, chunk_size=chunk_size)
+            self.assertEqual(chunked.fingerprint, whole.fingerprint)
+            for name in whole.arrays:
+                self.assertEqual(chunked.arrays[name].tolist(), whole.arrays[name].tolist(), name)
+
+    def test_contexts_are_shared(self):
+        """ Check that targets of the same sentence share its IDs """
+        corpus = self.get_dataset().compiled
+        self.assertGreater(len(corpus), len(corpus.arrays["offsets"]) - 1)
+        self.assertEqual(int(corpus.arrays["offsets"][-1]), len(corpus.arrays["lemma"]))
+
+    def test_invalidation(self):
+        """ Check that the corpus is compiled once, then again when the source changes """
+        dataset = self.get_dataset()
+        corpus = dataset.compiled
+        directory = cache_directory(self.settings.cache_dir, dataset.reader)
+        self.assertEqual(CompiledCorpus.load(directory).fingerprint, corpus.fingerprint)
+        self.assertIs(dataset.compiled, corpus, "The corpus should not be compiled again")
+        digest = dataset._encoder_digest
+        dataset.compiled
+        self.assertIs(dataset._encoder_digest, digest, "The encoder should not be hashed again")
+
+        time.sleep(0.01)
+        with open(self.source, "a") as f:
+            f.write("\nOr\tor\tADVgen\t_\t_\nsui\testre\tVERcjg\t_\t1\n")
+        self.assertIsNone(CompiledCorpus.load(directory, expected=dataset.compiled.fingerprint[::-1]))
+        self.assertNotEqual(dataset.compiled.fingerprint, corpus.fingerprint)
+        self.assertEqual(len(dataset.compiled), len(corpus) + 1)
+
+    def test_random_access(self):
+        """ Check that targets read from memory maps are the targets of the reader, in any order """
+        for context_window in (None, 1):
+            self.settings.buffer_size = 100
+            dataset = self.get_dataset(context_window)
+            read = list(dataset.batch_generator(return_raw=True))
+            dataset.random_access = True
+            batches = list(dataset.batch_generator(return_raw=True))
+            self.assertEqual(len(batches), len(read))
+            for (batch, raw), (expected_batch, expected_raw) in zip(batches, read):
+                self.assertEqual(raw, expected_raw)
+                self.assertEqual(batch[1].tolist(), expected_batch[1].tolist())
+                for tensors, expected_tensors in zip(batch[0], expected_batch[0]):
+                    for tensor, expected in zip(tensors, expected_tensors):
+                        self.assertEqual(tensor.tolist(), expected.tolist())
+
+            dataset.shuffle = True
+            shuffled = [target for _, (_, targets) in dataset.batch_generator(return_raw=True) for target in targets]
+            self.assertEqual(sorted(shuffled), sorted(target for _, (_, targets) in read for target in targets))
+
+    def test_bucket_batches(self):
+        """ Check that buckets batch every target once, with targets of close lengths """
+        lengths = np.array([1, 9, 2, 8, 3, 7, 4, 6, 5, 5])
+        batches = bucket_batches(lengths, batch_size=2, buckets=2, shuffle=True)
+        self.assertEqual(sorted(np.concatenate(batches).tolist()), list(range(len(lengths))))
+        for batch in batches:
+            self.assertTrue(all(lengths[batch] <= 5) or all(lengths[batch] >= 5), "Buckets should not be mixed")
+
+    def test_buckets(self):
+        """ Check that every path batches the same targets by bucket, with less padding """
+        self.settings.buffer_size = 100
+        for cache_dir, sentence_mode in ((None, False), (None, True), (self.settings.cache_dir, False)):
+            self.settings.cache_dir = cache_dir
+            self.settings.sentence_mode = sentence_mode
+            dataset = self.get_dataset()
+            expected = sorted(target for _, targets in dataset.batch_generator() for target in targets.tolist())
+            padding = dataset.padding_ratio
+
+            dataset.buckets = 4
+            dataset.shuffle = True
+            bucketed = list(dataset.batch_generator())
+            self.assertEqual(sorted(target for _, targets in bucketed for target in targets.tolist()), expected)
+            self.assertLess(dataset.padding_ratio, padding)
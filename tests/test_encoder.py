@@ -1,9 +1,19 @@
 from unittest import TestCase
 import json
+import os.path
+import shutil
+import tempfile
 
+import numpy
+import torch
+
+from pie.settings import Settings
+
+from tarte.modules.encoder import DataEncoder
 from tarte.utils.datasets import Dataset
 from tarte.utils.reader import ReaderWrapper
-from tarte.utils.labels import MultiEncoder, CategoryEncoder, CharEncoder
+from tarte.utils.labels import MultiEncoder, CategoryEncoder, CharEncoder, OutputEncoder, fit_files, \
+    pack_strings, unpack_strings
 
 from tests.defaults import DefaultSettings
 
@@ -49,6 +59,21 @@ class TestDataset(TestCase):
             "Disambiguation target should be correctly encoded as TUPLE"
         )
 
+    def test_fit_counts(self):
+        """ Check that tokens are counted once per sentence whatever its number of targets, and only if they
+            are in the context of one of them
+        """
+        self.encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"), freeze=False)
+        # "Certes je sui en grant pensez" has two targets, "sui" and "en"
+        self.assertEqual(self.encoder.token.counter["Certes"], 1)
+        self.assertEqual(self.encoder.output.counter[("estre", "1")], 1, "Classes are counted once per target")
+
+        windowed = MultiEncoder()
+        windowed.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv", context_window=1), freeze=False)
+        self.assertNotIn("Certes", windowed.token.counter, "Tokens out of every context should not be counted")
+        self.assertEqual(windowed.token.counter["je"], 1)
+        self.assertEqual(windowed.token.counter["pensez"], 0)
+
     def test_fit_then_dump_then_load(self):
         """ Check than dumping then loading is equal """
         self.encoder.fit_reader(self.reader)
@@ -60,6 +85,79 @@ class TestDataset(TestCase):
         self.assertEqual(self.encoder.output, loaded.output)
         self.assertEqual(self.encoder, loaded, "Loading multi-encoder should be equal to the dumped one")
 
+    def test_fit_then_dumpb_then_loadb(self):
+        """ Check that the binary serialization is read back as the encoder """
+        self.encoder.fit_reader(self.reader)
+        # Classes whose lemma is not a known lemma, and non ASCII categories
+        self.encoder.output.stoi[("mëisme", "2")] = len(self.encoder.output.itos)
+        self.encoder.output.itos.append(("mëisme", "2"))
+        self.encoder.token.stoi["après"] = len(self.encoder.token.itos)
+        self.encoder.token.itos.append("après")
+        self.encoder.output.set_routes(self.encoder.output.build_routes())
+
+        loaded = MultiEncoder.loadb(self.encoder.dumpb())
+        self.assertEqual(loaded, self.encoder, "Loading multi-encoder should be equal to the dumped one")
+        self.assertEqual(loaded.output.itos, self.encoder.output.itos)
+        self.assertEqual(loaded.lemma.itos, self.encoder.lemma.itos)
+        self.assertEqual(loaded.output._routes, {"estre": "1", "en": "1", "mëisme": "2"},
+                         "Routes should be loaded, not built again")
+        self.assertEqual(MultiEncoder.loadb(MultiEncoder().dumpb()), MultiEncoder())
+        with self.assertRaises(ValueError):
+            MultiEncoder.loadb(self.encoder.dumps().encode())
+
+    def test_strings(self):
+        """ Check that string tables are read back, with their offset """
+        for strings in (["<PAD>", "", "mëisme", "après"], ["<PAD>", "a", ""], []):
+            packed = pack_strings(strings)
+            self.assertEqual(unpack_strings(b"xx" + packed + b"yy", 2), (strings, len(packed) + 2))
+
+    def test_routes(self):
+        """ Check that routing tables are built at fit time and saved with the encoder """
+        self.encoder.fit_reader(self.reader)
+        self.assertEqual(self.encoder.output._routes, {"estre": "1", "en": "1"}, "Routes should be built by fit")
+        self.assertEqual(self.encoder.output.route("en"), "1", "Lemma with a single class are auto-assigned")
+        self.assertIs(self.encoder.output.route("grant"), OutputEncoder.PASSTHROUGH)
+        self.assertIs(self.encoder.output.need_categorization, self.encoder.output.need_categorization,
+                      "Tables derived from the routes should be built once")
+        self.assertIs(self.encoder.output.auto_categorization, self.encoder.output.auto_categorization)
+
+        loaded = OutputEncoder.load(self.encoder.output.dumps(as_string=False))
+        loaded.load_routes({"auto": {"en": "1"}, "need": ["estre"]})
+        self.assertEqual((loaded.need_categorization, loaded.auto_categorization), ({"estre"}, {"en": "1"}),
+                         "Loading routes should replace the derived tables")
+
+        dumped = json.loads(self.encoder.dumps())
+        self.assertEqual(dumped["output_routes"], {"auto": {"estre": "1", "en": "1"}, "need": []})
+        self.assertEqual(MultiEncoder.load(dumped).output._routes, self.encoder.output.routes)
+
+        # Encoders saved without routes rebuild them
+        del dumped["output_routes"]
+        self.assertEqual(MultiEncoder.load(dumped).output.routes, self.encoder.output.routes)
+
+    def test_limits(self):
+        """ Check that vocabulary limits prune rare categories to unknown but keep the lemma of classes """
+        encoder = MultiEncoder.from_settings(Settings(dict(
+            DefaultSettings, word_max_size=0, word_min_freq=3, char_max_size=3)))
+        encoder.fit_reader(self.reader)
+        self.encoder.fit_reader(self.reader)
+
+        self.assertEqual(encoder.lemma.itos[:2], ["<PAD>", "<UNK>"], "Reserved categories should keep their IDs")
+        self.assertIn("estre", encoder.lemma.stoi, "Lemma of classes should be kept")
+        self.assertIn("en", encoder.lemma.stoi, "Lemma of classes should be kept")
+        self.assertEqual(len(encoder.char), 5, "Only the 3 most frequent characters should be kept")
+        self.assertEqual(encoder.pos, self.encoder.pos, "POS have no limits")
+        self.assertEqual(encoder.output, self.encoder.output, "Classes have no limits")
+        self.assertEqual(
+            encoder.lemma.itos[2:], [lemma for lemma in self.encoder.lemma.itos if lemma in encoder.lemma.stoi][2:],
+            "Kept categories should keep their order"
+        )
+        self.assertEqual(encoder.token.transform_array(["sui", "Olivier"]).tolist(), [1, 1])
+
+        report = encoder.coverage["token"]
+        self.assertEqual(report["kept"] + report["pruned"], len(self.encoder.token) - 2)
+        self.assertEqual(report["coverage_lost"], 1.)
+        self.assertEqual(encoder.coverage["lemma"]["kept"], 2)
+
     def test_encoding(self):
         label_encoder = CategoryEncoder()
 
@@ -89,6 +187,24 @@ class TestDataset(TestCase):
             "Dumping and loading should not create discrepancies"
         )
 
+    def test_arrays(self):
+        """ Check that bulk encoding pads with the padding ID and bulk decoding keeps tuples """
+        self.encoder.fit_reader(self.reader)
+        padded, lengths = self.encoder.lemma.transform_many([["je", "estre"], ["en", "inconnu", "grant"]])
+        self.assertEqual(lengths.tolist(), [2, 3])
+        self.assertEqual(
+            padded.tolist(),
+            [[self.encoder.lemma.stoi["je"], self.encoder.lemma.stoi["en"]],
+             [self.encoder.lemma.stoi["estre"], 1],
+             [0, self.encoder.lemma.stoi["grant"]]],
+            "Sequences should be padded along the first dimension and unknown lemma get the unknown ID"
+        )
+        self.assertEqual(self.encoder.lemma.itos[self.encoder.lemma.stoi["grant"]], "grant")
+        self.assertEqual(
+            self.encoder.output.inverse_transform_many(numpy.array([[1, 0], [2, 1]])).tolist(),
+            [[("estre", "1"), "<UNK>"], [("en", "1"), ("estre", "1")]]
+        )
+
     def test_batching(self):
         generator = self.dataset.batch_generator()
 
@@ -109,3 +225,67 @@ class TestDataset(TestCase):
             )
             i += 1
         self.assertEqual(i, 1, "One batch should have happened")
+
+    def test_merge(self):
+        """ Check that merging the encoders of files is fitting over the files one after the other """
+        serial = MultiEncoder()
+        serial.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv", "data/test.tsv"))
+
+        shards = []
+        for fpath in ("data/ambiguous.tsv", "data/test.tsv"):
+            shard = MultiEncoder()
+            shard.fit_reader(ReaderWrapper(DefaultSettings, fpath), freeze=False)
+            shards.append(shard)
+        merged = MultiEncoder()
+        merged.merge(shards)
+
+        self.assertEqual(merged, serial, "IDs should be the ones of a serial fit")
+        self.assertEqual(merged.output.counter, serial.output.counter, "Counts should be summed")
+        self.assertEqual(merged.output.routes, serial.output.routes)
+
+        directory = tempfile.mkdtemp()
+        try:
+            # Files are copied, so that their index is not written next to the test data
+            files = [shutil.copy(fpath, directory) for fpath in ("data/ambiguous.tsv", "data/test.tsv")]
+            parallel = fit_files(DefaultSettings, files, processes=2, encoder=MultiEncoder())
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(parallel, serial, "Workers should merge in the order of the files")
+
+    def test_fit_files_max_sents(self):
+        """ Check that max_sents applies to the files as a whole when they are fitted in parallel """
+        directory = tempfile.mkdtemp()
+        try:
+            files = [shutil.copy(fpath, directory) for fpath in ("data/ambiguous.tsv", "data/test.tsv")]
+            files.append(shutil.copy("data/ambiguous.tsv", os.path.join(directory, "other.tsv")))
+            for max_sents in (1, 2, 3, 5, 100):
+                settings = Settings(dict(DefaultSettings, max_sents=max_sents))
+                serial = MultiEncoder()
+                serial.fit_reader(ReaderWrapper(settings, *files))
+                parallel = fit_files(settings, files, processes=2, encoder=MultiEncoder())
+                self.assertEqual(parallel, serial)
+                self.assertEqual(parallel.token.counter, serial.token.counter)
+            self.assertEqual(sorted(os.listdir(directory)), sorted(map(os.path.basename, files)),
+                             "Files should not be indexed before being fitted")
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestContextEncoder(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        self.encoder = DataEncoder(emb_dim=4, channels=16)
+
+    def test_short_sentences(self):
+        """ Check that sentences shorter than the kernel are encoded, alone or padded in a batch """
+        long = torch.rand(6, 4)
+        for length in (1, 2):
+            short = torch.rand(length, 4)
+            # Tensor(1 * batch_size * max_sentence_length * emb_dim)
+            alone = self.encoder(short.unsqueeze(0).unsqueeze(0), lengths=torch.tensor([length]))[0]
+            self.assertTrue(bool(alone.ne(0).any()), "Short sentences should not be encoded as zeros")
+
+            padded = torch.zeros(2, 6, 4)
+            padded[0, :length], padded[1] = short, long
+            batch = self.encoder(padded.unsqueeze(0), lengths=torch.tensor([length, 6]))
+            self.assertTrue(torch.allclose(batch[0], alone), "Padding should not change the encoding")
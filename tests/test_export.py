@@ -0,0 +1,55 @@
+from unittest import TestCase
+import shutil
+import subprocess
+import sys
+import tempfile
+import os.path
+
+import torch
+
+from tarte.modules.models import TarteModule
+from tarte.modules.export import export
+from tarte.runtime import TarteRuntime
+from tarte.tagger import Tagger
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestExport(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.directory = tempfile.mkdtemp()
+        self.model_path = TarteModule(encoder, context_window=2).save(os.path.join(self.directory, "model.tar"))
+        self.export_path = export(TarteModule.load(self.model_path), os.path.join(self.directory, "exported"))
+        self.sentences = [
+            [["Certes", "certes", "ADVgen"], ["je", "je", "PROper"], ["sui", "estre", "VERcjg"],
+             ["en", "en", "PRE"], ["grant", "grant", "ADJqua"], ["pensez", "pensé", "NOMcom"]],
+            [["en", "en", "ADVgen"]],
+            [["il", "il", "PROper"], ["s", "se", "PROper"], ["en", "en", "ADVgen"], ["est", "estre", "VERcjg"],
+             ["alez", "aler", "VERppe"], ["en", "en", "PRE"], ["grant", "grant", "ADJqua"]]
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_runtime_matches_tagger(self):
+        """ Check that the exported model predicts as the original one, whatever the batch size """
+        expected = list(Tagger(self.model_path).tag(self.sentences, batch_size=64))
+        runtime = TarteRuntime(self.export_path)
+        for batch_size in (1, 2, 64):
+            self.assertEqual(list(runtime.tag(self.sentences, batch_size=batch_size)), expected)
+
+    def test_runtime_without_pie(self):
+        """ Check that the runtime can be used without pie installed """
+        script = "import sys; sys.modules['pie'] = None; " \
+                 "from tarte.runtime import TarteRuntime; " \
+                 "print(list(TarteRuntime(sys.argv[1]).tag([[['en', 'en', 'PRE']]])))"
+        output = subprocess.check_output(
+            [sys.executable, "-c", script, self.export_path],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        self.assertIn("'en", output.decode())
@@ -0,0 +1,61 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os.path
+
+import torch
+
+from tarte.modules.base import Base
+from tarte.modules.models import TarteModule
+from tarte.modules.mapped import convert, is_mapped, ALIGNMENT, read_file_header
+from tarte.tagger import Tagger
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestMapped(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        self.encoder = MultiEncoder()
+        self.encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.directory = tempfile.mkdtemp()
+        self.model = TarteModule(self.encoder, context_window=2)
+        self.tar_path = self.model.save(os.path.join(self.directory, "model.tar"), settings={"a": 1})
+        self.mapped_path = convert(self.tar_path, os.path.join(self.directory, "model.tarte"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert(self):
+        """ Check that models are converted both ways and auto-detected by load """
+        self.assertTrue(is_mapped(self.mapped_path))
+        self.assertFalse(is_mapped(self.tar_path))
+
+        header = read_file_header(self.mapped_path)
+        self.assertTrue(all(tensor["offset"] % ALIGNMENT == 0 for tensor in header["tensors"].values()))
+
+        for path in (self.mapped_path, convert(self.mapped_path, os.path.join(self.directory, "back.tar"))):
+            loaded = TarteModule.load(path)
+            self.assertEqual(loaded.context_window, 2)
+            self.assertEqual(loaded.label_encoder, self.encoder)
+            self.assertEqual(loaded.label_encoder.output.routes, self.encoder.output.routes)
+            self.assertEqual(Base.load_settings(path), {"a": 1})
+            for (name, expected), (_, tensor) in zip(self.model.state_dict().items(), loaded.state_dict().items()):
+                self.assertTrue(torch.equal(expected, tensor), "{} should be loaded".format(name))
+
+    def test_copy_on_write(self):
+        """ Check that modifying a loaded model does not modify the file """
+        loaded = TarteModule.load(self.mapped_path)
+        with torch.no_grad():
+            loaded.hidden.weight.add_(1.)
+        self.assertTrue(torch.equal(TarteModule.load(self.mapped_path).hidden.weight, self.model.hidden.weight))
+
+    def test_tagger(self):
+        """ Check that both formats tag the same way """
+        sentences = [[["en", "en", "PRE"], ["grant", "grant", "ADJqua"], ["est", "estre", "VERcjg"]]]
+        self.assertEqual(
+            list(Tagger(self.mapped_path).tag(sentences)),
+            list(Tagger(self.tar_path).tag(sentences))
+        )
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from pie.settings import Settings
+
+from tarte.utils.datasets import Dataset
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.prefetch import Prefetcher
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestPrefetch(TestCase):
+    def setUp(self):
+        self.settings = Settings(dict(DefaultSettings, batch_size=2))
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(self.settings, "data/ambiguous.tsv"))
+        self.dataset = Dataset(self.settings, ReaderWrapper(self.settings, "data/ambiguous.tsv"), encoder)
+
+    @staticmethod
+    def as_lists(batches):
+        return [
+            ([[tensor.tolist() for tensor in tensors] for tensors in inputs], targets.tolist())
+            for inputs, targets in batches
+        ]
+
+    def test_same_batches(self):
+        """ Check that prefetched batches are the batches of the dataset, with its padding counters """
+        expected = self.as_lists(self.dataset.batch_generator())
+        padding = self.dataset.padding_ratio
+        for mode in ("thread", "process"):
+            for depth in (0, 1, 3):
+                self.dataset.context_tokens, self.dataset.context_cells = 0, 0
+                prefetcher = Prefetcher(self.dataset, depth=depth, mode=mode)
+                self.assertEqual(self.as_lists(prefetcher), expected)
+                self.assertEqual(self.dataset.padding_ratio, padding)
+                self.assertGreaterEqual(prefetcher.take_wait(), 0.)
+                self.assertEqual(prefetcher.wait, 0., "Waiting time should be reset once taken")
+
+    def test_stop_early(self):
+        """ Check that the producer stops when the consumer does """
+        for mode in ("thread", "process"):
+            for batch in Prefetcher(self.dataset, depth=1, mode=mode):
+                break
+
+    def test_error(self):
+        """ Check that errors of the producer are raised to the consumer """
+        self.dataset.label_encoder = None
+        for mode in ("thread", "process"):
+            with self.assertRaises(RuntimeError):
+                list(Prefetcher(self.dataset, depth=2, mode=mode))
@@ -0,0 +1,82 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os.path
+
+import torch
+
+from tarte.modules.models import TarteModule
+from tarte.modules.quantization import quantize, compare_scores
+from tarte.tagger import Tagger
+from tarte.utils.datasets import Dataset
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestQuantization(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        self.encoder = MultiEncoder()
+        self.encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.model = TarteModule(self.encoder)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_quantize(self):
+        """ Check that linear layers, and optionally embeddings, are quantized in a copy of the model """
+        quantized = quantize(self.model)
+        self.assertIsInstance(self.model.hidden, torch.nn.Linear, "Original model should be untouched")
+        self.assertNotIsInstance(quantized.hidden, torch.nn.Linear)
+        self.assertNotIsInstance(quantized.decoder.decoder, torch.nn.Linear)
+        self.assertIsInstance(quantized.word_embedding, torch.nn.Embedding)
+
+        quantized = quantize(self.model, embeddings=True)
+        self.assertNotIsInstance(quantized.word_embedding, torch.nn.Embedding)
+
+    def fit(self, dataset: Dataset, epochs: int = 20):
+        """ Train the model on a dataset until it predicts it, so that scores are meaningful """
+        optimizer = torch.optim.Adam(self.model.parameters(), lr=0.01)
+        for _ in range(epochs):
+            for batch in dataset.batch_generator():
+                optimizer.zero_grad()
+                self.model.loss(batch).backward()
+                optimizer.step()
+        self.model.eval()
+
+    def test_compare_scores(self):
+        """ Check that the quantized model predicts as the float one does on most targets """
+        testset = Dataset(DefaultSettings, ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"), self.encoder)
+        self.fit(testset)
+        quantized = quantize(self.model, embeddings=True)
+
+        agreements = []
+        with torch.no_grad():
+            for inputs, _ in testset.batch_generator():
+                _, expected = self.model.predict(inputs)
+                _, predicted = quantized.predict(inputs)
+                agreements.extend(left == right for left, right in zip(expected, predicted))
+        self.assertGreaterEqual(sum(agreements) / len(agreements), .75,
+                                "Quantized predictions should match float ones on most targets")
+
+        comparison = compare_scores(self.model, quantized, testset)
+        self.assertEqual(comparison["float"]["support"], comparison["quantized"]["support"])
+        self.assertEqual(comparison["float"]["accuracy"], 1., "The float model should have learnt the targets")
+        self.assertGreaterEqual(comparison["delta"]["accuracy"], -.25, "Quantization should keep the accuracy")
+        self.assertEqual(
+            comparison["delta"]["accuracy"],
+            round(comparison["quantized"]["accuracy"] - comparison["float"]["accuracy"], 4)
+        )
+
+    def test_tagger(self):
+        """ Check that a quantized tagger tags every token """
+        path = self.model.save(os.path.join(self.directory, "model.tar"))
+        tagger = Tagger(path, quantize=True, quantize_embeddings=True)
+        output = list(tagger.tag([[["en", "en", "PRE"], ["grant", "grant", "ADJqua"]]]))
+        self.assertIn(output[0][0], ("en1", "en2"))
+        self.assertEqual(output[0][1], "grant")
+        with self.assertRaises(ValueError):
+            Tagger(path, device="cuda", quantize=True)
@@ -1,6 +1,14 @@
 from tarte.utils.datasets import Dataset
 from tarte.utils.reader import ReaderWrapper
 from unittest import TestCase
+import shutil
+import tempfile
+import os.path
+
+from pie.settings import Settings
+
+from tarte.utils.tsv import TsvReader, SentenceIndex, RandomAccessCorpus, index_path
+from tarte.utils.compression import COMPRESSIONS, open_file
 
 
 from tests.defaults import DefaultSettings
@@ -8,11 +16,17 @@ from tests.defaults import DefaultSettings
 
 class TestReader(TestCase):
     def setUp(self):
+        # Files are copied, so that their index is not written next to the test data
+        self.directory = tempfile.mkdtemp()
+        self.path = shutil.copy("data/test.tsv", self.directory)
         self.reader = ReaderWrapper(
             DefaultSettings,
-            "data/test.tsv"
+            self.path
         )
 
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
     def test_expected_output_two_disam(self):
         """ Expect output to be conformant """
         sentence_tokens = ['Certes', 'dist', 'Olivier', 'je', 'sui', 'en', 'grant', 'pensez']
@@ -56,3 +70,138 @@ class TestReader(TestCase):
     def test_get_nsents(self):
         """ Assert total of sentence is well computed """
         self.assertEqual(self.reader.get_nsents(), 2)
+
+    def test_context_window(self):
+        """ Assert context is restricted to the window around the target """
+        reader = ReaderWrapper(DefaultSettings, "data/test.tsv", context_window=1)
+        sentences = list(reader.readsents(with_index=True))
+        (_, ((lemma, _, _, context_lemma, context_pos, context_tokens), _, index)) = sentences[0]
+        self.assertEqual(context_lemma, ['je', 'estre', 'en'], "Context should be one token on each side")
+        self.assertEqual(context_tokens, ['je', 'sui', 'en'], "Context should be one token on each side")
+        self.assertEqual(context_lemma[index], lemma, "Index should be relative to the window")
+        (_, ((lemma, _, _, context_lemma, _, _), _, index)) = sentences[1]
+        self.assertEqual(context_lemma, ['estre', 'en', 'grant'], "Context should be one token on each side")
+        self.assertEqual(index, 1, "Index should be relative to the window")
+
+    def test_readsentences(self):
+        """ Check that each sentence is read once with all of its targets """
+        sentences = list(self.reader.readsentences())
+        self.assertEqual(len(sentences), 1, "The second sentence has no target")
+        (filepath, _), (lemma, pos, tokens), targets = sentences[0]
+        self.assertEqual(filepath, self.path)
+        self.assertEqual(tokens, ['Certes', 'dist', 'Olivier', 'je', 'sui', 'en', 'grant', 'pensez'])
+        self.assertEqual(lemma[4], "estre")
+        self.assertEqual(targets, [(4, "1"), (5, "1")])
+
+
+class TestTsvReader(TestCase):
+    """ Check that the native reader yields what pie's reader yields """
+    EDGE_CASES = "\n".join([
+        "token\tlemma\tpos\tmorph\tDis",
+        "",
+        "Certes\tcertes\tADVgen\tDEGRE=-\t_",
+        "  sui\testre\tVERcjg\t_\t1  ",
+        "en\ten\tPRE\t\t",
+        "court",
+        ".\t.\t.$\t_\t_",
+        "Or\tor\tADVgen\t_\t2",
+        "",
+        "",
+        "  \t ",
+    ] + ["m{0}\tm{0}\tNOMcom\t_\t{1}".format(i, i % 3) for i in range(12)] + [
+        "",
+        "fin\tfin\tNOMcom\t_\t1"
+    ])
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "edge.tsv")
+        with open(self.path, "w") as f:
+            f.write(self.EDGE_CASES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertSameReading(self, settings, *paths):
+        pie_reader = ReaderWrapper(settings, *paths)
+        tsv_reader = ReaderWrapper(Settings(dict(settings, reader="tsv")), *paths)
+        self.assertEqual(tsv_reader.filenames, pie_reader.filenames)
+        self.assertEqual(list(tsv_reader.reader.readsents()), list(pie_reader.reader.readsents()))
+        self.assertEqual(list(tsv_reader.readsents(with_index=True)), list(pie_reader.readsents(with_index=True)))
+        self.assertEqual(tsv_reader.get_nsents(), pie_reader.get_nsents())
+
+    def test_same_reading(self):
+        data = os.path.join(self.directory, "data")
+        os.makedirs(data)
+        self.assertSameReading(DefaultSettings, shutil.copy("data/test.tsv", data),
+                               shutil.copy("data/ambiguous.tsv", data))
+        for breakline_ref in (None, "pos", "input"):
+            for max_sents in (1000000, 3):
+                self.assertSameReading(Settings(dict(
+                    DefaultSettings, max_sent_len=5, breakline_ref=breakline_ref, breakline_data=".$",
+                    max_sents=max_sents)), self.path)
+
+    def test_index(self):
+        """ Check that sentences are read back from their offset and that targets are counted from the index """
+        settings = Settings(dict(DefaultSettings, max_sent_len=5))
+        reader = TsvReader(settings, self.path)
+        index = SentenceIndex.get(settings, self.path)
+        self.assertTrue(os.path.isfile(index_path(self.path)), "The sidecar should be written")
+        self.assertEqual(
+            [reader.read_sentence(self.path, offset) for offset in index.offsets.tolist()],
+            [data for _, data in reader.readsents()]
+        )
+
+        wrapper = ReaderWrapper(settings, self.path)
+        self.assertEqual(wrapper.get_nsents(), len(list(wrapper.readsents())))
+        self.assertEqual(ReaderWrapper(settings, self.directory).filenames, [self.path],
+                         "The sidecar should not be an input file")
+
+        # Same content, new modification time: the sidecar records it, so that the file is not hashed again
+        os.utime(self.path, ns=(0, 0))
+        self.assertTrue(SentenceIndex.load(index_path(self.path)).is_valid(settings, self.path))
+        SentenceIndex.get(settings, self.path)
+        self.assertEqual(SentenceIndex.load(index_path(self.path)).meta["mtime"], 0)
+        # Partial sidecars, such as one being written, are built again
+        with open(index_path(self.path), "r+b") as f:
+            f.truncate(100)
+        self.assertEqual(SentenceIndex.get(settings, self.path).offsets.tolist(), index.offsets.tolist())
+        self.assertEqual(sorted(os.listdir(self.directory)), [os.path.basename(index_path(self.path)), "edge.tsv"],
+                         "Temporary files of the sidecar should be replaced or removed")
+        self.assertFalse(SentenceIndex.load(index_path(self.path)).is_valid(
+            Settings(dict(settings, max_sent_len=6)), self.path))
+        with open(self.path, "a") as f:
+            f.write("\n\nsui\testre\tVERcjg\t_\t1\n")
+        self.assertFalse(SentenceIndex.load(index_path(self.path)).is_valid(settings, self.path))
+        self.assertEqual(SentenceIndex.get(settings, self.path).n_targets, index.n_targets + 1)
+
+    def test_compressed(self):
+        """ Check that compressed files are read as their decompressed content, whatever the reader setting """
+        settings = Settings(dict(DefaultSettings, max_sent_len=5))
+        expected = [data for _, data in ReaderWrapper(settings, self.path).readsents()]
+        for extension in COMPRESSIONS:
+            path = self.path + extension
+            with open_file(path, "w") as f:
+                f.write(self.EDGE_CASES)
+            wrapper = ReaderWrapper(settings, path)
+            self.assertIsInstance(wrapper.reader, TsvReader, "pie cannot read compressed files")
+            self.assertEqual([data for _, data in wrapper.readsents()], expected)
+            self.assertEqual(wrapper.get_nsents(), len(expected))
+
+            reader = TsvReader(settings, path)
+            self.assertEqual(
+                [reader.read_sentence(path, offset) for offset in SentenceIndex.get(settings, path).offsets.tolist()],
+                [data for _, data in reader.readsents()]
+            )
+            with self.assertRaises(ValueError):
+                RandomAccessCorpus(settings, path)
+
+    def test_defaults(self):
+        """ Check that short lines get the defaults of tasks """
+        settings = Settings(dict(DefaultSettings, tasks=[
+            {"name": "lemma", "default": "copy"}, {"name": "pos", "default": "UNK"},
+            {"name": "morph", "default": "_"}, {"name": "Dis", "default": "_"}
+        ]))
+        self.assertSameReading(settings, self.path)
+        tokens = [inp for _, (inp, _) in ReaderWrapper(Settings(dict(settings, reader="tsv")), self.path).reader.readsents()]
+        self.assertIn("court", tokens[0])
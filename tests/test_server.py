@@ -0,0 +1,117 @@
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import asyncio
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import os.path
+
+import torch
+
+from tarte.modules.models import TarteModule
+from tarte.server import DisambiguationServer
+from tarte.tagger import Tagger
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+
+from tests.defaults import DefaultSettings
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.directory = tempfile.mkdtemp()
+        self.tagger = Tagger(TarteModule(encoder).save(os.path.join(self.directory, "model.tar")))
+
+        self.server = DisambiguationServer(self.tagger, max_batch_size=8, max_wait_ms=20)
+        self.loop = asyncio.new_event_loop()
+        server = self.loop.run_until_complete(self.server.start("127.0.0.1", 0))
+        self.url = "http://127.0.0.1:{}".format(server.sockets[0].getsockname()[1])
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    def post(self, sentences):
+        request = Request(self.url + "/disambiguate", data=json.dumps({"sentences": sentences}).encode(),
+                          headers={"Content-Type": "application/json"})
+        with urlopen(request) as response:
+            return json.loads(response.read().decode())["lemmas"]
+
+    def test_concurrent_requests(self):
+        """ Check that concurrent requests are answered with their own output and batched together """
+        requests = [
+            [[["sui", "estre", "VERcjg"], ["en", "en", "PRE"], ["grant", "grant", "ADJqua"]]],
+            [[["il", "il", "PROper"], ["en", "en", "ADVgen"], ["est", "estre", "VERcjg"]]],
+            [[["et", "et", "CONcoo"], ["li", "le", "DETdef"]], [["en", "en", "PRE"]]]
+        ] * 4
+        with ThreadPoolExecutor(len(requests)) as executor:
+            answers = list(executor.map(self.post, requests))
+
+        self.assertEqual(answers, [list(self.tagger.tag(sentences)) for sentences in requests],
+                         "Each request should get its own lemmas")
+
+        with urlopen(self.url + "/health") as response:
+            health = json.loads(response.read().decode())
+        self.assertEqual(health["status"], "ok")
+        self.assertEqual(health["requests"], len(requests))
+        self.assertLess(health["batches"], len(requests), "Concurrent requests should share batches")
+        self.assertEqual(sorted(health["latency_ms"]), ["p50", "p90", "p99"])
+
+    def test_bad_request(self):
+        with self.assertRaises(HTTPError) as error:
+            self.post([[["sui", "estre"]]])
+        self.assertEqual(error.exception.code, 400)
+        with self.assertRaises(HTTPError) as error:
+            urlopen(self.url + "/unknown")
+        self.assertEqual(error.exception.code, 404)
+        for sentences in ([["sui", "estre", "VERcjg"]], [["abc"]], [[["sui", "estre", 1]]], {"a": []}):
+            with self.assertRaises(HTTPError) as error:
+                self.post(sentences)
+            self.assertEqual(error.exception.code, 400, "Malformed requests should not be queued")
+
+    def send(self, content_length: int, body: bytes = b"") -> int:
+        """ Send a request with any Content-Length, and return the status of the answer """
+        port = int(self.url.rsplit(":", 1)[1])
+        with socket.create_connection(("127.0.0.1", port)) as connection:
+            connection.sendall("POST /disambiguate HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(
+                content_length).encode("latin-1") + body)
+            return int(connection.makefile("rb").readline().split()[1])
+
+    def test_body_size(self):
+        """ Check that bodies larger than max_body_size are refused without being read """
+        self.server.max_body_size = 100
+        body = json.dumps({"sentences": [[["sui", "estre", "VERcjg"]]]}).encode()
+        self.assertEqual(self.send(len(body), body), 200)
+        self.assertEqual(self.send(10 ** 12), 413, "The server should not wait for a body it refuses")
+        self.assertEqual(self.send(-1), 400)
+
+    def test_failing_request(self):
+        """ Check that a request which cannot be tagged does not fail the requests batched with it """
+        tag = self.server.tag
+
+        def failing_tag(sentences):
+            if any(word[0] == "boom" for sentence in sentences for word in sentence):
+                raise RuntimeError("Cannot tag")
+            return tag(sentences)
+        self.server.tag = failing_tag
+
+        requests = [[[["sui", "estre", "VERcjg"], ["en", "en", "PRE"]]]] * 3 + [[[["boom", "en", "PRE"]]]]
+        with ThreadPoolExecutor(len(requests)) as executor:
+            futures = [executor.submit(self.post, sentences) for sentences in requests]
+        for sentences, future in zip(requests[:3], futures):
+            self.assertEqual(future.result(), list(self.tagger.tag(sentences)))
+        with self.assertRaises(HTTPError) as error:
+            futures[-1].result()
+        self.assertEqual((error.exception.code, error.exception.reason), (500, "Internal Server Error"))
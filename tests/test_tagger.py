@@ -0,0 +1,266 @@
+from unittest import TestCase
+import shutil
+import tempfile
+import os.path
+
+import torch
+
+from pie.settings import Settings
+
+from tarte.modules.models import TarteModule
+from tarte.tagger import Tagger, sentence_ranges
+from tarte.utils.datasets import Dataset
+from tarte.utils.cache import LRUCache
+from tarte.utils.compression import open_file
+from tarte.utils.labels import MultiEncoder
+from tarte.utils.reader import ReaderWrapper
+from tarte.utils.tsv import TsvReader
+
+from tests.defaults import DefaultSettings
+
+
+class TestTagger(TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/ambiguous.tsv"))
+        self.directory = tempfile.mkdtemp()
+        self.model_path = TarteModule(encoder).save(os.path.join(self.directory, "model.tar"))
+        self.tagger = Tagger(self.model_path)
+        self.sentences = [
+            [
+                ["Certes", "certes", "ADVgen", "DEGRE=-"],
+                ["je", "je", "PROper", "_"],
+                ["sui", "estre", "VERcjg", "_"],
+                ["en", "en", "PRE", "_"],
+                ["grant", "grant", "ADJqua", "_"],
+                ["pensez", "pensé", "NOMcom", "_"]
+            ],
+            [
+                ["et", "et", "CONcoo", "_"],
+                ["li", "le", "DETdef", "_"],
+                ["vilains", "vilain", "NOMcom", "_"]
+            ],
+            [
+                ["il", "il", "PROper", "_"],
+                ["s", "se", "PROper", "_"],
+                ["en", "en", "ADVgen", "_"],
+                ["est", "estre", "VERcjg", "_"],
+                ["alez", "aler", "VERppe", "_"],
+                ["en", "en", "PRE", "_"],
+                ["grant", "grant", "ADJqua", "_"]
+            ]
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batch_size_does_not_change_output(self):
+        """ Check that batching targets across sentences yields the same as tagging one target at a time """
+        expected = list(self.tagger.tag(self.sentences, batch_size=1))
+        self.assertEqual(
+            [len(sentence) for sentence in expected], [6, 3, 7],
+            "Each sentence should be yielded with one output per token"
+        )
+        self.assertEqual(
+            expected[1], ["et", "le", "vilain"],
+            "Sentences without ambiguous tokens should be left untouched"
+        )
+        for batch_size in (2, 3, 64):
+            self.assertEqual(
+                list(self.tagger.tag(self.sentences, batch_size=batch_size)), expected,
+                "Batching {} targets at once should not change the output".format(batch_size)
+            )
+
+    def test_tag_is_lazy(self):
+        """ Check that sentences are not held until a batch of targets is full """
+        def rows(first, count):
+            yield first
+            for _ in range(count - 1):
+                yield self.sentences[1]
+            raise AssertionError("More sentences than needed were read")
+
+        # Without targets, each sentence is yielded as soon as it is read
+        self.assertEqual(next(self.tagger.tag(rows(self.sentences[1], 1), batch_size=64)), ["et", "le", "vilain"])
+
+        # With targets, at most max_pending_sentences sentences wait for them
+        self.tagger.max_pending_sentences = 5
+        expected = list(self.tagger.tag([self.sentences[0]], batch_size=1))[0]
+        self.assertEqual(next(self.tagger.tag(rows(self.sentences[0], 5), batch_size=64)), expected)
+
+    def test_sentence_context_is_encoded_once(self):
+        """ Check that predicting every target of a sentence at once equals predicting each target apart """
+        sentence = self.sentences[2]
+        tok_lst, lem_lst, pos_lst, *_ = zip(*sentence)
+        indexes = [2, 3, 5]
+        encoder = self.tagger.label_encoder
+
+        rows = [(lem_lst[index], pos_lst[index], tok_lst[index], lem_lst, pos_lst, tok_lst) for index in indexes]
+        expected = self.tagger.model.predict(Dataset._pack_batch(encoder, rows, with_target=False))
+        probs, preds = self.tagger.model.predict_sentences(
+            Dataset._pack_sentences(encoder, [(lem_lst, pos_lst, tok_lst, indexes)])
+        )
+        self.assertEqual(preds, expected[1], "Predictions should be the same")
+        for prob, expected_prob in zip(probs, expected[0]):
+            self.assertAlmostEqual(prob, expected_prob, places=5, msg="Probabilities should be the same")
+
+    def write_sentences(self, path, repeat=1):
+        with open(path, "w") as f:
+            f.write("token\tlemma\tpos\tmorph\n")
+            for sentence in self.sentences * repeat:
+                f.write("\n".join("\t".join(row) for row in sentence) + "\n\n")
+
+    def test_tag_file(self):
+        """ Check that tagging a file streams the same output as tagging sentences """
+        input_path, output_path = os.path.join(self.directory, "in.tsv"), os.path.join(self.directory, "out.tsv")
+        self.write_sentences(input_path)
+
+        self.assertEqual(self.tagger.tag_file(input_path, output_path, batch_size=2), (3, 16))
+
+        with open(output_path) as f:
+            self.assertEqual(next(f), "token\tlemma\tpos\tmorph\n", "Header should be kept")
+            output = [[row[1] for row in sentence] for sentence in Tagger.read_sentences(f)]
+        self.assertEqual(output, list(self.tagger.tag(self.sentences)),
+                         "Lemma column should be disambiguated")
+
+    def test_split_sentences(self):
+        """ Check that files without blank lines are split in sentences as the training reader splits them """
+        path = os.path.join(self.directory, "pie.tsv")
+        rows = ["\t".join(row) for sentence in self.sentences for row in sentence]
+        with open(path, "w") as f:
+            f.write("token\tlemma\tpos\tmorph\tDis\n" + "\n".join(row + "\t_" for row in rows * 4) + "\n")
+        for breakline_ref, max_sent_len in (("pos", 35), ("pos", 3), (None, 4)):
+            settings = Settings(dict(DefaultSettings, breakline_ref=breakline_ref, breakline_data="PROper",
+                                     max_sent_len=max_sent_len))
+            expected = [inp for _, (inp, _) in TsvReader(settings, path).readsents()]
+            with open(path) as f:
+                next(f)
+                sentences = [[row[0] for row in sentence] for sentence in Tagger.read_sentences(
+                    f, breakline=None if breakline_ref is None else 2, breakline_data="PROper",
+                    max_sent_len=max_sent_len)]
+            self.assertEqual(sentences, expected)
+            self.assertLessEqual(max(map(len, sentences)), max_sent_len + 1, "Sentences should be bounded")
+
+        # Sentences split without blank line are written back without one
+        self.tagger.breakline_ref, self.tagger.breakline_data = "pos", "PROper"
+        input_path, output_path = os.path.join(self.directory, "in.tsv"), os.path.join(self.directory, "out.tsv")
+        with open(input_path, "w") as f:
+            f.write("token\tlemma\tpos\tmorph\n" + "\n".join(rows * 4) + "\n")
+        self.tagger.tag_file(input_path, output_path)
+        with open(output_path) as f:
+            output = f.read().rstrip("\n").split("\n")
+        self.assertEqual(len(output), len(rows) * 4 + 1, "No line should be added")
+
+    def test_tag_files_with_workers(self):
+        """ Check that tagging files with several processes gives the same files as a single process """
+        input_path = os.path.join(self.directory, "in.tsv")
+        self.write_sentences(input_path, repeat=20)
+        self.assertEqual(len(sentence_ranges(input_path, 3)), 3, "File should be cut in three ranges")
+
+        expected, output_path = os.path.join(self.directory, "expected.tsv"), os.path.join(self.directory, "out.tsv")
+        self.tagger.tag_file(input_path, expected)
+        stats = self.tagger.tag_files([input_path], [output_path], workers=3)
+
+        self.assertEqual(sum(n_sents for (n_sents, _, _) in stats.values()), 60, "Every sentence should be tagged")
+        with open(expected) as exp, open(output_path) as out:
+            self.assertEqual(out.read(), exp.read(), "Output should be the same whatever the number of workers")
+
+    def test_tag_files_cache(self):
+        """ Check that the cache counters of the workers are summed in the cache of the tagger """
+        input_path = os.path.join(self.directory, "in.tsv")
+        self.write_sentences(input_path, repeat=20)
+        self.tagger.cache = LRUCache(100)
+        self.tagger.tag_file(input_path, os.path.join(self.directory, "expected.tsv"))
+        lookups = self.tagger.cache.hits + self.tagger.cache.misses + self.tagger.cache.deduplicated
+
+        self.tagger.cache = LRUCache(100)
+        self.tagger.tag_files([input_path], [os.path.join(self.directory, "out.tsv")], workers=3)
+        cache = self.tagger.cache
+        self.assertEqual(cache.hits + cache.misses + cache.deduplicated, lookups, "Every lookup should be counted")
+        self.assertGreaterEqual(cache.misses, 5, "Each worker should predict the targets it has not seen")
+        self.assertEqual(len(cache), 0, "Predictions stay in the cache of each worker")
+
+    def test_tag_files_quantized(self):
+        """ Check that workers tag files with a quantized model as a single process does """
+        tagger = Tagger(self.model_path, quantize=True, quantize_embeddings=True)
+        input_path = os.path.join(self.directory, "in.tsv")
+        self.write_sentences(input_path, repeat=20)
+        expected, output_path = os.path.join(self.directory, "expected.tsv"), os.path.join(self.directory, "out.tsv")
+        tagger.tag_file(input_path, expected)
+        tagger.tag_files([input_path], [output_path], workers=2)
+        with open(expected) as exp, open(output_path) as out:
+            self.assertEqual(out.read(), exp.read())
+
+    def test_tag_compressed_files(self):
+        """ Check that compressed files are tagged as their decompressed content, and compressed as their output """
+        input_path = os.path.join(self.directory, "in.tsv")
+        self.write_sentences(input_path, repeat=5)
+        expected = os.path.join(self.directory, "expected.tsv")
+        self.tagger.tag_file(input_path, expected)
+        with open(expected) as f:
+            expected = f.read()
+
+        with open(input_path) as inp, open_file(input_path + ".gz", "w") as out:
+            shutil.copyfileobj(inp, out)
+        output_path = os.path.join(self.directory, "out.tsv.xz")
+        self.assertEqual(self.tagger.tag_file(input_path + ".gz", output_path), (15, 80))
+        with open_file(output_path) as f:
+            self.assertEqual(f.read(), expected)
+
+        self.assertEqual(len(sentence_ranges(input_path + ".gz", 3)), 1, "Compressed files should not be cut")
+        self.tagger.tag_files([input_path + ".gz"], [output_path], workers=2)
+        with open_file(output_path) as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_cache(self):
+        """ Check that cached predictions are the ones of the model and that counters are kept """
+        expected = list(self.tagger.tag(self.sentences * 2, batch_size=1))
+
+        self.tagger.cache = LRUCache(100)
+        self.assertEqual(list(self.tagger.tag(self.sentences * 2, batch_size=1)), expected,
+                         "Cache should not change the output")
+        self.assertEqual(self.tagger.cache.misses, 5, "Each distinct target should be predicted once")
+        self.assertEqual(self.tagger.cache.hits + self.tagger.cache.deduplicated, 5,
+                         "Repeated targets should be read from the cache or deduplicated")
+
+        self.tagger.cache = LRUCache(2)
+        self.assertEqual(list(self.tagger.tag(self.sentences * 2, batch_size=64)), expected,
+                         "Deduplicating targets inside a batch should not change the output")
+        self.assertEqual(self.tagger.cache.deduplicated, 5, "Repeated targets of a batch should be deduplicated")
+        self.assertEqual(self.tagger.cache.evictions, 3, "Cache should be bounded")
+
+    def test_context_window(self):
+        """ Check that the context window of the model is saved and used by the tagger """
+        model = TarteModule(self.tagger.label_encoder, context_window=1)
+        tagger = Tagger(model.save(os.path.join(self.directory, "windowed.tar")))
+        self.assertEqual(tagger.model.context_window, 1, "Context window should be saved with the model")
+
+        sentence = self.sentences[2]
+        self.assertEqual(
+            [(offset, context[0], context[-1]) for offset, context in tagger.sentence_to_contexts(sentence, [2, 3, 5])],
+            [(1, ("se", "en", "estre"), [1]), (2, ("en", "estre", "aler"), [1]), (4, ("aler", "en", "grant"), [1])],
+            "Each target should get its own window"
+        )
+
+        contexts = [context for _, context in tagger.sentence_to_contexts(sentence, [2, 3, 5])]
+        rows = [(lem_lst[1], pos_lst[1], tok_lst[1], lem_lst, pos_lst, tok_lst)
+                for lem_lst, pos_lst, tok_lst, _ in contexts]
+        _, predictions = tagger.model.predict(Dataset._pack_batch(tagger.label_encoder, rows, with_target=False))
+        tagged, = tagger.tag([sentence], batch_size=8)
+        self.assertEqual(
+            [tagged[2], tagged[3], tagged[5]],
+            [Tagger.format_prediction(1, context, prediction, Tagger.formatter)
+             for context, prediction in zip(contexts, predictions)],
+            "Tagger should predict from the windows"
+        )
+
+    def test_routes(self):
+        """ Check that lemma with a single class are assigned without the model """
+        encoder = MultiEncoder()
+        encoder.fit_reader(ReaderWrapper(DefaultSettings, "data/test.tsv"))
+        tagger = Tagger(TarteModule(encoder).save(os.path.join(self.directory, "single.tar")))
+        self.assertEqual(tagger.count_targets(self.sentences), 0, "No token should need the model")
+        self.assertEqual(
+            list(tagger.tag(self.sentences[:1])),
+            [["certes", "je", "estre1", "en1", "grant", "pensé"]]
+        )